@@ -0,0 +1,551 @@
+from math import comb
+
+import numpy as np
+
+TREND_WINDOW = 14
+
+LINEAR_SMOOTHER = 'linear'
+MOVING_AVERAGE_SMOOTHER = 'moving-average'
+EWMA_SMOOTHER = 'ewma'
+SAVITZKY_GOLAY_SMOOTHER = 'savitzky-golay'
+MEDIAN_SMOOTHER = 'median'
+
+# smoothers whose trend sample refers to the last day of its window (the others refer to the mid point)
+CAUSAL_SMOOTHERS = [EWMA_SMOOTHER]
+
+SAVITZKY_GOLAY_DEGREE = 2
+
+
+def trend_offset(window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Trend offset
+
+    Index of the measure sample corresponding to the first trend sample
+
+    Parameters
+    ----------
+    window : int
+        Number of days of the smoother window
+    smoother : str
+        Smoother name, one of SMOOTHERS
+
+    Returns
+    ----------
+    int
+        The trend sample k refers to the measure sample k + offset
+    """
+    if smoother in CAUSAL_SMOOTHERS:
+        return window - 1
+
+    return window // 2
+
+
+def check_window(window, smoother=None):
+    """
+    Check that the smoother window is valid (for the smoother, if provided)
+    """
+    if window < 2:
+        raise ValueError("The trend window must be at least 2 days long")
+
+    if smoother == SAVITZKY_GOLAY_SMOOTHER and window <= SAVITZKY_GOLAY_DEGREE:
+        raise ValueError(f"The trend window of the {smoother} smoother must be longer than the polynomial degree ({SAVITZKY_GOLAY_DEGREE})")
+
+    return
+
+
+def rolling_linear_trend(measure, window=TREND_WINDOW):
+    """
+    Rolling linear trend
+
+    For each window of consecutive days a linear regression is evaluated, and the regression line is sampled at the mid point of the window.
+    Instead of calling polyfit for each window, the least squares solution is computed in closed form from cumulative sums, so that the whole trend is obtained in one pass.
+
+    Parameters
+    ----------
+    measure : array_like
+        Daily measure
+    window : int
+        Number of days of the regression window (default to two weeks)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values, len(measure) - window + 1 samples (empty if there is not enough data).
+        The first sample refers to measure[trend_offset(window)]
+    """
+    measure = np.asarray(measure, dtype=np.float64)
+
+    check_window(window)
+
+    n_trend = len(measure) - window + 1
+    if n_trend <= 0:
+        return np.empty(0)
+
+    # regression abscissa is 0..window-1 for each window
+    x = np.arange(window, dtype=np.float64)
+    x_mean = x.mean()
+    x_var = np.sum((x - x_mean)**2)
+
+    # sum(y) and sum(j*y) for each window, j being the absolute index
+    index = np.arange(len(measure), dtype=np.float64)
+    cumsum_y = np.concatenate(([0.0], np.cumsum(measure)))
+    cumsum_jy = np.concatenate(([0.0], np.cumsum(index*measure)))
+
+    sum_y = cumsum_y[window:] - cumsum_y[:n_trend]
+    sum_jy = cumsum_jy[window:] - cumsum_jy[:n_trend]
+
+    # sum(x*y) with x relative to the window start
+    start = np.arange(n_trend, dtype=np.float64)
+    sum_xy = sum_jy - start*sum_y
+
+    mean_y = sum_y / window
+    slope = (sum_xy - x_mean*sum_y) / x_var
+
+    return mean_y + slope*(trend_offset(window) - x_mean)
+
+
+def rolling_mean(measure, window=TREND_WINDOW):
+    """
+    Rolling mean
+
+    Centred moving average, computed from cumulative sums in one pass
+
+    Parameters
+    ----------
+    measure : array_like
+        Daily measure
+    window : int
+        Number of days of the window
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values (see rolling_linear_trend)
+    """
+    measure = np.asarray(measure, dtype=np.float64)
+
+    check_window(window)
+
+    if len(measure) < window:
+        return np.empty(0)
+
+    cumsum_y = np.concatenate(([0.0], np.cumsum(measure)))
+
+    return (cumsum_y[window:] - cumsum_y[:-window]) / window
+
+
+def exponential_moving_average(measure, window=TREND_WINDOW, previous_value=None):
+    """
+    Exponential moving average
+
+    Each trend sample is updated from the previous one (smoothing factor 2/(window+1)), so the trend can be extended by new samples without evaluating it again.
+    The first window-1 samples are used to initialize the average, so the trend has the same length of the other smoothers
+
+    Parameters
+    ----------
+    measure : array_like
+        Daily measure
+    window : int
+        Number of days of the window
+    previous_value : float
+        Trend value of the day before measure[0], if the trend is being extended (then the initialization is not needed and every measure sample gives a trend sample)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values, the first sample refers to measure[trend_offset(window, EWMA_SMOOTHER)] (to measure[0] if previous_value is provided)
+    """
+    measure = np.asarray(measure, dtype=np.float64)
+
+    check_window(window)
+
+    alpha = 2 / (window + 1)
+
+    if previous_value is None:
+        if len(measure) < window:
+            return np.empty(0)
+
+        # the average starts from the mean of the first days
+        value = measure[:window-1].mean()
+        values = measure[window-1:].tolist()
+
+    else:
+        value = float(previous_value)
+        values = measure.tolist()
+
+    trend = np.empty(len(values))
+
+    for index, measure_value in enumerate(values):
+        value += alpha*(measure_value - value)
+        trend[index] = value
+
+    return trend
+
+
+def rolling_polynomial_trend(measure, window=TREND_WINDOW, degree=SAVITZKY_GOLAY_DEGREE):
+    """
+    Rolling polynomial trend (Savitzky-Golay)
+
+    For each window a polynomial least squares fit is evaluated at the mid point of the window.
+    As for rolling_linear_trend, the moments of each window are obtained from cumulative sums, so the whole trend is evaluated in one pass
+
+    Parameters
+    ----------
+    measure : array_like
+        Daily measure
+    window : int
+        Number of days of the window (must be greater than degree)
+    degree : int
+        Degree of the polynomial
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values (see rolling_linear_trend)
+    """
+    measure = np.asarray(measure, dtype=np.float64)
+
+    check_window(window)
+
+    if window <= degree:
+        raise ValueError("The trend window must be longer than the polynomial degree")
+
+    n_trend = len(measure) - window + 1
+    if n_trend <= 0:
+        return np.empty(0)
+
+    # the fitted value at the evaluation point is a fixed combination of the window moments sum(x**k * y)
+    x = np.arange(window, dtype=np.float64)
+    vandermonde = np.vander(x, degree + 1, increasing=True)
+    moment_weights = np.vander([float(trend_offset(window))], degree + 1, increasing=True)[0] @ np.linalg.inv(vandermonde.T @ vandermonde)
+
+    # indices relative to the centre of the series, to limit the magnitude of the cumulative sums
+    centre = (len(measure) - 1) / 2
+    index = np.arange(len(measure), dtype=np.float64) - centre
+    start = np.arange(n_trend, dtype=np.float64) - centre
+
+    trend = np.zeros(n_trend)
+    window_sums = []
+
+    for power in range(degree + 1):
+        cumsum = np.concatenate(([0.0], np.cumsum(index**power * measure)))
+        window_sums.append(cumsum[window:] - cumsum[:n_trend])
+
+        # sum((j - start)**power * y) from the sums of j**m * y (binomial expansion)
+        moment = sum(comb(power, m) * (-start)**(power - m) * window_sums[m] for m in range(power + 1))
+        trend += moment_weights[power] * moment
+
+    return trend
+
+
+def rolling_median(measure, window=TREND_WINDOW):
+    """
+    Rolling median
+
+    Median of each window, robust to isolated spikes (e.g. data corrections)
+
+    Parameters
+    ----------
+    measure : array_like
+        Daily measure
+    window : int
+        Number of days of the window
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values (see rolling_linear_trend)
+    """
+    measure = np.asarray(measure, dtype=np.float64)
+
+    check_window(window)
+
+    if len(measure) < window:
+        return np.empty(0)
+
+    return np.median(np.lib.stride_tricks.sliding_window_view(measure, window), axis=1)
+
+
+# smoother name -> function evaluating the trend, trend sample k refers to measure sample k + trend_offset(window, smoother)
+SMOOTHERS = {
+    LINEAR_SMOOTHER: rolling_linear_trend,
+    MOVING_AVERAGE_SMOOTHER: rolling_mean,
+    EWMA_SMOOTHER: exponential_moving_average,
+    SAVITZKY_GOLAY_SMOOTHER: rolling_polynomial_trend,
+    MEDIAN_SMOOTHER: rolling_median,
+}
+
+
+def get_trend(measure, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Get trend
+
+    Parameters
+    ----------
+    measure : array_like
+        Daily measure
+    window : int
+        Number of days of the smoother window
+    smoother : str
+        Smoother name, one of SMOOTHERS
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values, len(measure) - window + 1 samples (empty if there is not enough data).
+        The first sample refers to measure[trend_offset(window, smoother)]
+    """
+    return SMOOTHERS[smoother](measure, window)
+
+
+def colour_bands(trend, area_colours):
+    """
+    Colour bands
+
+    Evaluate the boundaries of the coloured areas underneath the trend.
+    Each colour takes a share of the area proportional to its value in area_colours, colours are stacked in AreaColour order (red at the bottom).
+
+    Parameters
+    ----------
+    trend : array_like
+        Trend values
+    area_colours : array_like
+        (len(AreaColour), len(trend)) colour matrix (see area_colour.get_area_colour)
+
+    Returns
+    ----------
+    numpy.ndarray
+        (len(AreaColour), len(trend)) matrix, row i is the upper boundary of the band of the colour with value i+1.
+        The lower boundary of each band is the upper boundary of the previous one (0 for the first band)
+    """
+    return np.cumsum(np.asarray(area_colours)*np.asarray(trend), axis=0)
+
+
+def min_max_downsample(values, n_buckets):
+    """
+    Min/max downsampling
+
+    Split the values into n_buckets buckets of consecutive samples and keep only the minimum and the maximum of each bucket (and the first and last sample), so that the shape of the series, peaks included, is preserved
+
+    Parameters
+    ----------
+    values : array_like
+        Series to downsample
+    n_buckets : int
+        Number of buckets
+
+    Returns
+    ----------
+    numpy.ndarray
+        Sorted indices of the kept samples, at most 2*n_buckets + 2 (every index if the series is not longer than 2*n_buckets)
+    """
+    values = np.asarray(values)
+
+    if len(values) <= 2*n_buckets:
+        return np.arange(len(values))
+
+    bucket_size = -(-len(values)//n_buckets)
+
+    # the last bucket may be shorter, it is padded with its last value
+    buckets = np.concatenate((values, np.full(bucket_size*(-(-len(values)//bucket_size)) - len(values), values[-1]))).reshape(-1, bucket_size)
+    bucket_starts = np.arange(0, len(buckets)*bucket_size, bucket_size)
+
+    indices = np.concatenate(([0, len(values) - 1], bucket_starts + buckets.argmin(axis=1), bucket_starts + buckets.argmax(axis=1)))
+
+    return np.unique(np.minimum(indices, len(values) - 1))
+
+
+def get_first_change(previous_values, values):
+    """
+    Get first change
+
+    Parameters
+    ----------
+    previous_values : array_like
+        Previous version of the series
+    values : array_like
+        Actual version of the series
+
+    Returns
+    ----------
+    int
+        Index of the first element that differs between the two versions (the length of the shortest one if one is the beginning of the other)
+    """
+    previous_values = np.asarray(previous_values)
+    values = np.asarray(values)
+
+    n_common = min(len(previous_values), len(values))
+    changed = np.flatnonzero(previous_values[:n_common] != values[:n_common])
+
+    return changed[0] if len(changed) > 0 else n_common
+
+
+def update_trend(previous_trend, first_change, measure, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Update trend
+
+    Only the trend samples whose window contains changed or new measure samples are evaluated, the others are taken from the previous trend.
+    The exponential moving average is extended from the last unchanged trend sample
+
+    Parameters
+    ----------
+    previous_trend : array_like
+        Trend of the previous version of the measure
+    first_change : int
+        Index of the first measure sample that changed (see get_first_change)
+    measure : array_like
+        Actual version of the measure
+    window : int
+        Number of days of the smoother window (must be the one of previous_trend)
+    smoother : str
+        Smoother name, one of SMOOTHERS (must be the one of previous_trend)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend of the actual measure (see get_trend)
+    int
+        Number of trend samples taken from the previous trend
+    """
+    previous_trend = np.asarray(previous_trend, dtype=np.float64)
+    measure = np.asarray(measure)
+
+    # trend sample k depends on measure samples k..k+window-1 (and, for the exponential moving average, on the previous ones)
+    n_unchanged = int(np.clip(first_change - window + 1, 0, len(previous_trend)))
+
+    if smoother == EWMA_SMOOTHER and n_unchanged > 0:
+        new_trend = exponential_moving_average(measure[n_unchanged+window-1:], window, previous_trend[n_unchanged-1])
+    else:
+        new_trend = get_trend(measure[n_unchanged:], window, smoother)
+
+    return np.concatenate((previous_trend[:n_unchanged], new_trend)), n_unchanged
+
+
+MAX_TEST_DELAY = 5
+
+FEASIBLE_CRITERION = 'feasible'
+CROSS_CORRELATION_CRITERION = 'xcorr'
+TEST_DELAY_CRITERIA = [FEASIBLE_CRITERION, CROSS_CORRELATION_CRITERION]
+
+
+def get_delayed_ratios(numerator, denominator, max_lag):
+    """
+    Delayed ratios
+
+    Evaluate numerator[t]/denominator[t-lag] for every lag in 1..max_lag at once
+
+    Parameters
+    ----------
+    numerator : array_like
+        Numerator series
+    denominator : array_like
+        Denominator series, same length of numerator
+    max_lag : int
+        Maximum lag
+
+    Returns
+    ----------
+    numpy.ndarray
+        (max_lag, len(numerator)) matrix, row lag-1 contains the ratios for that lag (NaN for the first lag samples)
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+
+    # row k of the windows is the denominator delayed by max_lag-k samples
+    padded_denominator = np.concatenate((np.full(max_lag, np.nan), denominator))
+    delayed_denominators = np.lib.stride_tricks.sliding_window_view(padded_denominator, len(denominator))[max_lag-1::-1]
+
+    return numerator/delayed_denominators
+
+
+def get_cross_correlation(series, delayed_series, max_lag):
+    """
+    Cross-correlation
+
+    Normalized cross-correlation between series[t] and delayed_series[t-lag] for every lag in 0..max_lag, computed via FFT
+
+    Returns
+    ----------
+    numpy.ndarray
+        max_lag+1 values, element lag is the correlation for that lag (between -1 and 1)
+    """
+    series = np.asarray(series, dtype=np.float64)
+    delayed_series = np.asarray(delayed_series, dtype=np.float64)
+
+    series = (series - series.mean())/(series.std() or 1)
+    delayed_series = (delayed_series - delayed_series.mean())/(delayed_series.std() or 1)
+
+    # zero padding avoids circular correlation
+    n_fft = 2*len(series)
+    cross_correlation = np.fft.irfft(np.fft.rfft(series, n_fft)*np.conj(np.fft.rfft(delayed_series, n_fft)), n_fft)[:max_lag+1]
+
+    # normalize by the number of overlapping samples of each lag
+    return cross_correlation/(len(series) - np.arange(max_lag+1))
+
+
+def estimate_test_delay(variation_positives, variation_n_tests, max_lag=MAX_TEST_DELAY, criterion=FEASIBLE_CRITERION):
+    """
+    Estimate test delay
+
+    Estimate the number of days to wait before the test result, so that the number of positives best matches the number of tests.
+    Every lag in 1..max_lag is evaluated at once
+
+    Parameters
+    ----------
+    variation_positives : array_like
+        Daily variation of positives
+    variation_n_tests : array_like
+        Daily variation of tests (must not contain zeros)
+    max_lag : int
+        Maximum number of days (at least 1)
+    criterion : str
+        FEASIBLE_CRITERION: the lowest lag for which no ratio is greater than 1 (1 if there is no such lag)
+        CROSS_CORRELATION_CRITERION: the lag with the highest cross-correlation between positives and tests
+
+    Returns
+    ----------
+    dict
+        "lag": estimated lag
+        "ratio": positives/tests ratio for the estimated lag (first sample refers to variation_positives[lag])
+        "lags": evaluated lags
+        "n_impossible_ratios": number of ratios greater than 1 for each lag
+        "cross_correlation": cross-correlation for each lag
+        "is_feasible": True if no ratio is greater than 1 for the estimated lag
+    """
+    if max_lag < 1:
+        raise ValueError("The maximum test delay must be at least 1 day")
+
+    # too short series (e.g. a newly added area): no lag can be evaluated, lag 1 is assumed
+    if len(variation_positives) < 2:
+        return {
+            "lag": 1,
+            "ratio": np.asarray(variation_positives[1:], dtype=np.float64)/np.asarray(variation_n_tests[:-1]),
+            "lags": np.empty(0, dtype=np.int64),
+            "n_impossible_ratios": np.empty(0, dtype=np.int64),
+            "cross_correlation": np.empty(0),
+            "is_feasible": True,
+        }
+
+    max_lag = min(max_lag, len(variation_positives) - 1)
+    lags = np.arange(1, max_lag+1)
+
+    ratios = get_delayed_ratios(variation_positives, variation_n_tests, max_lag)
+    n_impossible_ratios = np.count_nonzero(ratios > 1, axis=1)
+    cross_correlation = get_cross_correlation(variation_positives, variation_n_tests, max_lag)[1:]
+
+    if criterion == CROSS_CORRELATION_CRITERION:
+        lag = lags[np.argmax(cross_correlation)]
+
+    else:
+        feasible_lags = lags[n_impossible_ratios == 0]
+        lag = feasible_lags[0] if len(feasible_lags) > 0 else 1
+
+    return {
+        "lag": int(lag),
+        "ratio": ratios[lag-1, lag:],
+        "lags": lags,
+        "n_impossible_ratios": n_impossible_ratios,
+        "cross_correlation": cross_correlation,
+        "is_feasible": bool(n_impossible_ratios[lag-1] == 0),
+    }
+
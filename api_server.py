@@ -0,0 +1,508 @@
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import time
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import numpy as np
+
+from area_colour import get_area_colour, AreaColour
+from dpc_data import load_national_data, load_regional_data, get_data_commit, get_area_names, MEASURE_FIELDS, REGIONAL_DATASET, JSON_SOURCE, SOURCES
+from analysis import check_window, TREND_WINDOW, LINEAR_SMOOTHER, SMOOTHERS
+import make_graphs
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_REFRESH_INTERVAL = 60
+
+NATIONAL_AREA = 'Italia'
+
+RAW_KIND = 'raw'
+DIFF_KIND = 'diff'
+TREND_KIND = 'trend'
+
+JSON_FORMAT = 'json'
+BINARY_FORMAT = 'binary'
+FORMATS = [JSON_FORMAT, BINARY_FORMAT]
+
+CONTENT_TYPES = {
+    JSON_FORMAT: 'application/json',
+    BINARY_FORMAT: 'application/octet-stream',
+}
+
+STATUS_REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+}
+
+MAX_HEADER_LINES = 100
+# larger request bodies are not read, the connection is closed instead
+MAX_REQUEST_BODY_SIZE = 1 << 16
+
+
+def get_area_series(columns, figures_data, area_colours):
+    """
+    Get the series of an area
+
+    Parameters
+    ----------
+    columns : dict
+        Loaded data of the area (see dpc_data.load_national_data)
+    figures_data : list
+        Figure data of the area (see make_graphs.compute_all_measures)
+    area_colours : numpy.ndarray
+        Colour matrix of the area (see area_colour.get_area_colour)
+
+    Returns
+    ----------
+    dict
+        "series": for each measure and kind, the dates and the values
+        "colours": dates and colour fractions
+    """
+    dates = np.asarray(columns["dates"], dtype='datetime64[D]')
+    series = {}
+
+    for measure in MEASURE_FIELDS.keys():
+        series[(measure, RAW_KIND)] = (dates, np.asarray(columns[measure], dtype=np.float64))
+
+    for figure_data in figures_data:
+        series[(figure_data["name"], DIFF_KIND)] = (figure_data["dates"], np.asarray(figure_data["measure"], dtype=np.float64))
+
+        if figure_data["trend"] is not None:
+            offset = figure_data["trend_offset"]
+            series[(figure_data["name"], TREND_KIND)] = (figure_data["dates"][offset:offset+len(figure_data["trend"])], figure_data["trend"])
+
+    return {"series": series, "colours": (dates, area_colours)}
+
+
+def compute_api_data(source=JSON_SOURCE, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute the data served by the API
+
+    Load and derive national data and the data of every region
+
+    Returns
+    ----------
+    dict
+        "commit": commit of the data
+        "areas": for each area, the series of the area (see get_area_series)
+    """
+    commit = get_data_commit()
+    areas = {}
+
+    national_data = load_national_data(source=source)
+    area_colours = get_area_colour(national_data["dates"], as_matrix=True)
+    figures_data = make_graphs.compute_all_measures(**national_data, area_colours=area_colours, area_name=NATIONAL_AREA, incremental=True, window=window, smoother=smoother)
+    areas[NATIONAL_AREA] = get_area_series(national_data, figures_data, area_colours)
+
+    region_list = get_area_names(REGIONAL_DATASET, source=source)
+
+    for region, regional_data in load_regional_data(region_list, source=source).items():
+        area_colours = get_area_colour(regional_data["dates"], region, as_matrix=True)
+        figures_data = make_graphs.compute_all_measures(**regional_data, area_colours=area_colours, area_name=region, incremental=True, window=window, smoother=smoother)
+        areas[region] = get_area_series(regional_data, figures_data, area_colours)
+
+    return {"commit": commit, "areas": areas}
+
+
+def encode_json(content):
+    """
+    Encode a JSON body
+    """
+    return json.dumps(content, separators=(',', ':')).encode()
+
+
+def encode_series(dates, values, response_format, content):
+    """
+    Encode a series
+
+    Parameters
+    ----------
+    dates : numpy.ndarray
+        Dates of the series
+    values : numpy.ndarray
+        Values (one row for each series if two-dimensional)
+    response_format : str
+        One of FORMATS
+    content : dict
+        Other fields of the JSON body
+
+    Returns
+    ----------
+    bytes
+        Body: JSON object, or little-endian float32 values (rows one after the other)
+    dict
+        Additional headers (first date and shape of binary bodies)
+    """
+    if response_format == BINARY_FORMAT:
+        headers = {
+            "X-First-Date": str(dates[0]) if len(dates) > 0 else '',
+            "X-Shape": ','.join(str(length) for length in values.shape),
+        }
+        return np.ascontiguousarray(values, dtype='<f4').tobytes(), headers
+
+    content["dates"] = np.datetime_as_string(dates).tolist()
+    # NaN values are encoded as null
+    content["values"] = np.where(np.isnan(values), None, values).tolist()
+
+    return encode_json(content), {}
+
+
+def slice_dates(dates, query):
+    """
+    Get the slice of the dates between the start and end (included) query parameters
+    """
+    start = np.searchsorted(dates, np.datetime64(query["start"], 'D'), side='left') if "start" in query else 0
+    end = np.searchsorted(dates, np.datetime64(query["end"], 'D'), side='right') if "end" in query else len(dates)
+
+    return slice(start, max(start, end))
+
+
+def build_response(api_data, path, query):
+    """
+    Build the response to a request
+
+    Endpoints:
+        /areas: data commit, list of areas and series kinds available for each measure
+        /series/<area>/<measure>/<kind>: raw, diff or trend series of the measure of the area
+        /colours/<area>: fraction of regions of each colour (one-hot for a region) for each day
+    Series and colours accept the start, end (ISO dates, included) and format (json or binary) query parameters
+
+    Parameters
+    ----------
+    api_data : dict
+        Data served by the API (see compute_api_data)
+    path : str
+        Request path
+    query : dict
+        Query parameters (last value of each parameter)
+
+    Returns
+    ----------
+    int
+        Status code
+    bytes
+        Body
+    str
+        Content type
+    dict
+        Additional headers
+    """
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+    response_format = query.get("format", JSON_FORMAT)
+
+    if response_format not in FORMATS:
+        return 400, encode_json({"error": "Unknown format: " + response_format}), CONTENT_TYPES[JSON_FORMAT], {}
+
+    try:
+        if parts == ['areas']:
+            # kinds available for each measure
+            measures = {}
+            for area_data in api_data["areas"].values():
+                for measure, kind in area_data["series"].keys():
+                    measures.setdefault(measure, [])
+                    if kind not in measures[measure]:
+                        measures[measure].append(kind)
+
+            content = {
+                "commit": api_data["commit"],
+                "areas": list(api_data["areas"].keys()),
+                "measures": measures,
+            }
+            return 200, encode_json(content), CONTENT_TYPES[JSON_FORMAT], {}
+
+        if len(parts) == 4 and parts[0] == 'series':
+            area, measure, kind = parts[1:]
+
+            if area not in api_data["areas"] or (measure, kind) not in api_data["areas"][area]["series"]:
+                return 404, encode_json({"error": "No " + kind + " series of " + measure + " for " + area}), CONTENT_TYPES[JSON_FORMAT], {}
+
+            dates, values = api_data["areas"][area]["series"][(measure, kind)]
+            selection = slice_dates(dates, query)
+
+            body, headers = encode_series(dates[selection], values[selection], response_format, {"area": area, "measure": measure, "kind": kind})
+            return 200, body, CONTENT_TYPES[response_format], headers
+
+        if len(parts) == 2 and parts[0] == 'colours':
+            area = parts[1]
+
+            if area not in api_data["areas"]:
+                return 404, encode_json({"error": "The area " + area + " hasn't been found"}), CONTENT_TYPES[JSON_FORMAT], {}
+
+            dates, area_colours = api_data["areas"][area]["colours"]
+            selection = slice_dates(dates, query)
+
+            body, headers = encode_series(dates[selection], area_colours[:, selection], response_format, {"area": area, "colours": [colour.name for colour in AreaColour]})
+            return 200, body, CONTENT_TYPES[response_format], headers
+
+    except ValueError as error:
+        # invalid dates
+        return 400, encode_json({"error": str(error)}), CONTENT_TYPES[JSON_FORMAT], {}
+
+    return 404, encode_json({"error": "Unknown endpoint: " + path}), CONTENT_TYPES[JSON_FORMAT], {}
+
+
+def is_etag_matched(if_none_match, etag):
+    """
+    Check if the ETag matches an If-None-Match header
+
+    The header can be "*" or a comma-separated list of ETags, weak ones (W/ prefix) included: If-None-Match uses the weak comparison
+
+    Parameters
+    ----------
+    if_none_match : str
+        Value of the If-None-Match header (None if missing)
+    etag : str
+        ETag of the response
+
+    Returns
+    ----------
+    bool
+        True if the ETag matches
+    """
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    return any(tag.strip().removeprefix('W/') == etag.removeprefix('W/') for tag in if_none_match.split(','))
+
+
+class ApiServer:
+    """
+    API server class
+
+    This class serves the precomputed data over HTTP/1.1 (keep-alive, GET and HEAD only).
+    Encoded responses are kept in an LRU cache keyed by data commit and request, each with an ETag, so repeated and conditional requests don't encode anything
+    """
+    def __init__(self, api_data, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        api_data : dict
+            Data served by the API (see compute_api_data)
+        cache_size : int
+            Maximum number of cached responses
+        """
+        self.api_data = api_data
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+        self.n_requests = 0
+        self.n_cache_hits = 0
+
+    def get_response(self, target):
+        """
+        Get the response to a request target (path and query), from the cache if available
+
+        Returns
+        ----------
+        tuple
+            Status code, body, content type, additional headers and ETag (see build_response)
+        """
+        key = (self.api_data["commit"], target)
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.n_cache_hits += 1
+            return self.cache[key]
+
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        status, body, content_type, headers = build_response(self.api_data, url.path, query)
+
+        # the ETag depends on the data commit and the body
+        etag = '"' + hashlib.sha1(str(self.api_data["commit"]).encode() + body).hexdigest()[:20] + '"'
+        response = (status, body, content_type, headers, etag)
+
+        self.cache[key] = response
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return response
+
+    def warm_up(self):
+        """
+        Fill the cache with the JSON and binary response of every series and colour endpoint (whole period)
+
+        Returns
+        ----------
+        int
+            Number of cached responses
+        """
+        targets = ['/areas']
+
+        for area, area_data in self.api_data["areas"].items():
+            for response_format in FORMATS:
+                targets += ['/series/' + quote(area) + '/' + measure + '/' + kind + '?format=' + response_format for measure, kind in area_data["series"].keys()]
+                targets.append('/colours/' + quote(area) + '?format=' + response_format)
+
+        for target in targets[:self.cache_size]:
+            self.get_response(target)
+
+        return min(len(targets), self.cache_size)
+
+    def set_api_data(self, api_data):
+        """
+        Serve new data, responses of the previous commit are evicted as they become the least recently used
+        """
+        self.api_data = api_data
+
+        return
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve the requests of a connection
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                request_headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    header_line = await reader.readline()
+                    if header_line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header_line.decode('latin-1').partition(':')
+                    request_headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+
+                self.n_requests += 1
+
+                # read the request body, if any, so that the next request starts where it ends
+                keep_alive = version == 'HTTP/1.1' and request_headers.get('connection', '').lower() != 'close'
+
+                try:
+                    body_size = int(request_headers.get('content-length', 0))
+                except ValueError:
+                    body_size = -1
+
+                if 'transfer-encoding' in request_headers or not 0 <= body_size <= MAX_REQUEST_BODY_SIZE:
+                    keep_alive = False
+                elif body_size > 0:
+                    await reader.readexactly(body_size)
+
+                if method not in ('GET', 'HEAD'):
+                    status, body, content_type, headers, etag = 405, encode_json({"error": "Only GET and HEAD are supported"}), CONTENT_TYPES[JSON_FORMAT], {}, None
+                else:
+                    status, body, content_type, headers, etag = self.get_response(target)
+
+                if status == 200 and etag is not None and is_etag_matched(request_headers.get('if-none-match'), etag):
+                    status, body = 304, b''
+
+                response_headers = {
+                    "Content-Type": content_type,
+                    "Content-Length": str(len(body)),
+                    "Connection": 'keep-alive' if keep_alive else 'close',
+                    **headers,
+                }
+                if etag is not None and status in (200, 304):
+                    response_headers["ETag"] = etag
+                    response_headers["Cache-Control"] = 'no-cache'
+
+                writer.write(('HTTP/1.1 ' + str(status) + ' ' + STATUS_REASONS[status] + '\r\n'
+                              + ''.join(name + ': ' + value + '\r\n' for name, value in response_headers.items())
+                              + '\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def refresh(self, interval, compute):
+        """
+        Check the data commit every interval seconds, the data is computed again (in a thread, while the previous data is still served) when it changes
+
+        Parameters
+        ----------
+        interval : float
+            Time between checks [s]
+        compute : callable
+            Function computing the data served by the API (see compute_api_data)
+        """
+        while True:
+            await asyncio.sleep(interval)
+
+            if get_data_commit() == self.api_data["commit"]:
+                continue
+
+            start_time = time.perf_counter()
+            self.set_api_data(await asyncio.to_thread(compute))
+            n_responses = self.warm_up()
+
+            print(f"Data of commit {str(self.api_data['commit'])[:7]} computed in {time.perf_counter() - start_time:.3f} s, {n_responses} responses cached")
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, source=JSON_SOURCE, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER, cache_size=DEFAULT_CACHE_SIZE, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+    """
+    Compute the data, then serve it until interrupted
+    """
+    def compute():
+        return compute_api_data(source, window, smoother)
+
+    start_time = time.perf_counter()
+
+    api_server = ApiServer(compute(), cache_size)
+    n_responses = api_server.warm_up()
+
+    print(f"Data of commit {str(api_server.api_data['commit'])[:7]} computed in {time.perf_counter() - start_time:.3f} s, {n_responses} responses cached")
+
+    server = await asyncio.start_server(api_server.handle_connection, host, port)
+
+    print(f"Serving on http://{host}:{port}/areas")
+
+    async with server:
+        if refresh_interval > 0:
+            await asyncio.gather(server.serve_forever(), api_server.refresh(refresh_interval, compute))
+        else:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Serve Italian COVID-19 series, trends and colours over HTTP')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on (default to %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default to %(default)s)')
+    parser.add_argument('--source', choices=SOURCES, default=JSON_SOURCE, help='format of the data files to parse (default to %(default)s)')
+    parser.add_argument('--smoother', choices=SMOOTHERS.keys(), default=LINEAR_SMOOTHER, help='smoother used to evaluate the trend (default to %(default)s)')
+    parser.add_argument('--trend-window', type=int, default=TREND_WINDOW, help='number of days of the trend window (default to %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='maximum number of cached responses (default to %(default)s)')
+    parser.add_argument('--refresh', type=float, default=DEFAULT_REFRESH_INTERVAL, help='seconds between checks for new local data, 0 to disable (default to %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        check_window(args.trend_window, args.smoother)
+    except ValueError as error:
+        parser.error("--trend-window: " + str(error))
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.source, args.trend_window, args.smoother, args.cache_size, args.refresh))
+    except KeyboardInterrupt:
+        print("Server stopped")
+
+    exit(0)
@@ -1,8 +1,12 @@
-
 import csv
+import os
 from datetime import datetime, timedelta
 from enum import Enum
 
+import numpy as np
+
+AREA_COLOUR_FILE_PATH = 'area_colour.csv'
+
 ALL_AREAS = ["Abruzzo", "Basilicata", "Calabria", "Campania", "Lombardia", "Piemonte", "P.A. Bolzano", "Toscana", "Valle d'Aosta", "Emilia-Romagna",  "Friuli Venezia Giulia", "Lazio", "Liguria", "Marche", "Molise", "P.A. Trento", "Puglia", "Sardegna", "Sicilia", "Umbria", "Veneto"]
 
 
@@ -67,44 +71,6 @@ class ColourPeriod:
         """
         self.end_date = next_period_start_date - timedelta(1)
     
-    def contains_duplicates(self):
-        """
-        Check if more than one colour is assigned to a single area
-
-        Returns
-        ----------
-        True if more than one colour is assigned to a area
-        False otherwise 
-        """
-        all_areas = self.red_areas + self.orange_areas + self.yellow_areas + self.white_areas
-
-        if len(all_areas) == len(set(all_areas)):
-            return False
-        else:
-            print(len(all_areas))
-            print(len(set(all_areas)))
-            print(all_areas)
-            print(set(all_areas))
-            return True
-
-    def every_area_has_colour_assigned(self):
-        """
-        Check if all the areas have been assigned to a colour
-
-        Returns
-        ----------
-        True if all the area has been assigned to a colour
-        False otherwise 
-        """
-        areas_assigned_to_colour = self.red_areas + self.orange_areas + self.yellow_areas + self.white_areas
-
-        for area in ALL_AREAS:
-            if area not in areas_assigned_to_colour:
-                print("No colour has been assigned to " + area)
-                return False
-
-        return True
-    
     def is_date_before_start(self, date):
         """
         Check if the date is before start date of the period
@@ -207,115 +173,393 @@ class ColourPeriod:
         else:
             return AreaColour.NONE
 
-def load_data():
+# colour of each column of the area colour file
+FILE_COLOURS = [AreaColour.RED, AreaColour.ORANGE, AreaColour.YELLOW, AreaColour.WHITE]
+
+COMPILED_FILE_EXTENSION = '.npz'
+
+
+def compile_data(file_path=AREA_COLOUR_FILE_PATH):
+    """
+    Compile data
+
+    Internal function to convert the file content to compact arrays
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the area colour file
+
+    Returns
+    -------
+    dict
+        "start_dates": start date of each period (datetime64[D], in file order)
+        "colours": (periods, len(ALL_AREAS)) uint8 matrix, AreaColour value assigned to each area (AreaColour.NONE if no colour is assigned)
+        "n_assignments": (periods, len(ALL_AREAS)) uint8 matrix, number of colours assigned to each area
+        "unknown_area_periods", "unknown_areas": period index and name of each area that is not in ALL_AREAS
+    """
+    area_columns = {area: column for column, area in enumerate(ALL_AREAS)}
+
+    start_dates = []
+    colours = []
+    n_assignments = []
+    unknown_area_periods = []
+    unknown_areas = []
+
+    with open(file_path) as csv_file:
+        file_content = csv.reader(csv_file, delimiter=',')
+
+        # skip header
+        next(file_content, None)
+
+        for row in file_content:
+
+            if not row:
+                continue
+
+            period_colours = np.full(len(ALL_AREAS), AreaColour.NONE.value, dtype=np.uint8)
+            period_n_assignments = np.zeros(len(ALL_AREAS), dtype=np.uint8)
+
+            # retrieve data from row
+            for colour, areas in zip(FILE_COLOURS, row[1:1+len(FILE_COLOURS)]):
+                for area in filter(None, areas.split(', ')):
+                    if area in area_columns:
+                        period_colours[area_columns[area]] = colour.value
+                        period_n_assignments[area_columns[area]] += 1
+                    else:
+                        unknown_area_periods.append(len(start_dates))
+                        unknown_areas.append(area)
+
+            start_dates.append(row[0][:10])
+            colours.append(period_colours)
+            n_assignments.append(period_n_assignments)
+
+    return {
+        "start_dates": np.array(start_dates, dtype='datetime64[D]'),
+        "colours": np.array(colours, dtype=np.uint8).reshape(-1, len(ALL_AREAS)),
+        "n_assignments": np.array(n_assignments, dtype=np.uint8).reshape(-1, len(ALL_AREAS)),
+        "unknown_area_periods": np.array(unknown_area_periods, dtype=np.int64),
+        "unknown_areas": np.array(unknown_areas, dtype=str),
+    }
+
+
+def get_compiled_data(file_path=AREA_COLOUR_FILE_PATH):
+    """
+    Get compiled data
+
+    The compiled data is cached in a file next to the area colour file, the file is compiled again only when it has been modified
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the area colour file
+
+    Returns
+    -------
+    dict
+        Compiled data (see compile_data)
+    """
+    file_stat = os.stat(file_path)
+    file_version = np.array([file_stat.st_mtime_ns, file_stat.st_size], dtype=np.int64)
+    compiled_file_path = os.path.splitext(file_path)[0] + COMPILED_FILE_EXTENSION
+
+    try:
+        with np.load(compiled_file_path) as compiled_file:
+            if np.array_equal(compiled_file["file_version"], file_version):
+                return {key: compiled_file[key] for key in compiled_file.files if key != "file_version"}
+    except Exception:
+        # missing, outdated or corrupted (e.g. truncated) compiled file
+        pass
+
+    compiled_data = compile_data(file_path)
+
+    # the compiled file is replaced at once, so an interrupted save leaves the previous file
+    temporary_file_path = compiled_file_path + '.tmp' + COMPILED_FILE_EXTENSION
+
+    try:
+        np.savez(temporary_file_path, file_version=file_version, **compiled_data)
+        os.replace(temporary_file_path, compiled_file_path)
+    except OSError:
+        # the cache is optional
+        pass
+
+    return compiled_data
+
+
+def load_data(file_path=AREA_COLOUR_FILE_PATH):
     """
     Load data from file
 
-    Internal function to convert the file content to Python structures
+    Generate the colour periods from the compiled data
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the area colour file
 
     Returns
     -------
     list
-        list of ColourPeriod instances
+        list of ColourPeriod instances (sorted by start date)
     """
-    loaded_data = []
+    return get_colour_index(file_path).get_colour_periods()
 
-    with open('area_colour.csv') as csv_file:
-        file_content = csv.reader(csv_file, delimiter=',')
 
-        for row_index, row in enumerate(file_content):
+class ColourIndex:
+    """
+    Colour index class
+
+    This class contains the colour data of every period compiled into arrays, so that the colours of many dates and areas can be looked up at once
+    """
+    def __init__(self, compiled_data):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        compiled_data : dict
+            Compiled area colour file (see compile_data)
+        """
+        # periods are sorted by start date, each one ends the day before the next one starts (the last one is open-ended, so that the index stays valid for days to come)
+        order = np.argsort(compiled_data["start_dates"], kind='stable')
+
+        self.start_dates = compiled_data["start_dates"][order]
+        self.area_columns = {area: column for column, area in enumerate(ALL_AREAS)}
+
+        # colour value for each period and area
+        self.colours = np.ascontiguousarray(compiled_data["colours"][order], dtype=np.uint8)
+
+        # percentage of areas of each colour for each period
+        self.colour_fractions = np.zeros((len(self.start_dates), len(AreaColour)))
+        for colour in AreaColour:
+            if colour is not AreaColour.NONE:
+                self.colour_fractions[:, colour.value-1] = np.count_nonzero(self.colours == colour.value, axis=1)/len(ALL_AREAS)
+
+    def get_colour_periods(self):
+        """
+        Get the colour periods
+
+        Returns
+        ----------
+        list
+            list of ColourPeriod instances, generated from the colour matrix (the last one ends today)
+        """
+        colour_periods = []
+        end_dates = np.append(self.start_dates[1:] - np.timedelta64(1, 'D'), np.datetime64(datetime.now().date(), 'D'))[:len(self.start_dates)]
 
-            if row_index > 0:
+        for start_date, end_date, period_colours in zip(self.start_dates.tolist(), end_dates.tolist(), self.colours):
+            areas = {colour: [area for area, area_colour in zip(ALL_AREAS, period_colours) if area_colour == colour.value] for colour in FILE_COLOURS}
 
-                # retrieve data from row
-                red_areas = list(filter(None, row[1].split(', ')))
-                orange_areas = list(filter(None, row[2].split(', ')))
-                yellow_areas = list(filter(None, row[3].split(', ')))
-                white_areas = list(filter(None, row[4].split(', ')))
+            colour_periods.append(ColourPeriod(start_date=start_date,
+                                               end_date=end_date,
+                                               red_areas=areas[AreaColour.RED],
+                                               orange_areas=areas[AreaColour.ORANGE],
+                                               yellow_areas=areas[AreaColour.YELLOW],
+                                               white_areas=areas[AreaColour.WHITE]))
 
-                start_date = datetime.fromisoformat(row[0]).date()
+        return colour_periods
+
+    def get_period_indices(self, dates):
+        """
+        Get the index of the colour period containing each date
+
+        Parameters
+        ----------
+        dates : array_like of Date
+            Input dates
+
+        Returns
+        ----------
+        numpy.ndarray
+            Period index for each date
+        numpy.ndarray
+            True for each date contained in a period, False otherwise (its period index shall be ignored)
+        """
+        days = np.asarray(dates, dtype='datetime64[D]')
 
-                # define a new colour period
-                loaded_data.append(ColourPeriod(start_date=start_date,
-                                               red_areas=red_areas,
-                                               orange_areas=orange_areas,
-                                               yellow_areas=yellow_areas,
-                                               white_areas=white_areas))
-                
-                # update end date for previous colour period
-                if len(loaded_data) > 1:
-                    loaded_data[-2].set_end_date(start_date)
+        period_indices = np.searchsorted(self.start_dates, days, side='right') - 1
+        period_indices = np.clip(period_indices, 0, max(len(self.start_dates)-1, 0))
 
-    return loaded_data
+        if len(self.start_dates) == 0:
+            return period_indices, np.zeros(days.shape, dtype=bool)
 
+        # each period ends where the next one starts, the last one is open-ended
+        is_valid = days >= self.start_dates[period_indices]
 
-def validate_data():
+        return period_indices, is_valid
+
+    def get_colours(self, dates, areas=ALL_AREAS):
+        """
+        Get the colour of each area for each date
+
+        Parameters
+        ----------
+        dates : array_like of Date
+            Input dates
+        areas : list of str
+            Desired areas (default to all)
+
+        Returns
+        ----------
+        numpy.ndarray
+            (len(dates), len(areas)) matrix of AreaColour values.
+            AreaColour.NONE is set if the date is not contained in any period or the area hasn't been found
+        """
+        period_indices, is_valid = self.get_period_indices(dates)
+
+        colours = np.full((len(period_indices), len(areas)), AreaColour.NONE.value, dtype=np.uint8)
+
+        for area_index, area in enumerate(areas):
+            if area not in self.area_columns:
+                print(f"The area {area} hasn't been found")
+                continue
+
+            colours[is_valid, area_index] = self.colours[period_indices[is_valid], self.area_columns[area]]
+
+        return colours
+
+    def get_colour_matrix(self, dates, area=None):
+        """
+        Get the colour matrix for the given area
+
+        Parameters
+        ----------
+        dates : array_like of Date
+            Input dates
+        area : str
+            Desired area (default to all)
+
+        Returns
+        ----------
+        numpy.ndarray
+            (len(AreaColour), len(dates)) matrix, see get_area_colour
+        """
+        if area is not None:
+            colours = self.get_colours(dates, [area])[:, 0]
+            return (np.arange(1, len(AreaColour)+1)[:, np.newaxis] == colours).astype(np.float64)
+
+        period_indices, is_valid = self.get_period_indices(dates)
+
+        colour_matrix = np.zeros((len(AreaColour), len(period_indices)))
+        colour_matrix[AreaColour.NONE.value-1] = 1
+
+        if len(self.colour_fractions) > 0:
+            colour_matrix[:, is_valid] = self.colour_fractions[period_indices[is_valid]].T
+
+        return colour_matrix
+
+
+# compiled colour index for each file path: (file modification time, ColourIndex)
+_colour_indices = {}
+
+
+def get_colour_index(file_path=AREA_COLOUR_FILE_PATH):
+    """
+    Get the colour index
+
+    The file is loaded and compiled only once, a new index is built only when the file has been modified
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the area colour file
+
+    Returns
+    ----------
+    ColourIndex
+        Colour index of the file
+    """
+    modification_time = os.stat(file_path).st_mtime_ns
+
+    if file_path not in _colour_indices or _colour_indices[file_path][0] != modification_time:
+        _colour_indices[file_path] = (modification_time, ColourIndex(get_compiled_data(file_path)))
+
+    return _colour_indices[file_path][1]
+
+
+def validate_data(file_path=AREA_COLOUR_FILE_PATH):
     """
     Validate data
     
     Checks that the file content is consistent and does not contain errors (such as duplicates, ...).
+    Every period is checked at once on the compiled data: duplicated or missing colours, unknown area names and periods that are not in chronological order.
 
     This is needed since the file that contains the colour information of the area has been created and updated manually, thus an automated check is needed.
     Once the area colour could be retrieved from the Civil Protection Department repository, then this function might be helpful to find any errors in their files.
     Hopefully the automatic retrieval from Civil Protection Department repository would be available soon!
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the area colour file
+
+    Returns
+    ----------
+    True if the file does not contain errors
+    False otherwise
     """
-    area_colour_data = load_data()
+    compiled_data = get_compiled_data(file_path)
+    start_dates = compiled_data["start_dates"]
+    n_assignments = compiled_data["n_assignments"]
 
     all_data_is_ok = True
 
-    for period in area_colour_data:
+    for period_index, area_index in zip(*np.nonzero(n_assignments > 1)):
+        print("More than one colour is assigned to " + ALL_AREAS[area_index] + " in the period starting on " + str(start_dates[period_index]))
+        all_data_is_ok = False
 
-        there_is_some_error = False
+    for period_index, area_index in zip(*np.nonzero(n_assignments == 0)):
+        print("No colour has been assigned to " + ALL_AREAS[area_index] + " in the period starting on " + str(start_dates[period_index]))
+        all_data_is_ok = False
 
-        if period.contains_duplicates():
-            print("The following colour period has more than one colour assigned to a area")
-            there_is_some_error = True
+    for period_index, area in zip(compiled_data["unknown_area_periods"], compiled_data["unknown_areas"]):
+        print("The area " + str(area) + " in the period starting on " + str(start_dates[period_index]) + " is unknown")
+        all_data_is_ok = False
 
-        if not period.every_area_has_colour_assigned():
-            print("Not all the area has a colour assigned in the following colour period")
-            there_is_some_error = True
-        
-        if there_is_some_error:
-            all_data_is_ok = False
-            print(period)
+    # each period must start after the previous one
+    for period_index in np.flatnonzero(np.diff(start_dates) <= np.timedelta64(0, 'D')) + 1:
+        print("The period starting on " + str(start_dates[period_index]) + " does not start after the previous one (" + str(start_dates[period_index-1]) + ")")
+        all_data_is_ok = False
 
     if all_data_is_ok:
         print("Data is correct!")
 
-    return True
+    return all_data_is_ok
 
 
-def get_area_colour(dates, area=None):
+def get_area_colour(dates, area=None, as_matrix=False):
     """
     Get area colour for all the input dates 
     
     Parameters
     ----------
-    dates : list of Date
-        List of dates for which the area colour is requested
+    dates : array_like of Date or numpy.datetime64
+        Dates for which the area colour is requested
     area : str
         Desired area (default to all)
+    as_matrix : bool
+        If True, return the colours as a matrix instead of a list (default to False)
 
     Returns
     ----------
     list
         List of AreaColours or obj if all the areas have been requested (return value of get_colour function for each ColourPeriod class)
+    numpy.ndarray
+        If as_matrix is True, a (len(AreaColour), len(dates)) matrix is returned.
+        Each column is one-hot if the area is provided, otherwise it contains the percentage of areas of each colour (AreaColour.NONE if no period contains the date)
     """
-    colour_data = load_data()
-    colour_data_index = 0
-
-    area_colours = []
-
-    for date in dates:
+    colour_index = get_colour_index()
 
-        if colour_data[colour_data_index].is_date_after_end(date) and colour_data_index < len(colour_data):
-            colour_data_index += 1
+    if as_matrix:
+        return colour_index.get_colour_matrix(dates, area)
 
-        area_colours.append(colour_data[colour_data_index].get_colour(date, area))
+    if area is None:
+        return [{colour: colour_fractions[colour.value-1] for colour in AreaColour} for colour_fractions in colour_index.get_colour_matrix(dates).T]
 
-    return area_colours
+    return [AreaColour(colour) for colour in colour_index.get_colours(dates, [area])[:, 0]]
 
 if __name__ == "__main__":
-    validate_data()
+    if not validate_data():
+        exit(1)
 
     exit(0)
\ No newline at end of file
@@ -0,0 +1,358 @@
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import area_colour
+import dpc_data
+import html_report
+import make_graphs
+import vintage
+from analysis import get_trend, SMOOTHERS
+
+OUTPUT_FILE_PATH = 'benchmark.json'
+
+N_PROVINCES_PER_REGION = 5
+
+FIRST_DATE = date(2020, 2, 24)
+DATA_TIME = "T17:00:00"
+
+# note of the provisional days of the synthetic history, with characters that have to be quoted or escaped
+PROVISIONAL_NOTE = 'Dati provvisori {in revisione},\n"soggetti a modifiche"'
+
+
+def get_region_names(n_regions):
+    """
+    Get the names of the synthetic regions
+
+    Actual region names are used first, so that they have a colour assigned
+    """
+    return (area_colour.ALL_AREAS + ["Regione " + str(index) for index in range(len(area_colour.ALL_AREAS), n_regions)])[:n_regions]
+
+
+def write_data_files(data_directory, dataset, dataset_data):
+    """
+    Write the JSON and CSV files of a dataset, laid out as in the Civil Protection Department repository
+
+    Parameters
+    ----------
+    data_directory : str
+        Path of the data directory
+    dataset : str
+        Dataset name (e.g. dpc_data.NATIONAL_DATASET)
+    dataset_data : list of dict
+        Records of the dataset
+    """
+    for source in dpc_data.SOURCES:
+        file_path = dpc_data.get_data_file_path(dataset, data_directory, source)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        with open(file_path, 'w', newline='') as data_file:
+            if source == dpc_data.CSV_SOURCE:
+                writer = csv.DictWriter(data_file, fieldnames=list(dataset_data[0].keys()))
+                writer.writeheader()
+                writer.writerows({field: '' if value is None else value for field, value in daily_data.items()} for daily_data in dataset_data)
+            else:
+                json.dump(dataset_data, data_file, indent=4)
+
+    return
+
+
+def generate_dataset(directory, n_regions=len(area_colour.ALL_AREAS), n_days=365, n_colour_periods=20, seed=0):
+    """
+    Generate a synthetic dataset
+
+    Write national, regional and provincial data files (JSON and CSV), laid out as in the Civil Protection Department repository, and an area colour file
+
+    Parameters
+    ----------
+    directory : str
+        Output directory, data files are written to directory/COVID-19, the area colour file to directory/area_colour.csv
+    n_regions : int
+        Number of regions
+    n_days : int
+        Number of days
+    n_colour_periods : int
+        Number of colour periods
+    seed : int
+        Random generator seed
+
+    Returns
+    ----------
+    str
+        Path of the data directory
+    str
+        Path of the area colour file
+    """
+    rng = np.random.default_rng(seed)
+    region_names = get_region_names(n_regions)
+    data_directory = os.path.join(directory, dpc_data.DATA_DIRECTORY)
+
+    # daily new cases follow a few waves, each region with its own size
+    days = np.arange(n_days)
+    waves = 1 + np.sin(days/60)**2 + 0.5*np.sin(days/23 + 1)**2
+    region_sizes = rng.uniform(0.2, 2, size=n_regions)
+    new_cases = rng.poisson(100*np.outer(region_sizes, waves))
+
+    # (regions, days) cumulative measures
+    measures = {
+        "tamponi": np.cumsum(rng.poisson(50*new_cases + 1000), axis=1),
+        "deceduti": np.cumsum(rng.binomial(new_cases, 0.02), axis=1),
+        "dimessi_guariti": np.cumsum(rng.binomial(new_cases, 0.9), axis=1),
+    }
+    measures["totale_casi"] = np.cumsum(new_cases, axis=1)
+    measures["totale_positivi"] = measures["totale_casi"] - measures["deceduti"] - measures["dimessi_guariti"]
+    measures["ricoverati_con_sintomi"] = measures["totale_positivi"]//10
+    measures["terapia_intensiva"] = measures["totale_positivi"]//100
+    measures["isolamento_domiciliare"] = measures["totale_positivi"] - measures["ricoverati_con_sintomi"] - measures["terapia_intensiva"]
+
+    # each region is split into provinces, every new case is assigned to one of them
+    provincial_total_cases = np.cumsum(rng.multinomial(new_cases, np.full(N_PROVINCES_PER_REGION, 1/N_PROVINCES_PER_REGION)), axis=1)
+
+    dates = [(FIRST_DATE + timedelta(int(day))).isoformat() + DATA_TIME for day in days]
+
+    regional_data = []
+    national_data = []
+    provincial_data = []
+
+    for day in days:
+        for region_index, region_name in enumerate(region_names):
+            daily_data = {"data": dates[day], "stato": "ITA", "codice_regione": region_index + 1, "denominazione_regione": region_name}
+            daily_data.update({field: int(measure[region_index, day]) for field, measure in measures.items()})
+            daily_data["note"] = None
+            regional_data.append(daily_data)
+
+            for province_index in range(N_PROVINCES_PER_REGION):
+                provincial_data.append({"data": dates[day], "stato": "ITA", "codice_regione": region_index + 1, "denominazione_regione": region_name,
+                                        "codice_provincia": region_index*N_PROVINCES_PER_REGION + province_index + 1, "denominazione_provincia": region_name + " " + str(province_index),
+                                        "totale_casi": int(provincial_total_cases[region_index, day, province_index]), "note": None})
+
+        daily_data = {"data": dates[day], "stato": "ITA"}
+        daily_data.update({field: int(measure[:, day].sum()) for field, measure in measures.items()})
+        daily_data["note"] = None
+        national_data.append(daily_data)
+
+    for dataset, dataset_data in ((dpc_data.NATIONAL_DATASET, national_data), (dpc_data.REGIONAL_DATASET, regional_data), (dpc_data.PROVINCIAL_DATASET, provincial_data)):
+        write_data_files(data_directory, dataset, dataset_data)
+
+    # colour periods start on random days, every region gets a random colour
+    colour_file_path = os.path.join(directory, 'area_colour.csv')
+    start_days = np.sort(rng.choice(np.arange(n_days), size=min(n_colour_periods, n_days), replace=False))
+    colours = rng.integers(1, 5, size=(len(start_days), n_regions))
+
+    with open(colour_file_path, 'w', newline='') as colour_file:
+        writer = csv.writer(colour_file)
+        writer.writerow(["Date", "Red", "Orange", "Yellow", "White", "Reference"])
+
+        for period_index, start_day in enumerate(start_days):
+            writer.writerow([(FIRST_DATE + timedelta(int(start_day))).isoformat() + DATA_TIME]
+                            + [", ".join(region_name for region_name, colour in zip(region_names, colours[period_index]) if colour == area_colour_value.value) for area_colour_value in (area_colour.AreaColour.RED, area_colour.AreaColour.ORANGE, area_colour.AreaColour.YELLOW, area_colour.AreaColour.WHITE)]
+                            + ["synthetic"])
+
+    return data_directory, colour_file_path
+
+
+def generate_history(directory, n_commits=30, n_regions=len(area_colour.ALL_AREAS), n_days=365, n_revised_days=5, seed=0):
+    """
+    Generate a synthetic history
+
+    Generate a synthetic dataset (see generate_dataset), then commit national and regional data one day at a time to a local git repository, as the Civil Protection Department does.
+    In each commit the last n_revised_days days are provisional: their cumulative measures are underestimated, and revised by the following commits, and they carry a multi-line note
+
+    Parameters
+    ----------
+    directory : str
+        Output directory (see generate_dataset)
+    n_commits : int
+        Number of commits, the first one contains n_days - n_commits + 1 days
+    n_revised_days : int
+        Number of provisional days in each commit
+
+    Returns
+    ----------
+    str
+        Path of the data directory (a git repository)
+    """
+    import git
+
+    rng = np.random.default_rng(seed)
+    data_directory, _ = generate_dataset(directory, n_regions, n_days, seed=seed)
+
+    g = git.cmd.Git(data_directory)
+    g.init()
+
+    final_data = {}
+    for dataset in (dpc_data.NATIONAL_DATASET, dpc_data.REGIONAL_DATASET):
+        with open(dpc_data.get_data_file_path(dataset, data_directory), 'r') as data_file:
+            final_data[dataset] = json.load(data_file)
+
+    for commit_index in range(n_commits):
+        last_date = (FIRST_DATE + timedelta(n_days - n_commits + commit_index)).isoformat()
+        first_revised_date = (FIRST_DATE + timedelta(n_days - n_commits + commit_index - n_revised_days + 1)).isoformat()
+
+        for dataset, dataset_data in final_data.items():
+            version_data = []
+
+            for daily_data in dataset_data:
+                if daily_data["data"][:10] > last_date:
+                    break
+
+                if daily_data["data"][:10] >= first_revised_date:
+                    # a random share of the data of the provisional days is still missing
+                    daily_data = {field: int(value*(1 - rng.uniform(0, 0.02))) if field in dpc_data.MEASURE_FIELDS.values() else value for field, value in daily_data.items()}
+                    daily_data["note"] = PROVISIONAL_NOTE
+
+                version_data.append(daily_data)
+
+            write_data_files(data_directory, dataset, version_data)
+
+        g.add('--all')
+        g.commit('-m', 'Data of ' + last_date, '--quiet', author='Synthetic data <synthetic@example.com>', env={"GIT_COMMITTER_NAME": 'Synthetic data', "GIT_COMMITTER_EMAIL": 'synthetic@example.com'})
+
+    return data_directory
+
+
+def time_stage(function, n_repeats):
+    """
+    Time a stage
+
+    Returns
+    ----------
+    dict
+        Minimum, median and maximum execution time [s] over n_repeats executions
+    object
+        Return value of the last execution
+    """
+    times = []
+
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start_time)
+
+    return {"min": min(times), "median": float(np.median(times)), "max": max(times)}, result
+
+
+def run_benchmark(n_regions=len(area_colour.ALL_AREAS), n_days=365, n_colour_periods=20, n_repeats=5, n_rendered_figures=3, n_vintage_commits=0, seed=0):
+    """
+    Run the benchmark
+
+    Generate a synthetic dataset in a temporary directory and time each stage of the pipeline separately
+
+    Returns
+    ----------
+    dict
+        Benchmark parameters, environment and stage timings
+    """
+    results = {
+        "parameters": {"n_regions": n_regions, "n_days": n_days, "n_colour_periods": n_colour_periods, "n_repeats": n_repeats, "n_rendered_figures": n_rendered_figures, "n_vintage_commits": n_vintage_commits, "seed": seed},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform()},
+        "date": datetime.now().isoformat(),
+        "stages": {},
+    }
+    stages = results["stages"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        data_directory, colour_file_path = generate_dataset(directory, n_regions, n_days, n_colour_periods, seed)
+        region_names = get_region_names(n_regions)
+
+        # parse
+        for source in dpc_data.SOURCES:
+            stages["parse_national_" + source], _ = time_stage(lambda: dpc_data.parse_dataset(dpc_data.NATIONAL_DATASET, data_directory=data_directory, source=source), n_repeats)
+            stages["parse_regional_" + source], regional_columns = time_stage(lambda: dpc_data.parse_dataset(dpc_data.REGIONAL_DATASET, data_directory=data_directory, source=source), n_repeats)
+            stages["parse_provincial_" + source], provincial_columns = time_stage(lambda: dpc_data.parse_dataset(dpc_data.PROVINCIAL_DATASET, data_directory=data_directory, source=source), n_repeats)
+
+        # province -> region roll-up
+        stages["province_roll_up"], _ = time_stage(lambda: dpc_data.group_sum(provincial_columns["dates"], provincial_columns["regions"], provincial_columns["total_cases"]), n_repeats)
+
+        # (regions, days) matrix for each measure
+        region_rows = {region_name: regional_columns["areas"] == region_name for region_name in region_names}
+        measures = {measure: np.stack([regional_columns[measure][region_rows[region_name]] for region_name in region_names]) for measure in dpc_data.MEASURE_FIELDS.keys()}
+        dates = regional_columns["dates"][region_rows[region_names[0]]]
+
+        # diff
+        stages["diff"], variations = time_stage(lambda: {measure: np.diff(values, axis=1) for measure, values in measures.items()}, n_repeats)
+
+        # trend, with each smoother (throughput over every measure of every region)
+        n_samples = sum(values.size for values in variations.values())
+
+        for smoother in SMOOTHERS.keys():
+            stages["trend_" + smoother], _ = time_stage(lambda: [get_trend(variation, smoother=smoother) for values in variations.values() for variation in values], n_repeats)
+            stages["trend_" + smoother]["samples_per_second"] = n_samples/stages["trend_" + smoother]["median"]
+
+        # colour lookup (index build and lookup for every area)
+        colour_areas = [region_name for region_name in region_names if region_name in area_colour.ALL_AREAS]
+        stages["colour_index"], colour_index = time_stage(lambda: area_colour.ColourIndex(area_colour.compile_data(colour_file_path)), n_repeats)
+        stages["colour_lookup"], _ = time_stage(lambda: [colour_index.get_colour_matrix(dates)] + [colour_index.get_colour_matrix(dates, area) for area in colour_areas], n_repeats)
+
+        # derive (every figure of every region, as make_graphs does)
+        def derive():
+            figures_data = []
+            for region_index, region_name in enumerate(region_names):
+                area_colours = colour_index.get_colour_matrix(dates, region_name if region_name in area_colour.ALL_AREAS else None)
+                figures_data += make_graphs.compute_all_measures(dates, **{measure: values[region_index] for measure, values in measures.items()}, area_colours=area_colours, area_name=region_name)
+            return figures_data
+
+        stages["derive"], figures_data = time_stage(derive, n_repeats)
+
+        # HTML report of every region
+        report_file_path = os.path.join(directory, html_report.REPORT_FILE_PATH)
+        stages["html_report"], report_size = time_stage(lambda: html_report.write_report(figures_data, report_file_path), n_repeats)
+        stages["html_report"]["size_bytes"] = report_size
+
+        # render
+        if n_rendered_figures > 0:
+            from matplotlib.figure import Figure
+
+            def render():
+                for figure_data in figures_data[:n_rendered_figures]:
+                    fig = Figure()
+                    make_graphs.draw_measure(figure_data, fig)
+                    fig.savefig(io.BytesIO(), format='png')
+
+            stages["render"], _ = time_stage(render, n_repeats)
+            stages["render"]["n_figures"] = min(n_rendered_figures, len(figures_data))
+
+        # vintage analysis of every region over a synthetic history
+        if n_vintage_commits > 1:
+            history_directory = os.path.join(directory, 'history')
+            history_data_directory = generate_history(history_directory, n_vintage_commits, n_regions, n_days, seed=seed)
+            commits = vintage.get_history(dpc_data.REGIONAL_DATASET, n_vintage_commits, data_directory=history_data_directory)
+
+            stages["vintage"], (_, _, _, parsed_fraction) = time_stage(lambda: vintage.compute_vintage_trends(commits, dpc_data.REGIONAL_DATASET, region_names, data_directory=history_data_directory), n_repeats)
+            stages["vintage"]["parsed_fraction"] = parsed_fraction
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the pipeline on a synthetic dataset')
+    parser.add_argument('--regions', type=int, default=len(area_colour.ALL_AREAS), help='number of regions (default to %(default)s)')
+    parser.add_argument('--days', type=int, default=365, help='number of days (default to %(default)s)')
+    parser.add_argument('--colour-periods', type=int, default=20, help='number of colour periods (default to %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of executions of each stage (default to %(default)s)')
+    parser.add_argument('--render', type=int, default=3, help='number of figures rendered (default to %(default)s)')
+    parser.add_argument('--vintage-commits', type=int, default=0, help='number of commits of the synthetic history walked by the vintage analysis, 0 to skip it (default to %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random generator seed (default to %(default)s)')
+    parser.add_argument('--output', default=OUTPUT_FILE_PATH, help='output file (default to %(default)s)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.regions, args.days, args.colour_periods, args.repeat, args.render, args.vintage_commits, args.seed)
+
+    for stage, timing in results["stages"].items():
+        print(f"{stage:25} {timing['median']*1000:10.3f} ms" + (f" {timing['samples_per_second']/1e6:10.2f} Msamples/s" if "samples_per_second" in timing else "") + (f" {timing['size_bytes']/1e6:10.2f} MB" if "size_bytes" in timing else ""))
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+
+    print("Results written to " + args.output)
+
+    exit(0)
@@ -0,0 +1,206 @@
+import argparse
+import os
+import tempfile
+
+import area_colour
+import benchmark
+import dpc_data
+import make_graphs
+import vintage
+
+N_COMMITS = 4
+N_REGIONS = 3
+N_DAYS = 60
+
+# watch checks [s]
+CHECK_INTERVAL = 0.2
+N_CHECKS = 5
+
+
+def check(condition, message):
+    """
+    Print the outcome of a check
+
+    Returns
+    ----------
+    bool
+        condition
+    """
+    print(("OK      " if condition else "FAILED  ") + message)
+
+    return condition
+
+
+def create_upstream(directory, n_commits=N_COMMITS, n_regions=N_REGIONS, n_days=N_DAYS):
+    """
+    Create a local bare repository standing in for the Civil Protection Department repository
+
+    A synthetic history is generated (see benchmark.generate_history) next to the bare repository, whose branch initially points to the first commit of the history
+
+    Parameters
+    ----------
+    directory : str
+        Output directory
+
+    Returns
+    ----------
+    str
+        URL of the bare repository
+    list of str
+        Commits of the synthetic history, oldest first
+    """
+    import git
+
+    history_data_directory = benchmark.generate_history(os.path.join(directory, 'history'), n_commits, n_regions, n_days)
+    commits = git.cmd.Git(history_data_directory).rev_list('--reverse', 'HEAD').splitlines()
+
+    bare_directory = os.path.join(directory, 'upstream.git')
+    git.cmd.Git(directory).init('--bare', '--quiet', bare_directory)
+
+    # the server side has to allow partial clones (see dpc_data.clone_data)
+    g = git.cmd.Git(bare_directory)
+    g.config('uploadpack.allowFilter', 'true')
+    g.symbolic_ref('HEAD', 'refs/heads/master')
+
+    publish(history_data_directory, bare_directory, commits[0])
+
+    return 'file://' + os.path.abspath(bare_directory), commits
+
+
+def publish(history_data_directory, bare_directory, commit):
+    """
+    Move the branch of the bare repository to a commit of the synthetic history, as if new data had been published
+    """
+    import git
+
+    git.cmd.Git(history_data_directory).push('--quiet', '--force', bare_directory, commit + ':refs/heads/master')
+
+    return
+
+
+def check_clone_and_fetch(directory, url, commits):
+    """
+    Check dpc_data.clone_data, fetch_data and merge_data against the bare repository
+
+    Returns
+    ----------
+    bool
+        True if every check passed
+    """
+    import git
+
+    history_data_directory = os.path.join(directory, 'history', dpc_data.DATA_DIRECTORY)
+    bare_directory = os.path.join(directory, 'upstream.git')
+    data_directory = os.path.join(directory, 'clone', dpc_data.DATA_DIRECTORY)
+    os.makedirs(os.path.dirname(data_directory))
+
+    dpc_data.clone_data(data_directory, url)
+    g = git.cmd.Git(data_directory)
+
+    is_passed = check(dpc_data.get_data_commit(data_directory) == commits[0], "clone_data checks out the published commit")
+    is_passed &= check(g.rev_parse('--is-shallow-repository') == 'true', "clone_data clones the last commit only")
+
+    checked_out_files = [os.path.relpath(os.path.join(root, file_name), data_directory).replace(os.sep, '/') for root, directories, file_names in os.walk(data_directory) if '.git' not in root.split(os.sep) for file_name in file_names]
+    is_passed &= check(g.sparse_checkout('list').splitlines() == dpc_data.get_sparse_checkout_paths() and set(checked_out_files) <= set(path.lstrip('/') for path in dpc_data.get_sparse_checkout_paths()), "clone_data checks out the dataset files only")
+
+    is_passed &= check(not dpc_data.fetch_data(data_directory), "fetch_data finds no new data")
+
+    publish(history_data_directory, bare_directory, commits[1])
+
+    is_passed &= check(dpc_data.fetch_data(data_directory), "fetch_data finds new data")
+    is_passed &= check(dpc_data.get_data_commit(data_directory) == commits[0], "fetch_data leaves the checked out data untouched")
+
+    dpc_data.merge_data(data_directory)
+
+    is_passed &= check(dpc_data.get_data_commit(data_directory) == commits[1], "merge_data checks out the new data")
+    is_passed &= check(len(dpc_data.get_changed_data_files(commits[0], commits[1], data_directory) or []) > 0, "get_changed_data_files finds the changed dataset files")
+
+    return is_passed
+
+
+def check_watch(directory, commits):
+    """
+    Check make_graphs.watch against the bare repository, after check_clone_and_fetch
+
+    New data is published before watching: it has to be fetched, and the figures drawn again.
+    Then a commit changing no dataset file is published: it has to be checked out without drawing the figures again
+
+    Returns
+    ----------
+    bool
+        True if every check passed
+    """
+    import git
+
+    history_directory = os.path.join(directory, 'history')
+    history_data_directory = os.path.join(history_directory, dpc_data.DATA_DIRECTORY)
+    bare_directory = os.path.join(directory, 'upstream.git')
+    data_directory = os.path.join(directory, 'clone', dpc_data.DATA_DIRECTORY)
+    output_directory = os.path.join(directory, 'figures')
+
+    colour_index = area_colour.ColourIndex(area_colour.compile_data(os.path.join(history_directory, 'area_colour.csv')))
+    computed_commits = []
+
+    def compute_figures_data():
+        computed_commits.append(dpc_data.get_data_commit(data_directory))
+        national_data = dpc_data.load_national_data(data_directory, os.path.join(directory, 'cache'))
+
+        return make_graphs.compute_all_measures(**national_data, area_colours=colour_index.get_colour_matrix(national_data["dates"]), area_name='Italia')
+
+    publish(history_data_directory, bare_directory, commits[2])
+    make_graphs.watch(compute_figures_data, CHECK_INTERVAL, output_directory=output_directory, n_checks=N_CHECKS, data_directory=data_directory)
+
+    is_passed = check(computed_commits == commits[1:3], "watch computes the data again when new data is fetched")
+    is_passed &= check(len(os.listdir(output_directory)) == len(compute_figures_data()), "watch saves every figure")
+
+    # same tree as the checked out commit
+    commit = git.cmd.Git(history_data_directory).commit_tree(commits[2] + '^{tree}', '-p', commits[2], '-m', 'No data change', env={"GIT_AUTHOR_NAME": 'Synthetic data', "GIT_AUTHOR_EMAIL": 'synthetic@example.com', "GIT_COMMITTER_NAME": 'Synthetic data', "GIT_COMMITTER_EMAIL": 'synthetic@example.com'})
+    publish(history_data_directory, bare_directory, commit)
+
+    computed_commits = []
+    make_graphs.watch(compute_figures_data, CHECK_INTERVAL, output_directory=output_directory, n_checks=N_CHECKS, data_directory=data_directory)
+
+    is_passed &= check(dpc_data.get_data_commit(data_directory) == commit, "watch checks out a commit changing no dataset file")
+    is_passed &= check(computed_commits == [commits[2]], "watch doesn't compute the data again if no dataset file changed")
+
+    return is_passed
+
+
+def check_vintage(directory, commits):
+    """
+    Check that the vintage analysis of the synthetic history reusing unchanged records leads to the same trends as parsing every version from scratch (see vintage.check_vintages)
+
+    Returns
+    ----------
+    bool
+        True if every check passed
+    """
+    history_data_directory = os.path.join(directory, 'history', dpc_data.DATA_DIRECTORY)
+    region_names = benchmark.get_region_names(N_REGIONS)
+
+    is_passed = True
+
+    for source in dpc_data.SOURCES:
+        is_passed &= check(vintage.check_vintages(commits, dpc_data.REGIONAL_DATASET, region_names, source, data_directory=history_data_directory), "vintage reuses unchanged " + source + " records without changing the trends")
+
+    return is_passed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Check the data update offline, against a local repository receiving synthetic commits')
+    parser.add_argument('--keep', metavar='DIRECTORY', help='create the repositories in DIRECTORY and keep them (default to a temporary directory)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = args.keep or temporary_directory
+        os.makedirs(directory, exist_ok=True)
+
+        url, commits = create_upstream(directory)
+        is_passed = check_clone_and_fetch(directory, url, commits)
+        is_passed &= check_watch(directory, commits)
+        is_passed &= check_vintage(directory, commits)
+
+    print("Every check passed!" if is_passed else "Some checks failed")
+
+    exit(0 if is_passed else 1)
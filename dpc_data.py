@@ -0,0 +1,878 @@
+import csv
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import profiling
+
+DATA_DIRECTORY = 'COVID-19'
+DATA_REPOSITORY_URL = 'https://github.com/pcm-dpc/COVID-19.git'
+CACHE_DIRECTORY = 'cache'
+
+NATIONAL_DATASET = 'andamento-nazionale'
+REGIONAL_DATASET = 'regioni'
+PROVINCIAL_DATASET = 'province'
+
+JSON_SOURCE = 'json'
+CSV_SOURCE = 'csv'
+SOURCES = [JSON_SOURCE, CSV_SOURCE]
+
+# dataset -> directory containing the CSV file
+CSV_DIRECTORIES = {
+    NATIONAL_DATASET: 'dati-andamento-nazionale',
+    REGIONAL_DATASET: 'dati-regioni',
+    PROVINCIAL_DATASET: 'dati-province',
+}
+
+# measure name -> field name in the Civil Protection Department files
+MEASURE_FIELDS = {
+    "hospitalized_with_sympthoms": "ricoverati_con_sintomi",
+    "intensive_care_unit": "terapia_intensiva",
+    "staying_at_home": "isolamento_domiciliare",
+    "positives": "totale_positivi",
+    "healed": "dimessi_guariti",
+    "deaths": "deceduti",
+    "n_tests": "tamponi",
+}
+
+# provincial data contains only the total number of cases
+PROVINCIAL_MEASURE_FIELDS = {
+    "total_cases": "totale_casi",
+}
+
+# dataset -> measure name -> field name (regional total cases are needed to check provincial data)
+DATASET_MEASURE_FIELDS = {
+    NATIONAL_DATASET: MEASURE_FIELDS,
+    REGIONAL_DATASET: {**MEASURE_FIELDS, **PROVINCIAL_MEASURE_FIELDS},
+    PROVINCIAL_DATASET: PROVINCIAL_MEASURE_FIELDS,
+}
+
+DATE_FIELD = "data"
+
+# dataset -> column name -> field containing the area names ("areas" are the areas of the dataset, "regions" the regions they belong to)
+AREA_FIELDS = {
+    NATIONAL_DATASET: {},
+    REGIONAL_DATASET: {"areas": "denominazione_regione"},
+    PROVINCIAL_DATASET: {"areas": "denominazione_provincia", "regions": "denominazione_regione"},
+}
+
+COMMIT_FILE_NAME = 'commit'
+
+DERIVED_STATE_DIRECTORY = 'derived'
+DERIVED_STATE_KEYS = ["dates", "measure", "trend", "colour_bands"]
+
+SEPARATORS_REGEX = re.compile(r'[\s,]*')
+
+READ_CHUNK_SIZE = 1 << 16
+INITIAL_N_ROWS = 1024
+WRITE_BATCH_SIZE = 4096
+AREA_NAME_MAX_LENGTH = 64
+
+
+def get_data_file_path(dataset, data_directory=DATA_DIRECTORY, source=JSON_SOURCE):
+    """
+    Get the path of the file of the dataset
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    data_directory : str
+        Path of the Civil Protection Department repository
+    source : str
+        File format, one of SOURCES
+
+    Returns
+    ----------
+    str
+        Path of the dataset file
+    """
+    if source == CSV_SOURCE:
+        return os.path.join(data_directory, CSV_DIRECTORIES[dataset], 'dpc-covid19-ita-' + dataset + '.csv')
+
+    return os.path.join(data_directory, 'dati-json', 'dpc-covid19-ita-' + dataset + '.json')
+
+
+def get_data_commit(data_directory=DATA_DIRECTORY):
+    """
+    Get the commit of the local Civil Protection Department repository
+
+    The commit is read straight from the repository files, so that git isn't needed to check whether the cache is valid
+
+    Parameters
+    ----------
+    data_directory : str
+        Path of the Civil Protection Department repository
+
+    Returns
+    ----------
+    str
+        HEAD commit hash, None if it can't be retrieved (e.g. the directory is not a git repository)
+    """
+    git_directory = os.path.join(data_directory, '.git')
+
+    try:
+        with open(os.path.join(git_directory, 'HEAD'), 'r') as head_file:
+            head = head_file.read().strip()
+
+        # detached HEAD
+        if not head.startswith('ref: '):
+            return head
+
+        reference = head[len('ref: '):]
+
+        if os.path.isfile(os.path.join(git_directory, reference)):
+            with open(os.path.join(git_directory, reference), 'r') as reference_file:
+                return reference_file.read().strip()
+
+        with open(os.path.join(git_directory, 'packed-refs'), 'r') as packed_references_file:
+            for line in packed_references_file:
+                if line.rstrip('\n').endswith(' ' + reference):
+                    return line.split(' ')[0]
+
+    except OSError:
+        pass
+
+    return None
+
+
+def get_sparse_checkout_paths():
+    """
+    Get the paths of the Civil Protection Department repository that are actually read
+
+    Returns
+    ----------
+    list of str
+        Sparse checkout patterns, one for each dataset file of each source
+    """
+    return ['/' + get_data_file_path(dataset, '', source).replace(os.sep, '/') for dataset in AREA_FIELDS.keys() for source in SOURCES]
+
+
+def clone_data(data_directory=DATA_DIRECTORY, url=DATA_REPOSITORY_URL):
+    """
+    Clone the Civil Protection Department repository
+
+    Only the last commit is cloned, without the content of the files (blobs).
+    Then only the dataset files are checked out, so only their content is downloaded
+
+    Parameters
+    ----------
+    data_directory : str
+        Path of the local repository
+    url : str
+        URL of the repository to clone
+    """
+    import git
+
+    parent_directory, directory_name = os.path.split(os.path.abspath(data_directory))
+
+    git.cmd.Git(parent_directory).clone('--depth=1', '--filter=blob:none', '--sparse', url, directory_name)
+
+    git.cmd.Git(data_directory).sparse_checkout('set', '--no-cone', *get_sparse_checkout_paths())
+
+
+def fetch_data(data_directory=DATA_DIRECTORY):
+    """
+    Fetch the Civil Protection Department repository
+
+    Only the remote branches are updated, the checked out files are left untouched, so the data can be read while fetching (see merge_data).
+    If the repository has been cloned with clone_data, the sparse checkout paths are set again, so that only the dataset files are downloaded
+
+    Parameters
+    ----------
+    data_directory : str
+        Path of the local repository
+
+    Returns
+    ----------
+    bool
+        True if new data has been fetched
+    """
+    import git
+
+    g = git.cmd.Git(data_directory)
+
+    if g.config('--bool', '--default', 'false', 'core.sparseCheckout') == 'true':
+        g.sparse_checkout('set', '--no-cone', *get_sparse_checkout_paths())
+
+    g.fetch()
+
+    return g.rev_parse('HEAD') != g.rev_parse('@{upstream}')
+
+
+def merge_data(data_directory=DATA_DIRECTORY):
+    """
+    Check out the fetched data (see fetch_data)
+
+    Parameters
+    ----------
+    data_directory : str
+        Path of the local repository
+    """
+    import git
+
+    git.cmd.Git(data_directory).merge('--ff-only', '@{upstream}')
+
+
+def get_changed_data_files(previous_commit, commit, data_directory=DATA_DIRECTORY):
+    """
+    Get the dataset files changed between two commits of the Civil Protection Department repository
+
+    Parameters
+    ----------
+    previous_commit : str
+        Previous commit
+    commit : str
+        Actual commit
+    data_directory : str
+        Path of the local repository
+
+    Returns
+    ----------
+    list of str
+        Paths of the changed dataset files, relative to the repository. None if the commits can't be compared (e.g. the previous commit is not available)
+    """
+    import git
+
+    try:
+        # paths are relative to the top of the repository
+        changed_files = git.cmd.Git(data_directory).diff('--name-only', previous_commit, commit, '--', *[':(top)' + path.lstrip('/') for path in get_sparse_checkout_paths()])
+    except git.exc.GitCommandError:
+        return None
+
+    return changed_files.splitlines()
+
+
+def iter_records(file_path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Iterate over the records of a JSON file
+
+    The file is read incrementally, so that only the record being decoded is kept in memory instead of the whole document
+
+    Parameters
+    ----------
+    file_path : str
+        Path of a JSON file containing an array of objects
+    chunk_size : int
+        Number of characters read from the file at once
+
+    Yields
+    ----------
+    dict
+        One record of the array
+    """
+    decoder = json.JSONDecoder()
+
+    with open(file_path, 'r') as data_file:
+        buffer = ''
+        position = 0
+        is_array_open = False
+        is_file_ended = False
+
+        while True:
+            position = SEPARATORS_REGEX.match(buffer, position).end()
+
+            if position < len(buffer):
+                if not is_array_open:
+                    if buffer[position] != '[':
+                        raise ValueError(file_path + " does not contain a JSON array")
+                    is_array_open = True
+                    position += 1
+                    continue
+
+                if buffer[position] == ']':
+                    return
+
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                    yield record
+                    continue
+                except json.JSONDecodeError:
+                    # the record is incomplete, more data is needed
+                    if is_file_ended:
+                        raise
+
+            elif is_file_ended:
+                raise ValueError(file_path + " ended before the end of the JSON array")
+
+            # drop what has been already decoded and read more data
+            chunk = data_file.read(chunk_size)
+            is_file_ended = chunk == ''
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+class ColumnBuilder:
+    """
+    Column builder class
+
+    This class collects the rows of a dataset being parsed into preallocated columns
+    """
+    def __init__(self, measure_names, area_column_names):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        measure_names : list of str
+            Names of the measure columns
+        area_column_names : list of str
+            Names of the area columns (see AREA_FIELDS)
+        """
+        # the dates are converted in bulk at the end
+        self.columns = {"dates": np.empty(INITIAL_N_ROWS, dtype='U10')}
+        for measure in measure_names:
+            self.columns[measure] = np.empty(INITIAL_N_ROWS, dtype=np.int64)
+        for area_column_name in area_column_names:
+            self.columns[area_column_name] = np.empty(INITIAL_N_ROWS, dtype='U' + str(AREA_NAME_MAX_LENGTH))
+        self.area_column_names = list(area_column_names)
+
+        self.n_rows = 0
+
+    def append(self, batch_columns):
+        """
+        Append a batch of rows
+
+        Parameters
+        ----------
+        batch_columns : dict
+            Sequence of values for each column. Dates can be either ISO strings (time is ignored) or datetime64 values
+        """
+        n_batch_rows = len(batch_columns["dates"])
+
+        # double the columns length when full
+        while self.n_rows + n_batch_rows > len(self.columns["dates"]):
+            for column_name, column in self.columns.items():
+                self.columns[column_name] = np.resize(column, 2*len(column))
+
+        for column_name, column in self.columns.items():
+            column[self.n_rows:self.n_rows+n_batch_rows] = batch_columns[column_name]
+
+        self.n_rows += n_batch_rows
+
+    def get_columns(self):
+        """
+        Get the parsed columns
+
+        Returns
+        ----------
+        dict
+            Columns of the dataset (see parse_dataset)
+        """
+        columns = {column_name: column[:self.n_rows].copy() for column_name, column in self.columns.items()}
+        columns["dates"] = columns["dates"].astype('datetime64[D]')
+
+        for area_column_name in self.area_column_names:
+            if self.n_rows > 0:
+                columns[area_column_name] = columns[area_column_name].astype('U' + str(np.char.str_len(columns[area_column_name]).max()))
+
+        return columns
+
+
+def parse_json_dataset(dataset, area_list=None, data_directory=DATA_DIRECTORY):
+    """
+    Parse the JSON file of the dataset
+
+    The file is read as a stream and records are written in batches straight into preallocated columns, so memory is bounded by the output columns.
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    area_list : list of str
+        Keep only the records of these areas (default to all). Ignored if the dataset has no area field
+    data_directory : str
+        Path of the Civil Protection Department repository
+
+    Returns
+    ----------
+    dict
+        Columns of the dataset (see parse_dataset)
+    """
+    measure_fields = DATASET_MEASURE_FIELDS[dataset]
+    area_fields = AREA_FIELDS[dataset]
+    area_field = area_fields.get("areas")
+    area_set = set(area_list) if area_list is not None and area_field is not None else None
+
+    column_builder = ColumnBuilder(measure_fields.keys(), area_fields.keys())
+    batch = []
+
+    def append_batch():
+        batch_columns = {"dates": [daily_data[DATE_FIELD][:10] for daily_data in batch]}
+        for measure, field in measure_fields.items():
+            batch_columns[measure] = [daily_data[field] or 0 for daily_data in batch]
+        for area_column_name, field in area_fields.items():
+            batch_columns[area_column_name] = [daily_data[field] for daily_data in batch]
+
+        column_builder.append(batch_columns)
+        batch.clear()
+
+    for daily_data in iter_records(get_data_file_path(dataset, data_directory, JSON_SOURCE)):
+
+        if area_set is None or daily_data[area_field] in area_set:
+            batch.append(daily_data)
+
+        if len(batch) == WRITE_BATCH_SIZE:
+            append_batch()
+
+    append_batch()
+
+    return column_builder.get_columns()
+
+
+def parse_csv_dataset(dataset, area_list=None, data_directory=DATA_DIRECTORY):
+    """
+    Parse the CSV file of the dataset
+
+    Rows are read in batches, each batch is converted to typed columns at once.
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    area_list : list of str
+        Keep only the rows of these areas (default to all). Ignored if the dataset has no area field
+    data_directory : str
+        Path of the Civil Protection Department repository
+
+    Returns
+    ----------
+    dict
+        Columns of the dataset (see parse_dataset)
+    """
+    measure_fields = DATASET_MEASURE_FIELDS[dataset]
+    area_fields = AREA_FIELDS[dataset]
+    area_field = area_fields.get("areas")
+
+    column_builder = ColumnBuilder(measure_fields.keys(), area_fields.keys())
+
+    with open(get_data_file_path(dataset, data_directory, CSV_SOURCE), 'r', newline='') as data_file:
+        file_content = csv.reader(data_file)
+
+        header = next(file_content)
+        field_indices = {field: index for index, field in enumerate(header)}
+
+        def append_batch(batch):
+            batch = np.array(batch, dtype=str)
+
+            if area_list is not None and area_field is not None:
+                batch = batch[np.isin(batch[:, field_indices[area_field]], area_list)]
+
+            # dates are truncated to the day
+            batch_columns = {"dates": batch[:, field_indices[DATE_FIELD]].astype('U10')}
+            for measure, field in measure_fields.items():
+                values = batch[:, field_indices[field]]
+                batch_columns[measure] = np.where(values == '', '0', values).astype(np.float64).astype(np.int64)
+            for area_column_name, field in area_fields.items():
+                batch_columns[area_column_name] = batch[:, field_indices[field]]
+
+            column_builder.append(batch_columns)
+
+        batch = []
+
+        for row in file_content:
+            if row:
+                batch.append(row)
+
+            if len(batch) == WRITE_BATCH_SIZE:
+                append_batch(batch)
+                batch = []
+
+        if batch:
+            append_batch(batch)
+
+    return column_builder.get_columns()
+
+
+# source -> parsing function
+PARSERS = {
+    JSON_SOURCE: parse_json_dataset,
+    CSV_SOURCE: parse_csv_dataset,
+}
+
+
+def parse_dataset(dataset, area_list=None, data_directory=DATA_DIRECTORY, source=JSON_SOURCE):
+    """
+    Parse the file of the dataset
+
+    If the file of the requested source is not available, the JSON file is parsed instead
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    area_list : list of str
+        Keep only the records of these areas (default to all). Ignored if the dataset has no area field
+    data_directory : str
+        Path of the Civil Protection Department repository
+    source : str
+        File format, one of SOURCES
+
+    Returns
+    ----------
+    dict
+        Columns of the dataset: "dates" (datetime64[D]), one int64 column for each measure in DATASET_MEASURE_FIELDS and one str column for each area field in AREA_FIELDS
+    """
+    if source != JSON_SOURCE and not os.path.isfile(get_data_file_path(dataset, data_directory, source)):
+        print(f"No {source} file for {dataset} data, fallback to {JSON_SOURCE}")
+        source = JSON_SOURCE
+
+    return PARSERS[source](dataset, area_list, data_directory)
+
+
+def get_cache_directory(dataset, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Get the cache directory of the dataset
+    """
+    return os.path.join(cache_directory, source, dataset)
+
+
+def read_cache(dataset, commit, column_names, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Read the cached columns of the dataset
+
+    Columns are memory-mapped, so only the data actually accessed is read from disk
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    commit : str
+        Commit of the data, the cache is valid only if it has been built from the same commit
+    column_names : list of str
+        Desired columns
+    cache_directory : str
+        Path of the cache
+    source : str
+        File format the cache has been built from
+
+    Returns
+    ----------
+    dict
+        Memory-mapped columns, None if the cache is not valid
+    """
+    dataset_cache_directory = get_cache_directory(dataset, cache_directory, source)
+
+    try:
+        with open(os.path.join(dataset_cache_directory, COMMIT_FILE_NAME), 'r') as commit_file:
+            if commit is None or commit_file.read().strip() != commit:
+                return None
+
+        return {column_name: np.load(os.path.join(dataset_cache_directory, column_name + '.npy'), mmap_mode='r') for column_name in column_names}
+
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(dataset, commit, columns, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Write the columns of the dataset to the cache
+
+    The cache is written to a temporary directory, then it replaces the previous one at once (see metrics_store.write_store), so that concurrent writers (e.g. make_graphs and the API server) never leave a partially written cache.
+    The commit file is written last, so an interrupted write leaves an invalid cache
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    commit : str
+        Commit of the data
+    columns : dict
+        Columns of the dataset (return value of parse_dataset)
+    cache_directory : str
+        Path of the cache
+    source : str
+        File format the columns have been parsed from
+    """
+    dataset_cache_directory = get_cache_directory(dataset, cache_directory, source)
+    os.makedirs(os.path.dirname(dataset_cache_directory), exist_ok=True)
+
+    # each writer has its own temporary directory
+    temporary_directory = tempfile.mkdtemp(prefix=dataset + '.', suffix='.tmp', dir=os.path.dirname(dataset_cache_directory))
+    previous_directory = temporary_directory + '.old'
+
+    for column_name, column in columns.items():
+        np.save(os.path.join(temporary_directory, column_name + '.npy'), column)
+
+    with open(os.path.join(temporary_directory, COMMIT_FILE_NAME), 'w') as commit_file:
+        commit_file.write(commit)
+
+    try:
+        if os.path.isdir(dataset_cache_directory):
+            os.replace(dataset_cache_directory, previous_directory)
+
+        os.replace(temporary_directory, dataset_cache_directory)
+    except OSError:
+        # another writer replaced the cache meanwhile
+        pass
+
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+    shutil.rmtree(previous_directory, ignore_errors=True)
+
+
+def load_dataset(dataset, column_names=None, area_list=None, data_directory=DATA_DIRECTORY, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Load the dataset
+
+    Data is read from the cache if it has been built from the actual commit of the data, otherwise the file is parsed and the cache rebuilt
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    column_names : list of str
+        Desired columns (default to all)
+    area_list : list of str
+        Desired areas (default to all). The cache always contains every area, so other areas might be returned as well
+    data_directory : str
+        Path of the Civil Protection Department repository
+    cache_directory : str
+        Path of the cache
+    source : str
+        File format, one of SOURCES
+
+    Returns
+    ----------
+    dict
+        Columns of the dataset (see parse_dataset)
+    """
+    if column_names is None:
+        column_names = ["dates"] + list(DATASET_MEASURE_FIELDS[dataset].keys()) + list(AREA_FIELDS[dataset].keys())
+
+    commit = get_data_commit(data_directory)
+
+    with profiling.span("read_cache", dataset=dataset, source=source):
+        columns = read_cache(dataset, commit, column_names, cache_directory, source)
+
+    if columns is None:
+        parsing_start_time = time.perf_counter()
+
+        # without a commit there is no cache to build, so only the desired areas are parsed
+        if commit is None:
+            with profiling.span("parse_dataset", dataset=dataset, source=source):
+                columns = parse_dataset(dataset, area_list, data_directory, source)
+        else:
+            with profiling.span("parse_dataset", dataset=dataset, source=source):
+                columns = parse_dataset(dataset, data_directory=data_directory, source=source)
+            with profiling.span("write_cache", dataset=dataset, source=source):
+                write_cache(dataset, commit, columns, cache_directory, source)
+
+        print(f"{dataset} data parsed from {source} in {time.perf_counter() - parsing_start_time:.3f} s")
+
+        columns = {column_name: columns[column_name] for column_name in column_names}
+
+    return columns
+
+
+def load_national_data(data_directory=DATA_DIRECTORY, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Load national data
+
+    Returns
+    ----------
+    dict
+        "dates" column and one column for each measure in MEASURE_FIELDS
+    """
+    return load_dataset(NATIONAL_DATASET, ["dates"] + list(MEASURE_FIELDS.keys()), data_directory=data_directory, cache_directory=cache_directory, source=source)
+
+
+def load_regional_data(region_list, data_directory=DATA_DIRECTORY, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Load regional data
+
+    Parameters
+    ----------
+    region_list : list of str
+        Desired regions
+
+    Returns
+    ----------
+    dict
+        For each region: "dates" column and one column for each measure in MEASURE_FIELDS (empty if the region hasn't been found)
+    """
+    columns = load_dataset(REGIONAL_DATASET, ["dates"] + list(MEASURE_FIELDS.keys()) + ["areas"], region_list, data_directory, cache_directory, source)
+
+    region_dict = {}
+
+    for region in region_list:
+        is_region_row = columns["areas"] == region
+
+        region_dict[region] = {column_name: column[is_region_row] for column_name, column in columns.items() if column_name != "areas"}
+
+    return region_dict
+
+
+def load_provincial_data(province_list, data_directory=DATA_DIRECTORY, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Load provincial data
+
+    Parameters
+    ----------
+    province_list : list of str
+        Desired provinces
+
+    Returns
+    ----------
+    dict
+        For each province: "dates" column, one column for each measure in PROVINCIAL_MEASURE_FIELDS (empty if the province hasn't been found) and "region", the name of the region the province belongs to (None if the province hasn't been found)
+    """
+    columns = load_dataset(PROVINCIAL_DATASET, area_list=province_list, data_directory=data_directory, cache_directory=cache_directory, source=source)
+
+    province_dict = {}
+
+    for province in province_list:
+        province_rows = np.flatnonzero(columns["areas"] == province)
+
+        province_dict[province] = {column_name: column[province_rows] for column_name, column in columns.items() if column_name not in AREA_FIELDS[PROVINCIAL_DATASET]}
+        province_dict[province]["region"] = str(columns["regions"][province_rows[0]]) if len(province_rows) > 0 else None
+
+    return province_dict
+
+
+def get_area_names(dataset, data_directory=DATA_DIRECTORY, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Get the names of every area of the dataset
+
+    Returns
+    ----------
+    list of str
+        Sorted area names
+    """
+    return np.unique(load_dataset(dataset, ["areas"], data_directory=data_directory, cache_directory=cache_directory, source=source)["areas"]).tolist()
+
+
+def group_sum(dates, areas, values):
+    """
+    Sum the values of each date and area
+
+    The sums are evaluated at once with a single bincount over the (date, area) pairs
+
+    Parameters
+    ----------
+    dates : array_like
+        Date of each value
+    areas : array_like
+        Area of each value
+    values : array_like
+        Values to sum
+
+    Returns
+    ----------
+    numpy.ndarray
+        Sorted unique dates
+    numpy.ndarray
+        Sorted unique areas
+    numpy.ndarray
+        (len(dates), len(areas)) int64 matrix of the sums (0 if there is no value for the date and area)
+    """
+    unique_dates, date_indices = np.unique(dates, return_inverse=True)
+    unique_areas, area_indices = np.unique(areas, return_inverse=True)
+
+    sums = np.bincount(date_indices.ravel()*len(unique_areas) + area_indices.ravel(), weights=np.asarray(values, dtype=np.float64), minlength=len(unique_dates)*len(unique_areas))
+
+    return unique_dates, unique_areas, np.rint(sums).astype(np.int64).reshape(len(unique_dates), len(unique_areas))
+
+
+def check_provincial_data(data_directory=DATA_DIRECTORY, cache_directory=CACHE_DIRECTORY, source=JSON_SOURCE):
+    """
+    Check provincial data against regional data
+
+    Provincial total cases are rolled up to regions and compared with regional total cases.
+    Regional rows are added with negative sign to provincial ones, so that a single group sum gives the differences
+
+    Returns
+    ----------
+    list of tuple
+        (date, region, difference between provincial and regional total cases) for each mismatch
+    """
+    provincial_columns = load_dataset(PROVINCIAL_DATASET, ["dates", "regions", "total_cases"], data_directory=data_directory, cache_directory=cache_directory, source=source)
+    regional_columns = load_dataset(REGIONAL_DATASET, ["dates", "areas", "total_cases"], data_directory=data_directory, cache_directory=cache_directory, source=source)
+
+    with profiling.span("check_provincial_data"):
+        dates, regions, differences = group_sum(np.concatenate((provincial_columns["dates"], regional_columns["dates"])),
+                                                np.concatenate((provincial_columns["regions"], regional_columns["areas"])),
+                                                np.concatenate((provincial_columns["total_cases"], -np.asarray(regional_columns["total_cases"]))))
+
+    return [(dates[date_index], str(regions[region_index]), int(differences[date_index, region_index])) for date_index, region_index in zip(*np.nonzero(differences))]
+
+
+def get_derived_state_file_path(area_name, cache_directory=CACHE_DIRECTORY):
+    """
+    Get the path of the file containing the derived data of the area
+    """
+    return os.path.join(cache_directory, DERIVED_STATE_DIRECTORY, re.sub(r'[^\w.-]+', '_', area_name) + '.npz')
+
+
+def load_derived_state(area_name, version, cache_directory=CACHE_DIRECTORY):
+    """
+    Load the derived data of the area computed by the previous run
+
+    Parameters
+    ----------
+    area_name : str
+        Area name
+    version : str
+        Version of everything the derived data depends on, besides the data itself (e.g. area colour file, trend window). The state is valid only if it has been saved with the same version
+    cache_directory : str
+        Path of the cache
+
+    Returns
+    ----------
+    dict
+        For each figure name, the saved figure data (see save_derived_state). None if there is no valid state
+    """
+    try:
+        with np.load(get_derived_state_file_path(area_name, cache_directory)) as state_file:
+            if str(state_file["version"]) != version:
+                return None
+
+            derived_state = {}
+
+            for figure_name in state_file["figure_names"]:
+                derived_state[str(figure_name)] = {key: state_file[figure_name + '__' + key] for key in DERIVED_STATE_KEYS}
+
+            return derived_state
+
+    except Exception:
+        # missing or corrupted (e.g. truncated) state
+        return None
+
+
+def save_derived_state(area_name, version, figures_data, cache_directory=CACHE_DIRECTORY):
+    """
+    Save the derived data of the area, so that the next run only needs to compute what changed
+
+    Parameters
+    ----------
+    area_name : str
+        Area name
+    version : str
+        Version of everything the derived data depends on, besides the data itself (see load_derived_state)
+    figures_data : list of dict
+        Figure data of the area, only figures with a trend are saved
+    cache_directory : str
+        Path of the cache
+    """
+    figures_data = [figure_data for figure_data in figures_data if figure_data["trend"] is not None]
+
+    arrays = {
+        "version": np.array(version),
+        "figure_names": np.array([figure_data["name"] for figure_data in figures_data]),
+    }
+
+    for figure_data in figures_data:
+        for key in DERIVED_STATE_KEYS:
+            arrays[figure_data["name"] + '__' + key] = figure_data[key]
+
+    file_path = get_derived_state_file_path(area_name, cache_directory)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    # the state is replaced at once, so an interrupted save leaves the previous state
+    temporary_file_path = file_path + '.tmp.npz'
+    np.savez(temporary_file_path, **arrays)
+    os.replace(temporary_file_path, file_path)
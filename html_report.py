@@ -0,0 +1,340 @@
+import base64
+import json
+import os
+
+import numpy as np
+
+from area_colour import AreaColour
+from metrics_store import get_store_arrays, MEASURE_KIND, TREND_KIND
+
+REPORT_FILE_PATH = 'report.html'
+
+# matplotlib colours used by make_graphs.EVENTS
+CSS_COLOURS = {
+    'r': 'red',
+    'g': 'green',
+    'b': 'blue',
+    'c': 'darkcyan',
+    'm': 'magenta',
+    'y': 'gold',
+    'k': 'black',
+}
+
+REPORT_DATA_MARKER = '/*REPORT_DATA*/'
+
+# every series is a base64-encoded little-endian Float32Array, drawn on canvases by the script
+REPORT_TEMPLATE = '''<!DOCTYPE html>
+<html lang="it">
+<head>
+<meta charset="utf-8">
+<title>COVID data plots</title>
+<style>
+body { font-family: sans-serif; margin: 1em 2em; }
+.figures { display: flex; flex-wrap: wrap; gap: 1em; }
+figure { margin: 0; width: 640px; }
+figure h3 { font-size: 1em; margin: 0.2em 0; }
+canvas { width: 640px; height: 360px; }
+.legend span { margin-right: 1em; font-size: 0.8em; }
+.readout, .notes { font-size: 0.8em; min-height: 1.2em; white-space: pre-line; }
+</style>
+</head>
+<body>
+<h1>COVID data plots</h1>
+<p id="info"></p>
+<label>Area <select id="area"></select></label>
+<div class="figures" id="figures"></div>
+<script id="report-data" type="application/json">/*REPORT_DATA*/</script>
+<script>
+"use strict";
+const report = JSON.parse(document.getElementById("report-data").textContent);
+const DAY_MS = 86400000;
+const MARGIN = {left: 60, right: 10, top: 10, bottom: 30};
+// bands stacked from the bottom, the top (white) band is not filled
+const BANDS = [["RED", "rgba(255,0,0,0.5)"], ["ORANGE", "rgba(255,165,0,0.5)"], ["YELLOW", "rgba(255,255,0,0.5)"]];
+
+function decode(base64) {
+    const bytes = Uint8Array.from(atob(base64), c => c.charCodeAt(0));
+    return new Float32Array(bytes.buffer);
+}
+
+const nAreas = report.areas.length, nMeasures = report.measures.length, nDays = report.n_days, nColours = report.colours.length;
+const measures = decode(report.measure), trends = decode(report.trend), areaColours = decode(report.area_colours);
+
+function series(array, area, measure) {
+    const start = (area*nMeasures + measure)*nDays;
+    return array.subarray(start, start + nDays);
+}
+
+function dateString(day) {
+    return new Date((report.first_day + day)*DAY_MS).toISOString().slice(0, 10);
+}
+
+function niceStep(range, nTicks) {
+    const step = Math.pow(10, Math.floor(Math.log10(range/nTicks)));
+    const ratio = range/nTicks/step;
+    return step*(ratio > 5 ? 10 : ratio > 2 ? 5 : ratio > 1 ? 2 : 1);
+}
+
+function drawFigure(canvas, readout, area, measureIndex) {
+    const measure = series(measures, area, measureIndex), trend = series(trends, area, measureIndex);
+
+    // x range: days with a value, y range: values, trend and 0
+    let first = nDays, last = -1, low = 0, high = 0;
+    for (let day = 0; day < nDays; day++) {
+        for (const value of [measure[day], trend[day]]) {
+            if (Number.isFinite(value)) {
+                first = Math.min(first, day);
+                last = Math.max(last, day);
+                low = Math.min(low, value);
+                high = Math.max(high, value);
+            }
+        }
+    }
+    if (last < first) return;
+    if (high === low) high = low + 1;
+    const padding = 0.05*(high - low);
+    low -= padding;
+    high += padding;
+
+    const ratio = window.devicePixelRatio || 1;
+    canvas.width = canvas.clientWidth*ratio;
+    canvas.height = canvas.clientHeight*ratio;
+    const ctx = canvas.getContext("2d");
+    ctx.scale(ratio, ratio);
+    const width = canvas.clientWidth - MARGIN.left - MARGIN.right, height = canvas.clientHeight - MARGIN.top - MARGIN.bottom;
+    const x = day => MARGIN.left + (day - first)/Math.max(last - first, 1)*width;
+    const y = value => MARGIN.top + (high - value)/(high - low)*height;
+
+    // axes and ticks
+    ctx.strokeStyle = "#ccc";
+    ctx.fillStyle = "#000";
+    ctx.font = "10px sans-serif";
+    ctx.textAlign = "right";
+    const step = niceStep(high - low, 6);
+    for (let value = Math.ceil(low/step)*step; value <= high; value += step) {
+        ctx.beginPath();
+        ctx.moveTo(MARGIN.left, y(value));
+        ctx.lineTo(MARGIN.left + width, y(value));
+        ctx.stroke();
+        ctx.fillText(+value.toPrecision(6), MARGIN.left - 4, y(value) + 3);
+    }
+    ctx.textAlign = "center";
+    const monthStep = Math.max(1, Math.ceil((last - first)/30/10));
+    for (let day = first, month = 0; day <= last; day++) {
+        const date = new Date((report.first_day + day)*DAY_MS);
+        if (date.getUTCDate() === 1 && month++ % monthStep === 0) {
+            ctx.fillText(dateString(day).slice(0, 7), x(day), MARGIN.top + height + 15);
+        }
+    }
+
+    // colour bands underneath the trend
+    const lower = new Float32Array(nDays);
+    for (const [colourName, fillStyle] of BANDS) {
+        const fractions = areaColours.subarray((area*nColours + report.colours.indexOf(colourName))*nDays);
+        const upper = lower.map((value, day) => value + fractions[day]*trend[day]);
+        ctx.fillStyle = fillStyle;
+        ctx.beginPath();
+        const days = [];
+        for (let day = first; day <= last; day++) if (Number.isFinite(trend[day])) days.push(day);
+        days.forEach((day, index) => index === 0 ? ctx.moveTo(x(day), y(upper[day])) : ctx.lineTo(x(day), y(upper[day])));
+        days.reverse().forEach(day => ctx.lineTo(x(day), y(lower[day])));
+        ctx.fill();
+        lower.set(upper);
+    }
+
+    // events
+    ctx.setLineDash([5, 4]);
+    for (const event of report.events) {
+        const day = event.day - report.first_day;
+        if (day < first || day > last) continue;
+        ctx.strokeStyle = event.colour;
+        ctx.beginPath();
+        ctx.moveTo(x(day), MARGIN.top);
+        ctx.lineTo(x(day), MARGIN.top + height);
+        ctx.stroke();
+    }
+    ctx.setLineDash([]);
+
+    // trend and measure
+    ctx.strokeStyle = "red";
+    ctx.beginPath();
+    let isDrawing = false;
+    for (let day = first; day <= last; day++) {
+        if (!Number.isFinite(trend[day])) { isDrawing = false; continue; }
+        isDrawing ? ctx.lineTo(x(day), y(trend[day])) : ctx.moveTo(x(day), y(trend[day]));
+        isDrawing = true;
+    }
+    ctx.stroke();
+    ctx.fillStyle = "#1f77b4";
+    for (let day = first; day <= last; day++) {
+        if (!Number.isFinite(measure[day])) continue;
+        ctx.beginPath();
+        ctx.arc(x(day), y(measure[day]), 2, 0, 2*Math.PI);
+        ctx.fill();
+    }
+
+    canvas.onmousemove = mouseEvent => {
+        const rectangle = canvas.getBoundingClientRect();
+        const day = Math.round(first + (mouseEvent.clientX - rectangle.left - MARGIN.left)/width*Math.max(last - first, 1));
+        if (day < first || day > last) return;
+        readout.textContent = dateString(day) + ": " + (Number.isFinite(measure[day]) ? +measure[day].toPrecision(6) : "-")
+            + (Number.isFinite(trend[day]) ? ", andamento " + +trend[day].toPrecision(6) : "");
+    };
+}
+
+function showArea(area) {
+    const container = document.getElementById("figures");
+    container.replaceChildren();
+    report.titles[area].forEach((title, measureIndex) => {
+        if (title === null) return;
+        const figure = document.createElement("figure");
+        const heading = document.createElement("h3");
+        const canvas = document.createElement("canvas");
+        const readout = document.createElement("div");
+        const legend = document.createElement("div");
+        const notes = document.createElement("div");
+        heading.textContent = title;
+        readout.className = "readout";
+        legend.className = "legend";
+        notes.className = "notes";
+        notes.textContent = report.notes[area][measureIndex] || "";
+        legend.innerHTML = '<span style="color: red">&#9473; Andamento</span>';
+        for (const event of report.events) {
+            const span = document.createElement("span");
+            span.style.color = event.colour;
+            span.textContent = "\\u2504 " + event.label;
+            legend.appendChild(span);
+        }
+        figure.append(heading, canvas, legend, readout, notes);
+        container.appendChild(figure);
+        drawFigure(canvas, readout, area, measureIndex);
+    });
+}
+
+const select = document.getElementById("area");
+report.areas.forEach((name, area) => select.add(new Option(name, area)));
+select.onchange = () => showArea(+select.value);
+document.getElementById("info").textContent = Object.entries(report.info).map(([key, value]) => key + ": " + value).join(", ");
+showArea(0);
+</script>
+</body>
+</html>
+'''
+
+
+def encode_array(array):
+    """
+    Encode an array as base64 little-endian float32 values
+    """
+    return base64.b64encode(np.ascontiguousarray(array, dtype='<f4').tobytes()).decode('ascii')
+
+
+def get_area_colours(figures_data, area_names, dates):
+    """
+    Get the area colours of every area on the report day axis
+
+    Colours depend only on the area and on the day, so they are embedded once for each area instead of the colour bands of every measure
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each measure of each area (see make_graphs.compute_measure)
+    area_names : list of str
+        Area names, in report order
+    dates : numpy.ndarray
+        (days,) datetime64[D], the report day axis
+
+    Returns
+    ----------
+    numpy.ndarray
+        (areas, len(AreaColour), days) area colours (see area_colour.get_area_colour), 0 where no figure of the area has a colour
+    """
+    area_indices = {area_name: area_index for area_index, area_name in enumerate(area_names)}
+    area_colours = np.zeros((len(area_names), len(AreaColour), len(dates)), dtype=np.float32)
+
+    for figure_data in figures_data:
+        if figure_data.get("area_colours") is not None:
+            area_colours[area_indices[figure_data["area_name"]]][:, (figure_data["dates"] - dates[0]).astype(np.int64)] = figure_data["area_colours"]
+
+    return area_colours
+
+
+def get_report_data(figures_data, info=None):
+    """
+    Get the data embedded in the report
+
+    Every figure is laid out on the same day axis (see metrics_store.get_store_arrays), so that the data of all the areas is encoded at once
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each measure of each area (see make_graphs.compute_measure)
+    info : dict
+        Information shown at the top of the report (e.g. data commit)
+
+    Returns
+    ----------
+    dict
+        JSON-serializable report data
+    """
+    from make_graphs import EVENTS
+
+    index, dates, arrays = get_store_arrays(figures_data)
+
+    area_indices = {area_name: area_index for area_index, area_name in enumerate(index["areas"])}
+    measure_indices = {measure_name: measure_index for measure_index, measure_name in enumerate(index["measures"])}
+
+    titles = [[None]*len(index["measures"]) for _ in index["areas"]]
+    notes = [[None]*len(index["measures"]) for _ in index["areas"]]
+
+    # figures without a title are not shown, as series with no dates (e.g. the ratio of an area with 2 days of data)
+    for figure_data in figures_data:
+        if len(figure_data["dates"]) == 0:
+            continue
+
+        titles[area_indices[figure_data["area_name"]]][measure_indices[figure_data["name"]]] = figure_data["title"]
+        notes[area_indices[figure_data["area_name"]]][measure_indices[figure_data["name"]]] = figure_data["notes"]
+
+    return {
+        "info": info or {},
+        "areas": index["areas"],
+        "measures": index["measures"],
+        "colours": [colour.name for colour in AreaColour],
+        "first_day": int(dates[0].astype(np.int64)),
+        "n_days": len(dates),
+        "titles": titles,
+        "notes": notes,
+        "events": [{"day": int(np.datetime64(event_date, 'D').astype(np.int64)), "label": label, "colour": CSS_COLOURS.get(colour, colour)} for event_date, label, colour in EVENTS],
+        "measure": encode_array(arrays[MEASURE_KIND]),
+        "trend": encode_array(arrays[TREND_KIND]),
+        "area_colours": encode_array(get_area_colours(figures_data, index["areas"], dates)),
+    }
+
+
+def write_report(figures_data, file_path=REPORT_FILE_PATH, info=None):
+    """
+    Write a self-contained HTML report
+
+    The figure data of every area is embedded as base64-encoded typed arrays and drawn by the bundled script, an area can be selected in the page
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each measure of each area (see make_graphs.compute_measure)
+    file_path : str
+        Report file path
+    info : dict
+        Information shown at the top of the report (e.g. data commit)
+
+    Returns
+    ----------
+    int
+        Report size [bytes]
+    """
+    # "</" would close the script element
+    report_data = json.dumps(get_report_data(figures_data, info), separators=(',', ':')).replace('</', '<\\/')
+
+    with open(file_path, 'w', encoding='utf-8') as report_file:
+        report_file.write(REPORT_TEMPLATE.replace(REPORT_DATA_MARKER, report_data))
+
+    return os.path.getsize(file_path)
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import quote
+
+import numpy as np
+
+from api_server import DEFAULT_HOST, DEFAULT_PORT, FORMATS
+
+N_CONNECTIONS = 16
+N_REQUESTS = 10000
+PERCENTILES = [50, 90, 99]
+
+
+async def request(reader, writer, host, target, etag=None):
+    """
+    Send a GET request over a keep-alive connection and read the response
+
+    Returns
+    ----------
+    int
+        Status code
+    dict
+        Response headers (lower case names)
+    bytes
+        Body
+    """
+    writer.write(('GET ' + target + ' HTTP/1.1\r\nHost: ' + host + '\r\n'
+                  + ('If-None-Match: ' + etag + '\r\n' if etag is not None else '')
+                  + '\r\n').encode('latin-1'))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+
+    headers = {}
+    while True:
+        header_line = await reader.readline()
+        if header_line in (b'\r\n', b''):
+            break
+        name, _, value = header_line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+    return status, headers, body
+
+
+async def get_targets(host, port):
+    """
+    Get the target of every series and colour endpoint served, in every format
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    _, _, body = await request(reader, writer, host, '/areas')
+    writer.close()
+
+    content = json.loads(body)
+    targets = []
+
+    for area in content["areas"]:
+        for response_format in FORMATS:
+            targets += ['/series/' + quote(area) + '/' + measure + '/' + kind + '?format=' + response_format for measure, kinds in content["measures"].items() for kind in kinds]
+            targets.append('/colours/' + quote(area) + '?format=' + response_format)
+
+    return targets
+
+
+async def run_client(host, port, targets, n_requests, is_conditional, latencies, status_counts):
+    """
+    Send n_requests requests over one connection, cycling through targets
+
+    If is_conditional, the ETag of the first response of each target is sent back with the following requests of the target
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+
+    for request_index in range(n_requests):
+        target = targets[request_index % len(targets)]
+
+        start_time = time.perf_counter()
+        status, headers, _ = await request(reader, writer, host, target, etags.get(target))
+        latencies.append(time.perf_counter() - start_time)
+
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+        if is_conditional and 'etag' in headers:
+            etags[target] = headers['etag']
+
+    writer.close()
+
+    return
+
+
+async def run_load_test(host=DEFAULT_HOST, port=DEFAULT_PORT, n_connections=N_CONNECTIONS, n_requests=N_REQUESTS, is_conditional=False):
+    """
+    Run the load test: n_requests requests spread over n_connections concurrent keep-alive connections
+
+    Returns
+    ----------
+    numpy.ndarray
+        Latency of each request [s]
+    dict
+        Number of responses for each status code
+    float
+        Elapsed time [s]
+    """
+    targets = await get_targets(host, port)
+
+    latencies = []
+    status_counts = {}
+
+    start_time = time.perf_counter()
+
+    # each client starts from a different target, so that concurrent requests are not all the same
+    await asyncio.gather(*[run_client(host, port, targets[client_index*len(targets)//n_connections:] + targets[:client_index*len(targets)//n_connections], n_requests//n_connections + (client_index < n_requests % n_connections), is_conditional, latencies, status_counts) for client_index in range(n_connections)])
+
+    return np.array(latencies), status_counts, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Load test the API server (see api_server.py)')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='server address (default to %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='server port (default to %(default)s)')
+    parser.add_argument('--connections', type=int, default=N_CONNECTIONS, help='number of concurrent connections (default to %(default)s)')
+    parser.add_argument('--requests', type=int, default=N_REQUESTS, help='total number of requests (default to %(default)s)')
+    parser.add_argument('--conditional', action='store_true', help='send back ETags, so that repeated requests are answered with 304 Not Modified')
+    args = parser.parse_args()
+
+    latencies, status_counts, elapsed_time = asyncio.run(run_load_test(args.host, args.port, args.connections, args.requests, args.conditional))
+
+    print(f"{len(latencies)} requests over {args.connections} connections in {elapsed_time:.3f} s: {len(latencies)/elapsed_time:.0f} requests/s")
+    print("Status codes: " + ', '.join(f"{status} x {count}" for status, count in sorted(status_counts.items())))
+    print("Latency: " + ', '.join(f"p{percentile} {np.percentile(latencies, percentile)*1e3:.3f} ms" for percentile in PERCENTILES) + f", max {latencies.max()*1e3:.3f} ms")
+
+    exit(0)
@@ -1,144 +1,438 @@
+import time
 
-import json
+# measure startup time from the beginning of the imports
+START_TIME = time.perf_counter()
+
+import argparse
+import concurrent.futures
+import multiprocessing
 import os
-import sys
-from datetime import datetime, date
-import math
-import git
-
-# plotting
-import matplotlib
-import matplotlib.pyplot as plt
+import re
+
+# plotting (matplotlib is imported only when something has to be drawn)
 import numpy as np
 
-from area_colour import get_area_colour, AreaColour
+from area_colour import get_area_colour, AreaColour, AREA_COLOUR_FILE_PATH
+from dpc_data import load_national_data, load_regional_data, load_provincial_data, get_area_names, check_provincial_data, load_derived_state, save_derived_state, clone_data, fetch_data, merge_data, get_data_commit, get_changed_data_files, DATA_DIRECTORY, DATA_REPOSITORY_URL, REGIONAL_DATASET, JSON_SOURCE, SOURCES
+import profiling
+from analysis import get_trend, update_trend, get_first_change, trend_offset, colour_bands, min_max_downsample, estimate_test_delay, check_window, TREND_WINDOW, LINEAR_SMOOTHER, SMOOTHERS, MAX_TEST_DELAY, FEASIBLE_CRITERION, TEST_DELAY_CRITERIA
 
 N_TICKS = 10
+# default number of points drawn for each series in level-of-detail mode
+MAX_DRAWN_POINTS = 500
 n_figures = 0
 
 DATE_STRING_FORMAT = "%d %b '%y"
 
+# events (sorted by date) shown as vertical lines: date, label, colour
+EVENTS = [
+    (np.datetime64('2020-09-14'), 'Riapertura scuole', 'g'),
+    (np.datetime64('2020-10-24'), 'DPCM 24 ottobre', 'c'),
+    (np.datetime64('2020-11-03'), 'DPCM 3 novembre', 'm'),
+    (np.datetime64('2020-12-21'), 'Blocco regioni', 'b'),
+    (np.datetime64('2020-12-25'), 'Natale', 'g'),
+]
+EVENT_DATES = np.array([event[0] for event in EVENTS], dtype='datetime64[D]')
+
+FILE_FORMATS = ['png', 'svg']
+DEFAULT_FILE_FORMAT = 'png'
+
+OVERLAY_LAYOUT = 'overlay'
+GRID_LAYOUT = 'grid'
+COMPARISON_LAYOUTS = [OVERLAY_LAYOUT, GRID_LAYOUT]
+
+
+def compute_trend(measure, area_colours, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute trend
+    
+    By default the trend is calculated as mid point of two-weeks linear regression on measure (with 13 days overlapping), other smoothers can be selected (see analysis.SMOOTHERS)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Trend values, the first one refers to measure[trend_offset(window, smoother)]
+    numpy.ndarray
+        Colour bands underneath the trend (see analysis.colour_bands)
+    """
+    trend = get_trend(measure, window, smoother)
+    offset = trend_offset(window, smoother)
+
+    # Region plot:
+    # The area underneath the trend shall be filled with the colour assigned to the region for that day
+    # National plot:
+    # The area underneath the trend shall be coloured with every colour in proportion to the number of regions assigned to that colour
+    # Example: if half of the regions are marked as red on a specifc day, then half of the area underneath the trend will be filled with red on that day
+    area_colours_data = colour_bands(trend, area_colours[:, offset:offset+len(trend)])
+
+    return trend, area_colours_data
 
-def plot_trend(measure, dates, area_colours, ax):
+
+def plot_trend(trend, trend_dates, area_colours_data, ax):
     """
     Plot trend
     
-    The trend is calculated as mid point of two-weeks linear regression on measure (with 13 days overlapping)
-    """
-    trend = []
-    trend_dates = []
-    trend_index = 0
-    area_colours_data = np.zeros((AreaColour.NONE.value+1, len(dates)-13))
-
-    for index, day in enumerate(dates):
-        # avoid first and last 7 days due to insufficient data
-        if (index < 7 or index > len(dates)-7): continue
-
-        model = np.polyfit(np.arange(0, 14), measure[index-7:index+7], 1)
-        predict = np.poly1d(model)
-        trend.append(predict(7))
-        trend_dates.append(day)
-
-        if type(area_colours[index]) is AreaColour:
-            # Region plot:
-            # The area underneath the trend shall be filled with the colour assigned to the region for that day
-            if area_colours[index] is AreaColour.RED:
-                area_colours_data[AreaColour.RED.value][trend_index] = trend[trend_index]
-                area_colours_data[AreaColour.ORANGE.value][trend_index] = trend[trend_index]
-                area_colours_data[AreaColour.YELLOW.value][trend_index] = trend[trend_index]
-                area_colours_data[AreaColour.NONE.value][trend_index] = trend[trend_index]
-            elif area_colours[index] is AreaColour.ORANGE:
-                area_colours_data[AreaColour.ORANGE.value][trend_index] = trend[trend_index]
-                area_colours_data[AreaColour.YELLOW.value][trend_index] = trend[trend_index]
-                area_colours_data[AreaColour.NONE.value][trend_index] = trend[trend_index]
-            elif area_colours[index] is AreaColour.YELLOW:
-                area_colours_data[AreaColour.YELLOW.value][trend_index] = trend[trend_index]
-                area_colours_data[AreaColour.NONE.value][trend_index] = trend[trend_index]
-            elif area_colours[index] is AreaColour.WHITE or area_colours[index] is AreaColour.NONE:
-                area_colours_data[AreaColour.NONE.value][trend_index] = trend[trend_index]
-        else:
-            # National plot:
-            # The area underneath the trend shall be coloured with every colour in proportion to the number of regions assigned to that colour
-            # Example: if half of the regions are marked as red on a specifc day, then half of the area underneath the trend will be filled with red on that day
-            area_colours_data[AreaColour.RED.value][trend_index] = trend[trend_index]*area_colours[index][AreaColour.RED]
-            area_colours_data[AreaColour.ORANGE.value][trend_index] = trend[trend_index]*area_colours[index][AreaColour.ORANGE] + area_colours_data[AreaColour.RED.value][trend_index]
-            area_colours_data[AreaColour.YELLOW.value][trend_index] = trend[trend_index]*area_colours[index][AreaColour.YELLOW] + area_colours_data[AreaColour.ORANGE.value][trend_index]
-            area_colours_data[AreaColour.NONE.value][trend_index] = trend[trend_index]*area_colours[index][AreaColour.NONE] + area_colours_data[AreaColour.YELLOW.value][trend_index]
-        
-        trend_index += 1
-
-    ax.plot(trend_dates, trend, label='Andamento', color='r')
-
-    ax.fill_between(trend_dates, area_colours_data[AreaColour.RED.value], 0, color='red', alpha=0.5)
-    ax.fill_between(trend_dates, area_colours_data[AreaColour.ORANGE.value], area_colours_data[AreaColour.RED.value], color='orange', alpha=0.5)
-    ax.fill_between(trend_dates, area_colours_data[AreaColour.YELLOW.value], area_colours_data[AreaColour.ORANGE.value], color='yellow', alpha=0.5)
-    ax.fill_between(trend_dates, area_colours_data[AreaColour.NONE.value], area_colours_data[AreaColour.YELLOW.value], color='white')
+    Plot the trend and the colour bands underneath it
+
+    Returns
+    ----------
+    matplotlib.lines.Line2D
+        Trend line
+    list
+        Colour bands (see plot_colour_bands)
+    """
+    trend_line, = ax.plot(trend_dates, trend, label='Andamento', color='r')
+
+    return trend_line, plot_colour_bands(trend_dates, area_colours_data, ax)
 
-    return
+
+def plot_colour_bands(trend_dates, area_colours_data, ax):
+    """
+    Plot colour bands
+
+    Fill the area underneath the trend with the colour bands (see analysis.colour_bands)
+
+    Returns
+    ----------
+    list
+        Filled area of each colour
+    """
+    return [
+        ax.fill_between(trend_dates, area_colours_data[AreaColour.RED.value-1], 0, color='red', alpha=0.5),
+        ax.fill_between(trend_dates, area_colours_data[AreaColour.ORANGE.value-1], area_colours_data[AreaColour.RED.value-1], color='orange', alpha=0.5),
+        ax.fill_between(trend_dates, area_colours_data[AreaColour.YELLOW.value-1], area_colours_data[AreaColour.ORANGE.value-1], color='yellow', alpha=0.5),
+        ax.fill_between(trend_dates, area_colours_data[AreaColour.NONE.value-1], area_colours_data[AreaColour.YELLOW.value-1], color='white'),
+    ]
 
 
 def plot_events(dates, ax):
     """
     Plot events
     
-    Plot events as vertical lines
+    Plot events as vertical lines (only the events within the dates)
     """
-    ax.axvline(dates.index(date(2020, 9, 14).strftime(DATE_STRING_FORMAT)), label='Riapertura scuole', linestyle='--', color='g')
-    ax.axvline(dates.index(date(2020, 10, 24).strftime(DATE_STRING_FORMAT)), label='DPCM 24 ottobre', linestyle='--', color='c')
-    ax.axvline(dates.index(date(2020, 11, 3).strftime(DATE_STRING_FORMAT)), label='DPCM 3 novembre', linestyle='--', color='m')
-    ax.axvline(dates.index(date(2020, 12, 21).strftime(DATE_STRING_FORMAT)), label='Blocco regioni', linestyle='--', color='b')
-    ax.axvline(dates.index(date(2020, 12, 25).strftime(DATE_STRING_FORMAT)), label='Natale', linestyle='--', color='g')
+    if len(dates) == 0:
+        return
+
+    first_event = np.searchsorted(EVENT_DATES, dates[0], side='left')
+    last_event = np.searchsorted(EVENT_DATES, dates[-1], side='right')
+
+    for event_date, label, colour in EVENTS[first_event:last_event]:
+        ax.axvline(event_date, label=label, linestyle='--', color=colour)
 
     return
 
 
-def plot_measure(measure, dates, title, area_colours=[], is_variation=False, notes=None):
+def get_derived_state_version(window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
     """
-    Plot single measure
-    
-    Plot measure, define each plot style, plot trend, ...
+    Get the version of everything the derived data depends on, besides the data itself (see dpc_data.load_derived_state)
     """
-    global n_figures
+    return f"{os.stat(AREA_COLOUR_FILE_PATH).st_mtime_ns}-{smoother}-{window}"
+
+
+def compute_measure(measure, dates, title, area_colours=None, is_variation=False, notes=None, name=None, previous_figure_data=None, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute single measure
+
+    Collect everything needed to draw the measure, so that drawing doesn't require any further computation.
+    If the figure data computed from a previous version of the data is provided, the trend and the colour bands are computed only where the data changed
+
+    Returns
+    ----------
+    dict
+        Figure data: measure, dates, title, notes, name, area colours of each date and, if is_variation, trend, colour bands and trend offset (index of the measure sample the first trend sample refers to)
+    """
+    figure_data = {
+        "name": name,
+        "title": title,
+        "measure": np.asarray(measure),
+        "dates": np.asarray(dates, dtype='datetime64[D]'),
+        "notes": notes,
+        "trend": None,
+        "colour_bands": None,
+        "trend_offset": trend_offset(window, smoother),
+        "area_colours": area_colours,
+    }
 
-    fig = plt.figure(n_figures)
-    ax = fig.subplots()
+    if is_variation and previous_figure_data is not None:
+        with profiling.span("trend", title=title, incremental=True):
+            first_change = min(get_first_change(previous_figure_data["dates"], figure_data["dates"]),
+                               get_first_change(previous_figure_data["measure"], figure_data["measure"]))
 
-    # convert date into suitable string format
-    dates = [day.strftime(DATE_STRING_FORMAT) for day in dates]
+            figure_data["trend"], n_unchanged = update_trend(previous_figure_data["trend"], first_change, figure_data["measure"], window, smoother)
 
-    # plot measure
-    ax.plot(dates, measure, marker='o', linestyle='None')
+            offset = figure_data["trend_offset"]
+            figure_data["colour_bands"] = np.concatenate((previous_figure_data["colour_bands"][:, :n_unchanged],
+                                                          colour_bands(figure_data["trend"][n_unchanged:], area_colours[:, offset+n_unchanged:offset+len(figure_data["trend"])])), axis=1)
 
-    # plot trend
-    if is_variation:
-        plot_trend(measure, dates, area_colours, ax)
+    elif is_variation:
+        with profiling.span("trend", title=title, incremental=False):
+            figure_data["trend"], figure_data["colour_bands"] = compute_trend(figure_data["measure"], area_colours, window, smoother)
 
-    # plot events
-    plot_events(dates, ax)
+    return figure_data
 
-    # plot notes, if any
-    if notes:
-        plt.figtext(0.5, 0.03, notes, fontsize=9, horizontalalignment='center', wrap=True)
 
-    # x axis properties
-    dates_step = math.floor(len(dates)/(N_TICKS-1))
-    ax.set_xticks(np.arange(0, len(dates), dates_step))
-    ax.set_xticklabels(dates[0::dates_step])
+def get_drawn_indices(dates, values, date_limits=None, max_points=MAX_DRAWN_POINTS):
+    """
+    Get the indices of the samples to draw
+
+    The samples within the date limits are downsampled to about max_points points (see analysis.min_max_downsample).
+    One more sample is kept beyond each limit, so that lines reach the edges of the axes
+
+    Parameters
+    ----------
+    dates : numpy.ndarray
+        Sorted dates of the series
+    values : numpy.ndarray
+        Values of the series
+    date_limits : tuple of numpy.datetime64
+        First and last visible date (default to every date)
+    max_points : int
+        Maximum number of drawn samples (about)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Sorted indices
+    """
+    start = 0
+    end = len(dates)
+
+    if date_limits is not None:
+        start = max(np.searchsorted(dates, date_limits[0], side='left') - 1, 0)
+        end = min(np.searchsorted(dates, date_limits[1], side='right') + 1, len(dates))
+
+    return start + min_max_downsample(values[start:end], max(max_points//2 - 1, 1))
+
+
+class MeasureFigure:
+    """
+    Measure figure class
+
+    This class draws the figure data of a measure (see compute_measure) and keeps its artists, so that the figure can be updated in place when the data changes.
+    In level-of-detail mode the number of drawn points is bounded: series are downsampled within the visible dates, and sampled again whenever the x limits change (e.g. zoom, pan)
+    """
+    def __init__(self, fig, figure_data, max_points=None):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        fig : matplotlib.figure.Figure
+            Figure to draw on
+        figure_data : dict
+            Figure data of the measure (see compute_measure)
+        max_points : int
+            Maximum number of points drawn for each series (default to every point)
+        """
+        import matplotlib.dates as mdates
+
+        self.fig = fig
+        self.ax = fig.subplots()
+        self.figure_data = figure_data
+        self.max_points = max_points
+        self.date_limits = None
+        self.is_drawing = False
+
+        dates, measure, trend_dates, trend, area_colours_data = self.get_drawn_data()
+
+        # plot measure
+        self.measure_line, = self.ax.plot(dates, measure, marker='o', linestyle='None')
+
+        # plot trend
+        self.trend_line = None
+        self.colour_bands = []
+
+        if trend is not None:
+            self.trend_line, self.colour_bands = plot_trend(trend, trend_dates, area_colours_data, self.ax)
+
+        # plot events
+        plot_events(figure_data["dates"], self.ax)
+
+        # plot notes, if any
+        self.notes = fig.text(0.5, 0.03, figure_data["notes"] or '', fontsize=9, horizontalalignment='center', wrap=True)
+
+        # x axis properties (only the shown ticks are formatted)
+        self.ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=N_TICKS))
+        self.ax.xaxis.set_major_formatter(mdates.DateFormatter(DATE_STRING_FORMAT))
+        fig.autofmt_xdate()
+
+        # other properties
+        self.ax.set(title=figure_data["title"])
+        self.ax.legend()
+
+        if max_points is not None:
+            self.ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+    def get_drawn_data(self, date_limits=None):
+        """
+        Get the data to draw
+
+        Every sample, or in level-of-detail mode the samples chosen within the date limits (see get_drawn_indices)
+
+        Parameters
+        ----------
+        date_limits : tuple of numpy.datetime64
+            First and last visible date (default to every date)
+
+        Returns
+        ----------
+        tuple
+            Dates, measure, trend dates, trend and colour bands (the last three are None if there is no trend)
+        """
+        dates = self.figure_data["dates"]
+        measure = self.figure_data["measure"]
+        trend = self.figure_data["trend"]
+
+        if trend is None:
+            trend_dates = area_colours_data = None
+        else:
+            offset = self.figure_data["trend_offset"]
+            trend_dates = dates[offset:offset+len(trend)]
+            area_colours_data = self.figure_data["colour_bands"]
+
+        if self.max_points is None:
+            return dates, measure, trend_dates, trend, area_colours_data
 
-    # other properties
-    ax.set(title=title)
-    ax.legend()
+        indices = get_drawn_indices(dates, measure, date_limits, self.max_points)
+
+        if trend is None:
+            return dates[indices], measure[indices], None, None, None
+
+        trend_indices = get_drawn_indices(trend_dates, trend, date_limits, self.max_points)
+
+        return dates[indices], measure[indices], trend_dates[trend_indices], trend[trend_indices], area_colours_data[:, trend_indices]
+
+    def draw_data(self, date_limits=None):
+        """
+        Update the artists with the data to draw (see get_drawn_data), colour bands are drawn again
+        """
+        dates, measure, trend_dates, trend, area_colours_data = self.get_drawn_data(date_limits)
+
+        # adding the colour bands may autoscale the axes, which changes the x limits
+        self.is_drawing = True
+
+        self.measure_line.set_data(dates, measure)
+
+        if self.trend_line is not None:
+            self.trend_line.set_data(trend_dates, trend)
+
+            for colour_band in self.colour_bands:
+                colour_band.remove()
+            self.colour_bands = plot_colour_bands(trend_dates, area_colours_data, self.ax)
+
+        self.is_drawing = False
+
+        return
+
+    def on_xlim_changed(self, ax):
+        """
+        Sample the data again for the visible dates (level-of-detail mode)
+        """
+        import matplotlib.dates as mdates
+
+        date_limits = tuple(np.datetime64(mdates.num2date(x_limit).replace(tzinfo=None), 'D') for x_limit in ax.get_xlim())
+
+        # limits are set again on every autoscale, even when they don't change
+        if date_limits == self.date_limits or self.is_drawing:
+            return
+
+        self.date_limits = date_limits
+        self.draw_data(date_limits)
+
+        return
+
+    def update(self, figure_data):
+        """
+        Update the figure with a new version of the figure data
+
+        Lines are updated in place, colour bands are drawn again
+
+        Parameters
+        ----------
+        figure_data : dict
+            Figure data of the same measure and area (see compute_measure)
+        """
+        self.figure_data = figure_data
+        self.date_limits = None
+
+        self.draw_data()
+
+        self.notes.set_text(figure_data["notes"] or '')
+        self.ax.set(title=figure_data["title"])
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+        # the limits might not have changed
+        if self.max_points is not None:
+            self.on_xlim_changed(self.ax)
+
+        return
+
+
+def draw_measure(figure_data, fig, max_points=None):
+    """
+    Draw single measure
+
+    Draw the figure data (see compute_measure) on the figure, define each plot style, ...
+    If max_points is provided, at most about max_points points are drawn for each series (see MeasureFigure)
+
+    Returns
+    ----------
+    MeasureFigure
+        The drawn figure, it can be updated in place
+    """
+    return MeasureFigure(fig, figure_data, max_points)
+
+
+def plot_figure(figure_data, max_points=None):
+    """
+    Plot single figure
+
+    Draw the figure data (see compute_measure) on a new interactive figure (see draw_measure)
+
+    Returns
+    ----------
+    MeasureFigure
+        The drawn figure
+    """
+    import matplotlib.pyplot as plt
+
+    global n_figures
+
+    with profiling.span("draw", title=figure_data["title"]):
+        measure_figure = draw_measure(figure_data, plt.figure(n_figures), max_points)
 
     n_figures += 1
 
+    return measure_figure
+
+
+def plot_measure(measure, dates, title, area_colours=None, is_variation=False, notes=None):
+    """
+    Plot single measure
+    
+    Plot measure, define each plot style, plot trend, ...
+    """
+    plot_figure(compute_measure(measure, dates, title, area_colours, is_variation, notes))
+
     return
 
 
-def plot_all_measures(dates, hospitalized_with_sympthoms, intensive_care_unit, staying_at_home, positives, healed, deaths, n_tests, area_colours, area_name):
+def compute_all_measures(dates, hospitalized_with_sympthoms, intensive_care_unit, staying_at_home, positives, healed, deaths, n_tests, area_colours, area_name, incremental=False, max_test_delay=MAX_TEST_DELAY, test_delay_criterion=FEASIBLE_CRITERION, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
     """
-    Plot all measures
+    Compute all measures
     
-    Derive and plot data for all measures
+    Derive data for all measures.
+    If incremental, the data derived by the previous run is loaded and only the days affected by new or changed data are computed, then the new derived data is saved.
+    The test delay used for the positives/tests ratio is estimated up to max_test_delay days with test_delay_criterion (see analysis.estimate_test_delay).
+    Trends are evaluated by smoother over window days (see analysis.get_trend)
+
+    Returns
+    ----------
+    list
+        Figure data for each measure (see compute_measure)
     """
     variation_hospitalized_with_sympthoms = np.diff(np.array(hospitalized_with_sympthoms))
     variation_intensive_care_unit = np.diff(np.array(intensive_care_unit))
@@ -149,189 +443,932 @@ def plot_all_measures(dates, hospitalized_with_sympthoms, intensive_care_unit, s
     variation_n_tests = np.diff(np.array(n_tests))
     variation_n_tests = np.where(variation_n_tests==0, 1, variation_n_tests)
 
-    plot_measure(variation_hospitalized_with_sympthoms, dates[1:], 'Variazione ricoverati con sintomi - ' + area_name, area_colours[1:], is_variation=True)
-    plot_measure(variation_intensive_care_unit, dates[1:], 'Variazione terapia intensiva - ' + area_name, area_colours[1:], is_variation=True)
-    plot_measure(variation_staying_at_home, dates[1:], 'Variazione isolamento domiciliare - ' + area_name, area_colours[1:], is_variation=True)
-    plot_measure(variation_positives, dates[1:], 'Variazione positivi - ' + area_name, area_colours[1:], is_variation=True)
-    plot_measure(variation_healed, dates[1:], 'Variazione guariti - ' + area_name, area_colours[1:], is_variation=True)
-    plot_measure(variation_deaths, dates[1:], 'Variazione deceduti - ' + area_name, area_colours[1:], is_variation=True)
+    derived_state = {}
+    if incremental:
+        with profiling.span("load_derived_state", area=area_name):
+            derived_state = load_derived_state(area_name, get_derived_state_version(window, smoother)) or {}
+
+    figures_data = [
+        compute_measure(variation_hospitalized_with_sympthoms, dates[1:], 'Variazione ricoverati con sintomi - ' + area_name, area_colours[:, 1:], is_variation=True, name='hospitalized_with_sympthoms', previous_figure_data=derived_state.get('hospitalized_with_sympthoms'), window=window, smoother=smoother),
+        compute_measure(variation_intensive_care_unit, dates[1:], 'Variazione terapia intensiva - ' + area_name, area_colours[:, 1:], is_variation=True, name='intensive_care_unit', previous_figure_data=derived_state.get('intensive_care_unit'), window=window, smoother=smoother),
+        compute_measure(variation_staying_at_home, dates[1:], 'Variazione isolamento domiciliare - ' + area_name, area_colours[:, 1:], is_variation=True, name='staying_at_home', previous_figure_data=derived_state.get('staying_at_home'), window=window, smoother=smoother),
+        compute_measure(variation_positives, dates[1:], 'Variazione positivi - ' + area_name, area_colours[:, 1:], is_variation=True, name='positives', previous_figure_data=derived_state.get('positives'), window=window, smoother=smoother),
+        compute_measure(variation_healed, dates[1:], 'Variazione guariti - ' + area_name, area_colours[:, 1:], is_variation=True, name='healed', previous_figure_data=derived_state.get('healed'), window=window, smoother=smoother),
+        compute_measure(variation_deaths, dates[1:], 'Variazione deceduti - ' + area_name, area_colours[:, 1:], is_variation=True, name='deaths', previous_figure_data=derived_state.get('deaths'), window=window, smoother=smoother),
+    ]
+    # the test result is not ready on the same day of the test
+    # the number of days to wait is estimated to best match the number of tests with the number of positives (but it is not reliable)
+    with profiling.span("test_delay_search", area=area_name):
+        test_delay = estimate_test_delay(variation_positives, variation_n_tests, max_test_delay, test_delay_criterion)
+
+    n_days_to_wait_before_test_result = test_delay["lag"]
+    ratio_positive_over_tests = test_delay["ratio"]
 
-    # we assume that one day after the test the result is ready
-    # this is needed to best match the number of tests with the number of positives (but it is not reliable)
-    n_days_to_wait_before_test_result = 1
-    ratio_positive_over_tests = variation_positives[n_days_to_wait_before_test_result:]/variation_n_tests[:-n_days_to_wait_before_test_result]
+    # set the maximum ratio to +-1
+    ratio_positive_over_tests = np.where(ratio_positive_over_tests>1, 1, ratio_positive_over_tests)
+    ratio_positive_over_tests = np.where(ratio_positive_over_tests<-1, -1, ratio_positive_over_tests)
 
-    # check if the assumption leads to impossible result (ratio>1)
-    if np.any(ratio_positive_over_tests > 1):
+    figures_data.append(compute_measure(ratio_positive_over_tests, dates[1+n_days_to_wait_before_test_result:], 'Rapporto positivi/numero tamponi - ' + area_name, area_colours[:, 1+n_days_to_wait_before_test_result:], is_variation=True, notes='Il rapporto è stato calcolato assumendo che il risultato del tampone arrivasse '+ str(n_days_to_wait_before_test_result) +' giorno/i dopo il test. \nL\'assunzione è forte e poco affidabile, serve solo per mostrare un grafico dell\'andamento', name='ratio_positives_over_tests', previous_figure_data=derived_state.get('ratio_positives_over_tests'), window=window, smoother=smoother))
 
-        print(n_days_to_wait_before_test_result, "day(s) to wait before test result leads to an impossible ratio. Trying with higher number of days...")
+    # keep the test delay diagnostics with the ratio
+    figures_data[-1]["test_delay"] = {key: value for key, value in test_delay.items() if key != "ratio"}
 
-        # try every number of days up to 5
-        for n_days_to_wait_before_test_result in range(2, 6):
-            print("Evaluating", n_days_to_wait_before_test_result, "...")
-            ratio_positive_over_tests = variation_positives[n_days_to_wait_before_test_result:]/variation_n_tests[:-n_days_to_wait_before_test_result]
+    for figure_data in figures_data:
+        figure_data["area_name"] = area_name
 
-            if np.any(ratio_positive_over_tests > 1) and n_days_to_wait_before_test_result<5 :
-                print("Impossible ratio, continue")
-                continue
+    if incremental:
+        with profiling.span("save_derived_state", area=area_name):
+            save_derived_state(area_name, get_derived_state_version(window, smoother), figures_data)
 
-            elif np.any(ratio_positive_over_tests > 1):
-                print("Impossible ratio. Any number of days leads to impossible result. Fallback to 1 number of days")
-                n_days_to_wait_before_test_result = 1
-                ratio_positive_over_tests = variation_positives[n_days_to_wait_before_test_result:]/variation_n_tests[:-n_days_to_wait_before_test_result]
-                break
+    return figures_data
 
-            else:
-                print("Possible number of days found")
 
-                break
-    
-    # set the maximum ratio to +-1
-    ratio_positive_over_tests = np.where(ratio_positive_over_tests>1, 1, ratio_positive_over_tests)
-    ratio_positive_over_tests = np.where(ratio_positive_over_tests<-1, -1, ratio_positive_over_tests)
+def compute_provincial_measures(dates, total_cases, area_colours, area_name, incremental=False, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute provincial measures
+
+    Derive data for the measures available for provinces (only the total number of cases).
+    If incremental, only the days affected by new or changed data are computed (see compute_all_measures)
+
+    Returns
+    ----------
+    list
+        Figure data for each measure (see compute_measure)
+    """
+    variation_total_cases = np.diff(np.array(total_cases))
+
+    derived_state = {}
+    if incremental:
+        with profiling.span("load_derived_state", area=area_name):
+            derived_state = load_derived_state(area_name, get_derived_state_version(window, smoother)) or {}
+
+    figures_data = [
+        compute_measure(variation_total_cases, dates[1:], 'Variazione casi totali - ' + area_name, area_colours[:, 1:], is_variation=True, name='total_cases', previous_figure_data=derived_state.get('total_cases'), window=window, smoother=smoother),
+    ]
+
+    for figure_data in figures_data:
+        figure_data["area_name"] = area_name
 
-    plot_measure(ratio_positive_over_tests, dates[1+n_days_to_wait_before_test_result:], 'Rapporto positivi/numero tamponi - ' + area_name, area_colours[1:], is_variation=True, notes='Il rapporto è stato calcolato assumendo che il risultato del tampone arrivasse '+ str(n_days_to_wait_before_test_result) +' giorno/i dopo il test. \nL\'assunzione è forte e poco affidabile, serve solo per mostrare un grafico dell\'andamento')
+    if incremental:
+        with profiling.span("save_derived_state", area=area_name):
+            save_derived_state(area_name, get_derived_state_version(window, smoother), figures_data)
+
+    return figures_data
+
+
+def plot_all_measures(dates, hospitalized_with_sympthoms, intensive_care_unit, staying_at_home, positives, healed, deaths, n_tests, area_colours, area_name):
+    """
+    Plot all measures
+    
+    Derive and plot data for all measures
+    """
+    for figure_data in compute_all_measures(dates, hospitalized_with_sympthoms, intensive_care_unit, staying_at_home, positives, healed, deaths, n_tests, area_colours, area_name):
+        plot_figure(figure_data)
 
     return
 
 
-def plot_national_data():
+def compute_national_data(source=JSON_SOURCE, incremental=False, max_test_delay=MAX_TEST_DELAY, test_delay_criterion=FEASIBLE_CRITERION, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute national data
+    
+    Loads and derive national data
+
+    Returns
+    ----------
+    list
+        Figure data for each measure (see compute_measure)
+    """
+    with profiling.span("load_data", area='Italia'):
+        national_data = load_national_data(source=source)
+
+    with profiling.span("area_colour", area='Italia'):
+        area_colours = get_area_colour(national_data['dates'], as_matrix=True)
+
+    return compute_all_measures(**national_data,
+                                area_colours=area_colours,
+                                area_name='Italia',
+                                incremental=incremental,
+                                max_test_delay=max_test_delay,
+                                test_delay_criterion=test_delay_criterion,
+                                window=window,
+                                smoother=smoother)
+
+
+def compute_regional_data(region_list, source=JSON_SOURCE, incremental=False, max_test_delay=MAX_TEST_DELAY, test_delay_criterion=FEASIBLE_CRITERION, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute regional data
+
+    Loads and derive data for each region in region_list, areas that are not regions are looked up among provinces (see compute_provincial_data)
+
+    Returns
+    ----------
+    list
+        Figure data for each measure of each region (see compute_measure)
+    """
+    with profiling.span("load_data", area=', '.join(region_list)):
+        region_dict = load_regional_data(region_list, source=source)
+
+    figures_data = []
+
+    for region in region_dict.keys():
+
+        if len(region_dict[region]['dates']) == 0:
+            continue
+
+        with profiling.span("area_colour", area=region):
+            area_colours = get_area_colour(region_dict[region]['dates'], region, as_matrix=True)
+
+        figures_data += compute_all_measures(**region_dict[region],
+                                             area_colours=area_colours,
+                                             area_name=region,
+                                             incremental=incremental,
+                                             max_test_delay=max_test_delay,
+                                             test_delay_criterion=test_delay_criterion,
+                                             window=window,
+                                             smoother=smoother)
+
+    # areas that are not regions might be provinces
+    province_list = [region for region in region_list if len(region_dict[region]['dates']) == 0]
+
+    if len(province_list) > 0:
+        figures_data += compute_provincial_data(province_list, source=source, incremental=incremental, window=window, smoother=smoother)
+    
+    return figures_data
+
+
+def compute_provincial_data(province_list, source=JSON_SOURCE, incremental=False, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Compute provincial data
+
+    Loads and derive data for each province in province_list, the area underneath the trend is filled with the colour of the region the province belongs to
+
+    Returns
+    ----------
+    list
+        Figure data for each measure of each province (see compute_measure)
+    """
+    try:
+        with profiling.span("load_data", area=', '.join(province_list)):
+            province_dict = load_provincial_data(province_list, source=source)
+
+    # repositories cloned before provinces were supported don't contain provincial data until they are updated
+    except FileNotFoundError:
+        print("No provincial data found, invalid regions: ", ', '.join(province_list))
+        return []
+
+    figures_data = []
+
+    for province in province_dict.keys():
+
+        if len(province_dict[province]['dates']) == 0:
+            print("Invalid region or province: ", province)
+            continue
+
+        with profiling.span("area_colour", area=province):
+            area_colours = get_area_colour(province_dict[province]['dates'], province_dict[province]['region'], as_matrix=True)
+
+        figures_data += compute_provincial_measures(province_dict[province]['dates'],
+                                                    province_dict[province]['total_cases'],
+                                                    area_colours=area_colours,
+                                                    area_name=province,
+                                                    incremental=incremental,
+                                                    window=window,
+                                                    smoother=smoother)
+
+    return figures_data
+
+
+def plot_national_data(source=JSON_SOURCE):
     """
     Plot national data
     
     Loads and plot national data
     """
-    data_file_path = os.path.join('COVID-19', 'dati-json', 'dpc-covid19-ita-andamento-nazionale.json')
-
-    with open(data_file_path, 'r') as data_file:
-        national_data = json.load(data_file)
-        
-        dates = []
-        hospitalized_with_sympthoms = []
-        intensive_care_unit = []
-        staying_at_home = []
-        positives = []
-        healed = []
-        deaths = []
-        n_tests = []
-
-        for daily_data in national_data:
-            hospitalized_with_sympthoms.append(daily_data['ricoverati_con_sintomi'])
-            intensive_care_unit.append(daily_data['terapia_intensiva'])
-            staying_at_home.append(daily_data['isolamento_domiciliare'])
-            positives.append(daily_data['totale_positivi'])
-            healed.append(daily_data['dimessi_guariti'])
-            deaths.append(daily_data['deceduti'])
-            n_tests.append(daily_data['tamponi'])
-
-            dates.append(datetime.fromisoformat(daily_data['data']).date())
-        
-        area_colours = get_area_colour(dates)
-
-        plot_all_measures(dates=dates,
-                          hospitalized_with_sympthoms=hospitalized_with_sympthoms, 
-                          intensive_care_unit=intensive_care_unit,
-                          staying_at_home=staying_at_home,
-                          positives=positives,
-                          healed=healed,
-                          deaths=deaths,
-                          n_tests=n_tests,
-                          area_colours=area_colours,
-                          area_name='Italia')
+    for figure_data in compute_national_data(source):
+        plot_figure(figure_data)
     
     return
 
 
-def plot_regional_data(region_list):
+def plot_regional_data(region_list, source=JSON_SOURCE):
     """
     Plot regional data
 
     Loads and plot data for each region in region_list
     """
-    region_dict = {}
-
-    for region_province in region_list:
-        region_dict[region_province] = {
-            "dates": [],
-            "hospitalized_with_sympthoms": [],
-            "intensive_care_unit": [],
-            "staying_at_home": [],
-            "positives": [],
-            "healed": [],
-            "deaths": [],
-            "n_tests": []
-        }
+    for figure_data in compute_regional_data(region_list, source):
+        plot_figure(figure_data)
     
-    # load data
-    data_file_path = os.path.join('COVID-19', 'dati-json', 'dpc-covid19-ita-regioni.json')
-
-    with open(data_file_path, 'r') as data_file:
-        national_data = json.load(data_file)
-
-        for daily_data in national_data:
-            region = daily_data['denominazione_regione']
-            if region in region_dict:
-                region_dict[region]['hospitalized_with_sympthoms'].append(daily_data['ricoverati_con_sintomi'])
-                region_dict[region]['intensive_care_unit'].append(daily_data['terapia_intensiva'])
-                region_dict[region]['staying_at_home'].append(daily_data['isolamento_domiciliare'])
-                region_dict[region]['positives'].append(daily_data['totale_positivi'])
-                region_dict[region]['healed'].append(daily_data['dimessi_guariti'])
-                region_dict[region]['deaths'].append(daily_data['deceduti'])
-                region_dict[region]['n_tests'].append(daily_data['tamponi'])
-
-                region_dict[region]['dates'].append(datetime.fromisoformat(daily_data['data']).date())
-        
-        
-        for region in region_dict.keys():
-
-            if len(region_dict[region]['dates']) == 0:
-                print("Invalid region: ", region)
-                continue
+    return
+
+
+def get_comparison_data(figures_data):
+    """
+    Get comparison data
+
+    Group the figure data of every area by measure
+
+    Returns
+    ----------
+    dict
+        For each figure name (e.g. positives), the figure data of each area (see compute_measure)
+    """
+    comparison_data = {}
+
+    for figure_data in figures_data:
+        comparison_data.setdefault(figure_data["name"], []).append(figure_data)
+
+    return comparison_data
+
+
+class ComparisonFigure:
+    """
+    Comparison figure class
+
+    This class draws a measure of several areas on a single figure, either on the same axes (overlay) or on a grid of axes sharing both x and y (small multiples).
+    Axes, tick locators, event lines and legend are built once, the line artists of each area are then updated in place for each measure, so the same figure can be reused for every measure
+    """
+    def __init__(self, fig, area_names, dates, layout=OVERLAY_LAYOUT):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        fig : matplotlib.figure.Figure
+            Figure to draw on
+        area_names : list of str
+            Areas to compare
+        dates : numpy.ndarray
+            First and last date of the data, used to select the events to show
+        layout : str
+            One of COMPARISON_LAYOUTS
+        """
+        import matplotlib.dates as mdates
+
+        self.fig = fig
+        self.area_names = list(area_names)
+
+        if layout == GRID_LAYOUT:
+            n_columns = int(np.ceil(np.sqrt(len(self.area_names))))
+            n_rows = int(np.ceil(len(self.area_names)/n_columns))
+            axes = fig.subplots(n_rows, n_columns, sharex=True, sharey=True, squeeze=False).ravel()
+
+            for ax in axes[len(self.area_names):]:
+                ax.set_visible(False)
+
+            self.axes = list(axes[:len(self.area_names)])
+
+            # the same number of ticks is shared by the columns
+            max_ticks = max(2, N_TICKS//n_columns)
+
+        else:
+            self.axes = [fig.subplots()]*len(self.area_names)
+            max_ticks = N_TICKS
+
+        # measure and trend line of each area, their data is set by update
+        self.measure_lines = []
+        self.trend_lines = []
+
+        for area_name, ax in zip(self.area_names, self.axes):
+            trend_line, = ax.plot([], [], label=area_name if layout == OVERLAY_LAYOUT else 'Andamento')
+            measure_line, = ax.plot([], [], marker='o', markersize=3, linestyle='None', alpha=0.3, color=trend_line.get_color())
+
+            self.trend_lines.append(trend_line)
+            self.measure_lines.append(measure_line)
+
+            if layout == GRID_LAYOUT:
+                ax.set_title(area_name, fontsize=9)
+
+        for ax in dict.fromkeys(self.axes):
+            plot_events(dates, ax)
+
+        # x axis properties (shared axes share the locator and the formatter), limits span the dates of every area
+        self.axes[0].set_xlim(dates[0], dates[-1])
+        self.axes[0].xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=max_ticks))
+        self.axes[0].xaxis.set_major_formatter(mdates.DateFormatter(DATE_STRING_FORMAT))
+        fig.autofmt_xdate()
+
+        if layout == GRID_LAYOUT:
+            fig.legend(*self.axes[0].get_legend_handles_labels(), loc='upper right', fontsize=8)
+        else:
+            self.axes[0].legend()
+
+        self.title = fig.suptitle('')
+
+    def update(self, figures_data):
+        """
+        Show a measure
+
+        Parameters
+        ----------
+        figures_data : list of dict
+            Figure data of the measure for each area, in the order of area_names (see get_comparison_data)
+        """
+        for figure_data, measure_line, trend_line in zip(figures_data, self.measure_lines, self.trend_lines):
+            measure_line.set_data(figure_data["dates"], figure_data["measure"])
+
+            if figure_data["trend"] is not None:
+                offset = figure_data["trend_offset"]
+                trend_line.set_data(figure_data["dates"][offset:offset+len(figure_data["trend"])], figure_data["trend"])
+            else:
+                trend_line.set_data([], [])
+
+        # the title without the area name
+        self.title.set_text(figures_data[0]["title"].rsplit(' - ', 1)[0])
+
+        for ax in dict.fromkeys(self.axes):
+            ax.relim()
+            ax.autoscale_view()
+
+        return
+
+
+def get_comparison_dates(figures_data):
+    """
+    Get the first and the last date of the figure data (figure data with no dates is ignored)
+    """
+    dated_figures_data = [figure_data for figure_data in figures_data if len(figure_data["dates"]) > 0]
+
+    return np.array([min(figure_data["dates"][0] for figure_data in dated_figures_data), max(figure_data["dates"][-1] for figure_data in dated_figures_data)])
+
+
+def plot_comparison(figures_data, layout=OVERLAY_LAYOUT):
+    """
+    Plot comparison
+
+    Draw each measure of every area on a new interactive figure (see ComparisonFigure)
+
+    Returns
+    ----------
+    dict
+        For each figure name, the drawn comparison figure
+    """
+    import matplotlib.pyplot as plt
+
+    global n_figures
+
+    comparison_data = get_comparison_data(figures_data)
+    dates = get_comparison_dates(figures_data)
+    comparison_figures = {}
+
+    for name, measure_figures_data in comparison_data.items():
+        with profiling.span("draw_comparison", measure=name):
+            comparison_figures[name] = ComparisonFigure(plt.figure(n_figures), [figure_data["area_name"] for figure_data in measure_figures_data], dates, layout)
+            comparison_figures[name].update(measure_figures_data)
+
+        n_figures += 1
+
+    return comparison_figures
+
+
+def render_comparison(figures_data, output_directory, file_format=DEFAULT_FILE_FORMAT, layout=OVERLAY_LAYOUT):
+    """
+    Render comparison
+
+    Render each measure of every area to file. A single figure is built and updated in place for each measure that involves the same areas
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each figure (see compute_measure)
+    output_directory : str
+        Directory where the figures are saved
+    file_format : str
+        Figure file format (e.g. png, svg)
+    layout : str
+        One of COMPARISON_LAYOUTS
+    """
+    from matplotlib.figure import Figure
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    start_time = time.perf_counter()
+
+    dates = get_comparison_dates(figures_data)
+    comparison_figures = {}
+
+    with profiling.span("render_comparison", n_figures=len(figures_data)):
+        for name, measure_figures_data in get_comparison_data(figures_data).items():
+            rendering_start_time = time.perf_counter()
+
+            area_names = tuple(figure_data["area_name"] for figure_data in measure_figures_data)
+
+            if area_names not in comparison_figures:
+                comparison_figures[area_names] = ComparisonFigure(Figure(), area_names, dates, layout)
+
+            comparison_figures[area_names].update(measure_figures_data)
+
+            file_path = os.path.join(output_directory, re.sub(r'[^\w.-]+', '_', 'comparison_' + name) + '.' + file_format)
+            comparison_figures[area_names].fig.savefig(file_path)
+
+            print(f"{file_path} rendered in {time.perf_counter() - rendering_start_time:.3f} s")
+
+    print(f"{len(figures_data)} series rendered in {time.perf_counter() - start_time:.3f} s")
 
-            area_colours = get_area_colour(region_dict[region]['dates'], region)
-
-            plot_all_measures(dates=region_dict[region]['dates'],
-                            hospitalized_with_sympthoms=region_dict[region]['hospitalized_with_sympthoms'],
-                            intensive_care_unit=region_dict[region]['intensive_care_unit'],
-                            staying_at_home=region_dict[region]['staying_at_home'],
-                            positives=region_dict[region]['positives'],
-                            healed=region_dict[region]['healed'],
-                            deaths=region_dict[region]['deaths'],
-                            n_tests=region_dict[region]['n_tests'],
-                            area_colours=area_colours,
-                            area_name=region)
-    
     return
 
-if __name__ == "__main__":
 
-    # update or clone data
-    if os.path.isdir('COVID-19'):
+def print_startup_time(stage):
+    """
+    Print the time elapsed since the start (the beginning of the imports) when the stage has been completed
+    """
+    print(f"{stage} completed in {time.perf_counter() - START_TIME:.3f} s since start")
+
+    return
+
+
+def get_figure_file_name(figure_data, file_format):
+    """
+    Get the file name of the figure (area and measure names, without characters unsafe for file names)
+    """
+    return re.sub(r'[^\w.-]+', '_', figure_data["area_name"] + '_' + figure_data["name"]) + '.' + file_format
+
 
-        g = git.cmd.Git('COVID-19')
+def render_figure(figure_data, file_path):
+    """
+    Render single figure
+
+    Draw the figure data (see compute_measure) on a non-interactive figure and save it to file.
+    This function is executed by the batch rendering processes
+
+    Returns
+    ----------
+    float
+        Rendering time [s]
+    """
+    from matplotlib.figure import Figure
+
+    start_time = time.perf_counter()
+
+    # the figure is not managed by pyplot, so it is released as soon as it is saved
+    fig = Figure()
+    draw_measure(figure_data, fig)
+    fig.savefig(file_path)
+
+    return time.perf_counter() - start_time
+
+
+def render_batch(figures_data, output_directory, file_format=DEFAULT_FILE_FORMAT, n_jobs=None):
+    """
+    Render batch
+
+    Render each figure to file using a pool of processes. Data is computed in advance, only the figure data is sent to the processes.
+    Processes are spawned instead of forked, since data may be fetched by a thread meanwhile
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each figure (see compute_measure)
+    output_directory : str
+        Directory where the figures are saved
+    file_format : str
+        Figure file format (e.g. png, svg)
+    n_jobs : int
+        Number of rendering processes (default to number of CPUs)
+    """
+    os.makedirs(output_directory, exist_ok=True)
 
-        print("Updating data...")
+    start_time = time.perf_counter()
+
+    with profiling.span("render_batch", n_figures=len(figures_data)), concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        file_paths = [os.path.join(output_directory, get_figure_file_name(figure_data, file_format)) for figure_data in figures_data]
+        rendering_times = executor.map(render_figure, figures_data, file_paths)
+
+        for file_path, rendering_time in zip(file_paths, rendering_times):
+            print(f"{file_path} rendered in {rendering_time:.3f} s")
+
+    print(f"{len(figures_data)} figures rendered in {time.perf_counter() - start_time:.3f} s")
+
+    return
+
+
+def export_report(figures_data, file_path):
+    """
+    Export report
+
+    Write every figure to a self-contained HTML report (see html_report.write_report), then print generation time and size
+    """
+    from html_report import write_report
+
+    start_time = time.perf_counter()
+
+    with profiling.span("html_report"):
+        report_size = write_report(figures_data, file_path, {"commit": str(get_data_commit())[:7]})
+
+    n_areas = len(set(figure_data["area_name"] for figure_data in figures_data))
+
+    print(f"HTML report of {n_areas} areas ({len(figures_data)} figures) written to {file_path} in {time.perf_counter() - start_time:.3f} s, {report_size/1e6:.2f} MB")
+
+    return
+
+
+def is_figure_data_changed(previous_figure_data, figure_data):
+    """
+    Check if the figure data changed
+
+    Returns
+    ----------
+    True if the figure has to be drawn again (the previous figure data is None or data differs)
+    False otherwise
+    """
+    if previous_figure_data is None:
+        return True
 
-        ret = g.fetch()
-        if ret != '': g.pull()
+    return (not np.array_equal(previous_figure_data["dates"], figure_data["dates"])
+            or not np.array_equal(previous_figure_data["measure"], figure_data["measure"])
+            or previous_figure_data["notes"] != figure_data["notes"])
 
-        print("Data up-to-date!")
 
+def get_changed_figures_data(previous_figures_data, figures_data):
+    """
+    Get the figure data that changed since the previous version (see is_figure_data_changed)
+    """
+    previous_figures_data = {(figure_data["area_name"], figure_data["name"]): figure_data for figure_data in previous_figures_data}
+
+    return [figure_data for figure_data in figures_data if is_figure_data_changed(previous_figures_data.get((figure_data["area_name"], figure_data["name"])), figure_data)]
+
+
+class FigureUpdater:
+    """
+    Figure updater class
+
+    This class keeps the figure drawn for each area and measure, so that when the data changes only the figures whose data changed are drawn again, in place
+    """
+    def __init__(self, output_directory=None, file_format=DEFAULT_FILE_FORMAT, max_points=None):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        output_directory : str
+            Directory where the figures are saved (default to interactive figures)
+        file_format : str
+            Figure file format (e.g. png, svg)
+        max_points : int
+            Maximum number of points drawn for each series of interactive figures (default to every point, see MeasureFigure)
+        """
+        self.output_directory = output_directory
+        self.file_format = file_format
+        self.max_points = max_points
+
+        # figure data and drawn figure of each area and measure
+        self.figures_data = {}
+        self.measure_figures = {}
+
+        if output_directory is not None:
+            os.makedirs(output_directory, exist_ok=True)
+
+    def draw(self, figures_data):
+        """
+        Draw the figures whose data changed
+
+        Parameters
+        ----------
+        figures_data : list
+            Figure data for each figure (see compute_measure)
+
+        Returns
+        ----------
+        list
+            Figure data of the figures drawn
+        """
+        changed_figures_data = get_changed_figures_data(self.figures_data.values(), figures_data)
+
+        for figure_data in changed_figures_data:
+            key = (figure_data["area_name"], figure_data["name"])
+
+            with profiling.span("draw", title=figure_data["title"], update=key in self.measure_figures):
+                if key in self.measure_figures:
+                    self.measure_figures[key].update(figure_data)
+                elif self.output_directory is not None:
+                    from matplotlib.figure import Figure
+                    self.measure_figures[key] = draw_measure(figure_data, Figure())
+                else:
+                    self.measure_figures[key] = plot_figure(figure_data, self.max_points)
+
+            if self.output_directory is not None:
+                self.measure_figures[key].fig.savefig(os.path.join(self.output_directory, get_figure_file_name(figure_data, self.file_format)))
+            else:
+                self.measure_figures[key].fig.canvas.draw_idle()
+
+            self.figures_data[key] = figure_data
+
+        return changed_figures_data
+
+
+def wait(interval, is_interactive):
+    """
+    Wait for interval seconds, keeping the interactive figures responsive
+    """
+    if is_interactive:
+        import matplotlib.pyplot as plt
+        plt.pause(interval)
     else:
-        print("Cloning data from https://github.com/pcm-dpc/COVID-19.git (it takes several minutes) ...")
+        time.sleep(interval)
+
+    return
+
+
+def merge_fetched_data(fetch_future, data_directory=DATA_DIRECTORY):
+    """
+    Check out the data fetched in background, if any (see dpc_data.fetch_data)
+
+    Fetch failures are printed and ignored, so that the local data is still used
+
+    Parameters
+    ----------
+    fetch_future : concurrent.futures.Future
+        Completed fetch
+    data_directory : str
+        Path of the local repository
+
+    Returns
+    ----------
+    bool
+        True if new data has been checked out
+    """
+    try:
+        if not fetch_future.result():
+            return False
+
+        with profiling.span("data_merge"):
+            merge_data(data_directory)
+
+    except Exception as error:
+        print("Data update failed: ", error)
+        return False
+
+    return True
+
+
+def watch(compute_figures_data, interval, update=True, output_directory=None, file_format=DEFAULT_FILE_FORMAT, n_checks=None, max_points=None, data_directory=DATA_DIRECTORY):
+    """
+    Watch data
+
+    Check the local repository for new commits every interval seconds (fetching them in background first if update).
+    When a commit changes the data files, the data is computed again and only the figures whose data changed are drawn again, updating the figures already drawn in place
+
+    Parameters
+    ----------
+    compute_figures_data : callable
+        Function returning the figure data of every figure to draw (e.g. compute_national_data)
+    interval : float
+        Time between checks [s]
+    update : bool
+        If True, new commits are fetched from the remote repository, otherwise the local repository is only checked for new commits
+    output_directory : str
+        Directory where the figures are saved (default to interactive figures)
+    file_format : str
+        Figure file format (e.g. png, svg)
+    n_checks : int
+        Number of checks before returning (default to watch until interrupted)
+    max_points : int
+        Maximum number of points drawn for each series of interactive figures (default to every point, see MeasureFigure)
+    data_directory : str
+        Path of the local repository (compute_figures_data is expected to read the data from it)
+    """
+    figure_updater = FigureUpdater(output_directory, file_format, max_points)
+
+    commit = get_data_commit(data_directory)
+    figure_updater.draw(compute_figures_data())
+
+    print(f"Watching data every {interval} s (commit {str(commit)[:7]})")
+
+    n_checks_done = 0
+    fetch_future = None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        while n_checks is None or n_checks_done < n_checks:
+            # the fetch runs while waiting, a slow fetch is checked again at the next interval
+            if update and fetch_future is None:
+                fetch_future = executor.submit(fetch_data, data_directory)
+
+            wait(interval, output_directory is None)
+
+            n_checks_done += 1
+
+            if update:
+                if not fetch_future.done():
+                    continue
+
+                merge_fetched_data(fetch_future, data_directory)
+                fetch_future = None
+
+            new_commit = get_data_commit(data_directory)
+
+            if new_commit == commit:
+                continue
+
+            changed_files = get_changed_data_files(commit, new_commit, data_directory) if commit is not None and new_commit is not None else None
+            commit = new_commit
+
+            if changed_files == []:
+                print(f"New commit {commit[:7]}, no data file changed")
+                continue
+
+            changed_figures_data = figure_updater.draw(compute_figures_data())
+
+            changed_areas = sorted(set(figure_data["area_name"] for figure_data in changed_figures_data))
+            print(f"New commit {str(commit)[:7]}: {len(changed_figures_data)} figures drawn again (" + ', '.join(changed_areas) + ")")
+
+    return
 
-        g = git.cmd.Git('./')
-        g.clone('--depth=1', 'https://github.com/pcm-dpc/COVID-19.git')
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Plot Italian COVID-19 data')
+    parser.add_argument('regions', nargs='*', help='regions or provinces to plot (default to national data)')
+    parser.add_argument('--source', choices=SOURCES, default=JSON_SOURCE, help='format of the data files to parse (default to %(default)s)')
+    parser.add_argument('--max-test-delay', type=int, default=MAX_TEST_DELAY, help='maximum number of days to wait before the test result, used for the positives/tests ratio (default to %(default)s)')
+    parser.add_argument('--test-delay-criterion', choices=TEST_DELAY_CRITERIA, default=FEASIBLE_CRITERION, help='criterion used to estimate the days to wait before the test result: lowest number of days that leads to possible ratios, or highest cross-correlation (default to %(default)s)')
+    parser.add_argument('--smoother', choices=SMOOTHERS.keys(), default=LINEAR_SMOOTHER, help='smoother used to evaluate the trend (default to %(default)s)')
+    parser.add_argument('--trend-window', type=int, default=TREND_WINDOW, help='number of days of the trend window (default to %(default)s)')
+    parser.add_argument('--check-provinces', action='store_true', help='check that provincial total cases add up to regional ones')
+    parser.add_argument('--compare', action='store_true', help='draw each measure of every area on a single figure')
+    parser.add_argument('--layout', choices=COMPARISON_LAYOUTS, default=OVERLAY_LAYOUT, help='comparison layout: every area on the same axes, or a grid of axes (default to %(default)s)')
+    parser.add_argument('--batch', metavar='OUTPUT_DIRECTORY', help='save every figure to OUTPUT_DIRECTORY instead of showing them')
+    parser.add_argument('--format', choices=FILE_FORMATS, default=DEFAULT_FILE_FORMAT, help='figure file format in batch mode (default to %(default)s)')
+    parser.add_argument('--jobs', type=int, help='number of rendering processes in batch mode (default to number of CPUs)')
+    parser.add_argument('--html', metavar='REPORT_FILE', help='write every figure to a self-contained HTML report instead of drawing them (default to national data and every region)')
+    parser.add_argument('--lod', dest='max_points', action='store_const', const=MAX_DRAWN_POINTS, help='level-of-detail mode: draw at most about %(const)s points for each series, sampled again when zooming or panning')
+    parser.add_argument('--lod-points', dest='max_points', type=int, metavar='POINTS', help='level-of-detail mode drawing at most about POINTS points for each series')
+    parser.add_argument('--watch', metavar='SECONDS', type=float, help='keep running, check for new data every SECONDS and draw again only the figures whose data changed')
+    parser.add_argument('--no-update', '--offline', dest='update', action='store_false', help='do not update data, plot the local data')
+    parser.add_argument('--startup-time', action='store_true', help='print the time spent to reach each stage since the start')
+    parser.add_argument('--profile', metavar='TRACE_FILE', help='measure each stage and write the measures to TRACE_FILE (Chrome trace format)')
+    parser.add_argument('--profile-memory', action='store_true', help='measure the peak memory of each stage as well with --profile (much slower, timings are not reliable)')
+    parser.add_argument('--cprofile', metavar='STATS_FILE', help='profile the execution with cProfile and write the stats to STATS_FILE')
+    args = parser.parse_args()
+
+    try:
+        check_window(args.trend_window, args.smoother)
+    except ValueError as error:
+        parser.error("--trend-window: " + str(error))
+
+    if args.watch and args.compare:
+        parser.error("--watch can't be used with --compare")
+
+    if args.html and (args.watch or args.compare or args.batch):
+        parser.error("--html can't be used with --watch, --compare or --batch")
+
+    if args.max_test_delay < 1:
+        parser.error("--max-test-delay must be at least 1")
+
+    if args.profile_memory and not args.profile:
+        parser.error("--profile-memory requires --profile")
+
+    if args.profile:
+        profiling.enable(trace_memory=args.profile_memory)
+
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.startup_time:
+        print_startup_time("Imports")
+
+    if args.batch:
+        import matplotlib
+        matplotlib.use('Agg')
+
+    # clone data, or fetch it in background while the local data is plotted
+    fetch_future = None
+
+    if not args.update:
+        if not os.path.isdir(DATA_DIRECTORY):
+            print("No local data found in " + DATA_DIRECTORY + ", run without --no-update to download it")
+            exit(1)
+
+    elif not os.path.isdir(DATA_DIRECTORY):
+        print("Cloning data from " + DATA_REPOSITORY_URL + " ...")
+
+        with profiling.span("data_clone"):
+            clone_data()
 
         print("Cloning done!")
 
+    elif not args.watch:
+        print("Updating data in background...")
+
+        fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        fetch_future = fetch_executor.submit(fetch_data)
+
+    if args.startup_time:
+        print_startup_time("Data update")
+
+    def compute_figures_data():
+        if args.html and len(args.regions) == 0:
+            return (compute_national_data(source=args.source, incremental=True, max_test_delay=args.max_test_delay, test_delay_criterion=args.test_delay_criterion, window=args.trend_window, smoother=args.smoother)
+                    + compute_regional_data(get_area_names(REGIONAL_DATASET, source=args.source), source=args.source, incremental=True, max_test_delay=args.max_test_delay, test_delay_criterion=args.test_delay_criterion, window=args.trend_window, smoother=args.smoother))
+
+        if len(args.regions) > 0:
+            return compute_regional_data(args.regions, source=args.source, incremental=True, max_test_delay=args.max_test_delay, test_delay_criterion=args.test_delay_criterion, window=args.trend_window, smoother=args.smoother)
+
+        return compute_national_data(source=args.source, incremental=True, max_test_delay=args.max_test_delay, test_delay_criterion=args.test_delay_criterion, window=args.trend_window, smoother=args.smoother)
+
+    # watch mode fetches data by itself
+    if args.watch:
+        try:
+            watch(compute_figures_data, args.watch, args.update, args.batch, args.format, max_points=args.max_points)
+        except KeyboardInterrupt:
+            print("Stopped watching data")
+
+        exit(0)
+
+    if args.check_provinces:
+        mismatches = check_provincial_data(source=args.source)
+
+        for mismatch_date, region, difference in mismatches:
+            print(f"{mismatch_date} {region}: provincial total cases differ from regional ones by {difference}")
+
+        if len(mismatches) == 0:
+            print("Provincial data is consistent with regional data!")
+
+    figures_data = compute_figures_data()
+
+    if args.startup_time:
+        print_startup_time("Data computation")
+
+    if args.batch and args.compare:
+        render_comparison(figures_data, args.batch, args.format, args.layout)
 
-    if len(sys.argv) > 1:
-        plot_regional_data(sys.argv[1:])
+        if args.startup_time:
+            print_startup_time("Rendering")
+
+    elif args.batch:
+        render_batch(figures_data, args.batch, args.format, args.jobs)
+
+        if args.startup_time:
+            print_startup_time("Rendering")
+
+    elif args.html:
+        export_report(figures_data, args.html)
+
+        if args.startup_time:
+            print_startup_time("Report")
+
+    elif args.compare:
+        comparison_figures = plot_comparison(figures_data, args.layout)
+
+        if args.startup_time:
+            print_startup_time("Drawing")
 
     else:
-        plot_national_data()
+        figure_updater = FigureUpdater(max_points=args.max_points)
+        figure_updater.draw(figures_data)
+
+        if args.startup_time:
+            print_startup_time("Drawing")
+
+    # refresh the figures if the background fetch brings new data
+    if fetch_future is not None:
+        if not args.batch and not args.html:
+            import matplotlib.pyplot as plt
+
+            # keep the figures responsive until the fetch is completed (or every figure is closed)
+            while not fetch_future.done() and plt.get_fignums():
+                wait(0.1, True)
+
+        if merge_fetched_data(fetch_future):
+            print("New data available, refreshing figures...")
+
+            new_figures_data = compute_figures_data()
+
+            if args.batch and args.compare:
+                render_comparison(new_figures_data, args.batch, args.format, args.layout)
+
+            elif args.batch:
+                render_batch(get_changed_figures_data(figures_data, new_figures_data), args.batch, args.format, args.jobs)
+
+            elif args.html:
+                export_report(new_figures_data, args.html)
+
+            elif args.compare:
+                for name, measure_figures_data in get_comparison_data(new_figures_data).items():
+                    comparison_figures[name].update(measure_figures_data)
+                    comparison_figures[name].fig.canvas.draw_idle()
+
+            else:
+                figure_updater.draw(new_figures_data)
+
+        elif fetch_future.exception() is None:
+            print("Data up-to-date!")
+
+        fetch_executor.shutdown()
+
+    if args.profile:
+        profiling.write_trace(args.profile)
+        print("Profiling trace written to " + args.profile)
+
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        print("cProfile stats written to " + args.cprofile)
 
-    plt.show()
+    if not args.batch and not args.html:
+        import matplotlib.pyplot as plt
+        plt.show()
 
-    exit(0)
\ No newline at end of file
+    exit(0)
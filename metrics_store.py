@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from area_colour import AreaColour
+from dpc_data import get_data_commit, get_area_names, CACHE_DIRECTORY, REGIONAL_DATASET, PROVINCIAL_DATASET, JSON_SOURCE, SOURCES
+from analysis import check_window, TREND_WINDOW, LINEAR_SMOOTHER, SMOOTHERS
+
+METRICS_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'metrics')
+INDEX_FILE_NAME = 'index.json'
+DATES_FILE_NAME = 'dates.npy'
+
+# metric families, one file each
+MEASURE_KIND = 'measure'
+TREND_KIND = 'trend'
+COLOUR_BANDS_KIND = 'colour_bands'
+TEST_DELAY_KIND = 'test_delay'
+SERIES_KINDS = [MEASURE_KIND, TREND_KIND, COLOUR_BANDS_KIND]
+
+
+def get_store_arrays(figures_data):
+    """
+    Get the arrays of the metrics store
+
+    Every series is laid out on the same day axis (NaN where there is no value), so that a series of an area and measure is a contiguous slice of its family array:
+        measure: (areas, measures, days) float32, daily variation (or ratio) of each measure
+        trend: (areas, measures, days) float32, trend of each measure
+        colour_bands: (areas, measures, len(AreaColour), days) float32, colour bands underneath the trend (see analysis.colour_bands)
+        test_delay: (areas,) int32, estimated test delay (0 if not estimated)
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each measure of each area (see make_graphs.compute_measure)
+
+    Returns
+    ----------
+    dict
+        Index: area names, measure names, first date and number of days
+    numpy.ndarray
+        (days,) datetime64[D], the day axis
+    dict
+        Array of each metric family
+    """
+    area_names = list(dict.fromkeys(figure_data["area_name"] for figure_data in figures_data))
+    measure_names = list(dict.fromkeys(figure_data["name"] for figure_data in figures_data))
+    area_indices = {area_name: index for index, area_name in enumerate(area_names)}
+    measure_indices = {measure_name: index for index, measure_name in enumerate(measure_names)}
+
+    # series with no dates (e.g. the ratio of an area with 2 days of data) are left empty
+    dated_figures_data = [figure_data for figure_data in figures_data if len(figure_data["dates"]) > 0]
+
+    if len(dated_figures_data) == 0:
+        raise ValueError("No series has any date")
+
+    first_date = min(figure_data["dates"][0] for figure_data in dated_figures_data)
+    last_date = max(figure_data["dates"][-1] for figure_data in dated_figures_data)
+    dates = np.arange(first_date, last_date + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+
+    arrays = {
+        MEASURE_KIND: np.full((len(area_names), len(measure_names), len(dates)), np.nan, dtype=np.float32),
+        TREND_KIND: np.full((len(area_names), len(measure_names), len(dates)), np.nan, dtype=np.float32),
+        COLOUR_BANDS_KIND: np.full((len(area_names), len(measure_names), len(AreaColour), len(dates)), np.nan, dtype=np.float32),
+        TEST_DELAY_KIND: np.zeros(len(area_names), dtype=np.int32),
+    }
+
+    for figure_data in figures_data:
+        area_index = area_indices[figure_data["area_name"]]
+        measure_index = measure_indices[figure_data["name"]]
+        day_indices = (figure_data["dates"] - first_date).astype(np.int64)
+
+        arrays[MEASURE_KIND][area_index, measure_index, day_indices] = figure_data["measure"]
+
+        if figure_data["trend"] is not None:
+            trend_day_indices = day_indices[figure_data["trend_offset"]:figure_data["trend_offset"]+len(figure_data["trend"])]
+            arrays[TREND_KIND][area_index, measure_index, trend_day_indices] = figure_data["trend"]
+            arrays[COLOUR_BANDS_KIND][area_index, measure_index][:, trend_day_indices] = figure_data["colour_bands"]
+
+        if "test_delay" in figure_data:
+            arrays[TEST_DELAY_KIND][area_index] = figure_data["test_delay"]["lag"]
+
+    index = {
+        "areas": area_names,
+        "measures": measure_names,
+        "first_date": str(first_date),
+        "n_days": len(dates),
+    }
+
+    return index, dates, arrays
+
+
+def write_store(figures_data, directory=METRICS_DIRECTORY, metadata=None):
+    """
+    Write the metrics store
+
+    Each metric family (see get_store_arrays) is saved to its own file (e.g. trend.npy), the day axis to dates.npy.
+    The store is written to a temporary directory, then it replaces the previous one at once: the previous store is renamed aside and removed only after the new one is in place, so that the store is missing only between two renames
+
+    Parameters
+    ----------
+    figures_data : list
+        Figure data for each measure of each area (see make_graphs.compute_measure)
+    directory : str
+        Path of the store
+    metadata : dict
+        Additional information saved in the index (e.g. commit, smoother)
+    """
+    index, dates, arrays = get_store_arrays(figures_data)
+    index.update(metadata or {})
+
+    temporary_directory = directory + '.tmp'
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+    os.makedirs(temporary_directory)
+
+    np.save(os.path.join(temporary_directory, DATES_FILE_NAME), dates)
+    for kind, array in arrays.items():
+        np.save(os.path.join(temporary_directory, kind + '.npy'), array)
+
+    with open(os.path.join(temporary_directory, INDEX_FILE_NAME), 'w') as index_file:
+        json.dump(index, index_file, indent=4)
+
+    previous_directory = directory + '.old'
+    shutil.rmtree(previous_directory, ignore_errors=True)
+
+    if os.path.isdir(directory):
+        os.replace(directory, previous_directory)
+
+    os.replace(temporary_directory, directory)
+    shutil.rmtree(previous_directory, ignore_errors=True)
+
+    return
+
+
+class MetricsStore:
+    """
+    Metrics store class
+
+    This class gives access to the metrics store written by write_store. Every family file is memory-mapped when the store is opened, so that the files opened stay readable after the store is written again. Series are returned as views of the files
+    """
+    def __init__(self, directory=METRICS_DIRECTORY):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        directory : str
+            Path of the store
+        """
+        self.directory = directory
+
+        with open(os.path.join(directory, INDEX_FILE_NAME), 'r') as index_file:
+            self.index = json.load(index_file)
+
+        self.area_indices = {area_name: index for index, area_name in enumerate(self.index["areas"])}
+        self.measure_indices = {measure_name: index for index, measure_name in enumerate(self.index["measures"])}
+        self.first_date = np.datetime64(self.index["first_date"], 'D')
+        self.n_days = self.index["n_days"]
+
+        self.dates = np.load(os.path.join(directory, DATES_FILE_NAME), mmap_mode='r')
+        self.arrays = {kind: np.load(os.path.join(directory, kind + '.npy'), mmap_mode='r') for kind in SERIES_KINDS + [TEST_DELAY_KIND]}
+
+    def get_array(self, kind):
+        """
+        Get the memory-mapped file of a metric family (one of SERIES_KINDS or TEST_DELAY_KIND)
+        """
+        if kind not in self.arrays:
+            raise ValueError("Unknown metric kind: " + str(kind))
+
+        return self.arrays[kind]
+
+    def get_day_index(self, date):
+        """
+        Get the index of the date on the day axis (it may be outside the store)
+        """
+        return int((np.datetime64(date, 'D') - self.first_date).astype(np.int64))
+
+    def get_series(self, area, measure, start=None, end=None, kind=TREND_KIND):
+        """
+        Get a series
+
+        Parameters
+        ----------
+        area : str
+            Area name
+        measure : str
+            Measure name (e.g. positives, see make_graphs.compute_all_measures)
+        start : str, Date or numpy.datetime64
+            First date (default to the first day of the store)
+        end : str, Date or numpy.datetime64
+            Last date, included (default to the last day of the store)
+        kind : str
+            Metric family, one of SERIES_KINDS
+
+        Returns
+        ----------
+        numpy.ndarray
+            Dates (view of the store)
+        numpy.ndarray
+            Values for each date (NaN if not available), a (len(AreaColour), len(dates)) matrix for colour bands (view of the store)
+        """
+        if area not in self.area_indices:
+            raise ValueError("The area " + str(area) + " hasn't been found")
+
+        if measure not in self.measure_indices:
+            raise ValueError("The measure " + str(measure) + " hasn't been found")
+
+        start_index = int(np.clip(self.get_day_index(start), 0, self.n_days)) if start is not None else 0
+        end_index = int(np.clip(self.get_day_index(end) + 1, start_index, self.n_days)) if end is not None else self.n_days
+
+        return self.dates[start_index:end_index], self.get_array(kind)[self.area_indices[area], self.measure_indices[measure], ..., start_index:end_index]
+
+    def get_test_delay(self, area):
+        """
+        Get the test delay estimated for the area (0 if not estimated)
+        """
+        return int(self.get_array(TEST_DELAY_KIND)[self.area_indices[area]])
+
+
+# opened store for each directory: (index modification time, MetricsStore)
+_stores = {}
+
+
+def get_store(directory=METRICS_DIRECTORY):
+    """
+    Get the metrics store
+
+    The store is opened only once, it is opened again only when it has been written again
+
+    Returns
+    ----------
+    MetricsStore
+        The store
+    """
+    modification_time = os.stat(os.path.join(directory, INDEX_FILE_NAME)).st_mtime_ns
+
+    if directory not in _stores or _stores[directory][0] != modification_time:
+        _stores[directory] = (modification_time, MetricsStore(directory))
+
+    return _stores[directory][1]
+
+
+def get_series(area, measure, start=None, end=None, kind=TREND_KIND, directory=METRICS_DIRECTORY):
+    """
+    Get a series from the metrics store (see MetricsStore.get_series)
+
+        dates, trend = get_series('Lombardia', 'positives', '2020-11-01', '2020-11-30')
+    """
+    return get_store(directory).get_series(area, measure, start, end, kind)
+
+
+def build_store(source=JSON_SOURCE, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER, include_provinces=False, directory=METRICS_DIRECTORY):
+    """
+    Build the metrics store
+
+    Derive every measure of national data and of every region (and province, if include_provinces), then write the store
+
+    Returns
+    ----------
+    int
+        Number of series written
+    """
+    import make_graphs
+
+    figures_data = make_graphs.compute_national_data(source=source, incremental=True, window=window, smoother=smoother)
+    figures_data += make_graphs.compute_regional_data(get_area_names(REGIONAL_DATASET, source=source), source=source, incremental=True, window=window, smoother=smoother)
+
+    if include_provinces:
+        figures_data += make_graphs.compute_provincial_data(get_area_names(PROVINCIAL_DATASET, source=source), source=source, incremental=True, window=window, smoother=smoother)
+
+    write_store(figures_data, directory, {"commit": get_data_commit(), "smoother": smoother, "window": window})
+
+    return len(figures_data)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Write the derived metrics of every area and measure to a columnar store')
+    parser.add_argument('--source', choices=SOURCES, default=JSON_SOURCE, help='format of the data files to parse (default to %(default)s)')
+    parser.add_argument('--smoother', choices=SMOOTHERS.keys(), default=LINEAR_SMOOTHER, help='smoother used to evaluate the trend (default to %(default)s)')
+    parser.add_argument('--trend-window', type=int, default=TREND_WINDOW, help='number of days of the trend window (default to %(default)s)')
+    parser.add_argument('--provinces', action='store_true', help='store provincial data as well')
+    parser.add_argument('--output', default=METRICS_DIRECTORY, help='store directory (default to %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        check_window(args.trend_window, args.smoother)
+    except ValueError as error:
+        parser.error("--trend-window: " + str(error))
+
+    start_time = time.perf_counter()
+
+    n_series = build_store(args.source, args.trend_window, args.smoother, args.provinces, args.output)
+
+    print(f"{n_series} series written to {args.output} in {time.perf_counter() - start_time:.3f} s")
+
+    exit(0)
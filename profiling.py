@@ -0,0 +1,151 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# shared by every span when profiling is disabled, so that disabled spans cost a function call
+NULL_SPAN = contextlib.nullcontext()
+
+_is_enabled = False
+_is_memory_traced = False
+_start_time_ns = 0
+_events = []
+_span_stack = []
+
+
+class Span:
+    """
+    Span class
+
+    This class measures wall time, CPU time and peak traced memory of a named stage, nested spans are supported
+    """
+    def __init__(self, name, args):
+        """
+        Class constructor
+
+        Parameters
+        ----------
+        name : str
+            Stage name
+        args : dict
+            Additional information about the stage (e.g. area, measure)
+        """
+        self.name = name
+        self.args = args
+        self.peak_memory = 0
+
+    def __enter__(self):
+        if _is_memory_traced:
+            # the peak reached so far belongs to the parent span
+            if _span_stack:
+                _span_stack[-1].peak_memory = max(_span_stack[-1].peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        _span_stack.append(self)
+
+        self.start_cpu_time_ns = time.process_time_ns()
+        self.start_time_ns = time.perf_counter_ns()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_time_ns = time.perf_counter_ns()
+        end_cpu_time_ns = time.process_time_ns()
+
+        _span_stack.pop()
+
+        args = dict(self.args)
+        args["cpu_time_ms"] = (end_cpu_time_ns - self.start_cpu_time_ns)/1e6
+
+        if _is_memory_traced:
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            args["peak_memory_bytes"] = self.peak_memory
+
+            if _span_stack:
+                _span_stack[-1].peak_memory = max(_span_stack[-1].peak_memory, self.peak_memory)
+            tracemalloc.reset_peak()
+
+        # Chrome trace "complete" event, times in microseconds
+        _events.append({
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start_time_ns - _start_time_ns)/1e3,
+            "dur": (end_time_ns - self.start_time_ns)/1e3,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+        return False
+
+
+def enable(trace_memory=False):
+    """
+    Enable profiling
+
+    Parameters
+    ----------
+    trace_memory : bool
+        If True, the peak memory allocated by Python is measured for each span. Tracing slows down the execution several times, so timings are reliable only without it
+    """
+    global _is_enabled, _is_memory_traced, _start_time_ns
+
+    _is_enabled = True
+    _is_memory_traced = trace_memory
+    _start_time_ns = time.perf_counter_ns()
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    return
+
+
+def is_enabled():
+    """
+    Check if profiling is enabled
+    """
+    return _is_enabled
+
+
+def span(name, **args):
+    """
+    Get a span measuring the stage, to be used as context manager
+
+        with profiling.span("stage", area="Lombardia"):
+            ...
+
+    Parameters
+    ----------
+    name : str
+        Stage name
+    args
+        Additional information about the stage, they must be JSON serializable
+
+    Returns
+    ----------
+    Span
+        The span, or a shared no-op context manager if profiling is disabled
+    """
+    if not _is_enabled:
+        return NULL_SPAN
+
+    return Span(name, args)
+
+
+def get_events():
+    """
+    Get the events recorded so far (Chrome trace format)
+    """
+    return _events
+
+
+def write_trace(file_path):
+    """
+    Write the recorded events to file in Chrome trace format (it can be opened with chrome://tracing or Perfetto)
+    """
+    with open(file_path, 'w') as trace_file:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, trace_file)
+
+    return
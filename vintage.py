@@ -0,0 +1,436 @@
+import argparse
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from dpc_data import get_data_file_path, SEPARATORS_REGEX, DATA_DIRECTORY, CACHE_DIRECTORY, NATIONAL_DATASET, REGIONAL_DATASET, MEASURE_FIELDS, AREA_FIELDS, DATE_FIELD, JSON_SOURCE, CSV_SOURCE, SOURCES
+from analysis import get_trend, trend_offset, check_window, TREND_WINDOW, LINEAR_SMOOTHER, SMOOTHERS
+
+VINTAGE_FILE_PATH = os.path.join(CACHE_DIRECTORY, 'vintage.npz')
+
+N_COMMITS = 30
+MAX_REVISION_AGE = 14
+
+NATIONAL_AREA = 'Italia'
+
+
+def deepen_history(n_commits, data_directory=DATA_DIRECTORY):
+    """
+    Fetch n_commits more commits if the repository is shallow (see dpc_data.clone_data), blobs are still downloaded only when read
+    """
+    import git
+
+    g = git.cmd.Git(data_directory)
+
+    if g.rev_parse('--is-shallow-repository') == 'true':
+        g.fetch('--deepen=' + str(n_commits))
+
+    return
+
+
+def get_history(dataset, n_commits=N_COMMITS, source=JSON_SOURCE, data_directory=DATA_DIRECTORY):
+    """
+    Get the last commits that changed the file of the dataset
+
+    Returns
+    ----------
+    list of str
+        Commit hashes, oldest first
+    """
+    import git
+
+    path = get_data_file_path(dataset, '', source).replace(os.sep, '/')
+
+    return git.cmd.Git(data_directory).log('--format=%H', '-n', str(n_commits), '--', ':(top)' + path).split()[::-1]
+
+
+def split_records(blob, source):
+    """
+    Split the content of a dataset file into records, without parsing them
+
+    Records are found line by line, so that the records that didn't change since the previous version are found before decoding anything:
+    a CSV record goes on until its quotes are balanced (quoted fields may span several lines), a JSON record is an object of the pretty-printed array (JSON strings can't contain raw newlines).
+    JSON files that are not pretty-printed are split by the JSON decoder instead (see dpc_data.iter_records)
+
+    Returns
+    ----------
+    bytes
+        Header (None for JSON files)
+    list of bytes
+        Records: rows of CSV files, objects of JSON files
+    """
+    lines = blob.splitlines(keepends=True)
+    records = []
+
+    if source == CSV_SOURCE:
+        record_start = 0
+        n_quotes = 0
+
+        for line_index, line in enumerate(lines):
+            n_quotes += line.count(b'"')
+
+            if n_quotes % 2 == 0:
+                records.append(b''.join(lines[record_start:line_index + 1]))
+                record_start = line_index + 1
+                n_quotes = 0
+
+        # unbalanced quotes at the end of the file
+        if record_start < len(lines):
+            records.append(b''.join(lines[record_start:]))
+
+        records = [record for record in records if record.strip()]
+
+        return records[0], records[1:]
+
+    record_start = None
+
+    for line_index, line in enumerate(lines):
+        stripped_line = line.strip()
+
+        if stripped_line == b'{':
+            record_start = line_index
+        elif stripped_line in (b'}', b'},') and record_start is not None:
+            records.append(b''.join(lines[record_start:line_index + 1]).rstrip().rstrip(b','))
+            record_start = None
+
+    # not pretty-printed
+    if len(records) == 0 and blob.strip(b'[], \t\r\n'):
+        text = blob.decode()
+        decoder = json.JSONDecoder()
+
+        position = SEPARATORS_REGEX.match(text).end()
+        if text[position:position + 1] != '[':
+            raise ValueError("The dataset file does not contain a JSON array")
+
+        position += 1
+        while True:
+            position = SEPARATORS_REGEX.match(text, position).end()
+            if text[position:position + 1] == ']':
+                break
+
+            record_start = position
+            _, position = decoder.raw_decode(text, position)
+            records.append(text[record_start:position].encode())
+
+    return None, records
+
+
+def parse_records(records, header, dataset, source):
+    """
+    Parse records of a dataset file (see split_records) at once
+
+    Returns
+    ----------
+    list of tuple
+        For each record: date (ISO string), area (None if the dataset has no area field) and value of each measure in MEASURE_FIELDS
+    """
+    area_field = AREA_FIELDS[dataset].get("areas")
+
+    if source == CSV_SOURCE:
+        field_indices = {field: index for index, field in enumerate(next(csv.reader(io.StringIO(header.decode(), newline=''))))}
+        content = b''.join(record if record.endswith((b'\n', b'\r')) else record + b'\n' for record in records)
+
+        return [(row[field_indices[DATE_FIELD]][:10],
+                 row[field_indices[area_field]] if area_field is not None else None,
+                 tuple(int(float(row[field_indices[field]] or 0)) for field in MEASURE_FIELDS.values()))
+                for row in csv.reader(io.StringIO(content.decode(), newline=''))]
+
+    return [(daily_data[DATE_FIELD][:10],
+             daily_data[area_field] if area_field is not None else None,
+             tuple(daily_data[field] or 0 for field in MEASURE_FIELDS.values()))
+            for daily_data in json.loads(b'[' + b','.join(records) + b']')]
+
+
+def get_area_trends(rows, area, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER):
+    """
+    Get the trend of the daily variation of each measure of an area
+
+    Parameters
+    ----------
+    rows : list of tuple
+        Parsed records (see parse_records)
+    area : str
+        Area name (None if the dataset has no area field)
+
+    Returns
+    ----------
+    numpy.datetime64
+        Date of the first trend sample (None if the area hasn't been found)
+    numpy.ndarray
+        (len(MEASURE_FIELDS), days) trends
+    """
+    area_rows = [row for row in rows if row[1] == area]
+
+    if len(area_rows) == 0:
+        return None, np.empty((len(MEASURE_FIELDS), 0), dtype=np.float32)
+
+    dates = np.array([row[0] for row in area_rows], dtype='datetime64[D]')
+    values = np.array([row[2] for row in area_rows], dtype=np.int64)
+
+    order = np.argsort(dates, kind='stable')
+    dates = dates[order]
+    variations = np.diff(values[order], axis=0)
+
+    trends = np.array([get_trend(variation, window, smoother) for variation in variations.T], dtype=np.float32)
+
+    return dates[1 + trend_offset(window, smoother)] if trends.shape[1] > 0 else None, trends
+
+
+def compute_vintages(commits, dataset, area_list, source=JSON_SOURCE, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER, data_directory=DATA_DIRECTORY):
+    """
+    Compute the trends of consecutive versions of the dataset
+
+    Blobs are read straight from the object store, nothing is checked out.
+    Records that didn't change since the previous version are not parsed again.
+    This function is executed by the vintage processes
+
+    Parameters
+    ----------
+    commits : list of str
+        Consecutive commits, oldest first
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    area_list : list of str
+        Areas (None if the dataset has no area field)
+
+    Returns
+    ----------
+    list of dict
+        For each commit, the trends of each area (see get_area_trends) and "last_date", the date of the last record
+    int
+        Number of parsed records
+    int
+        Number of records
+    """
+    import git
+
+    g = git.cmd.Git(data_directory)
+    path = get_data_file_path(dataset, '', source).replace(os.sep, '/')
+
+    vintages = []
+    n_parsed_records = 0
+    n_records = 0
+
+    previous_header = None
+    previous_rows = {}
+
+    for commit in commits:
+        _, _, _, blob = g.get_object_data(commit + ':' + path)
+
+        header, records = split_records(blob, source)
+
+        # columns may have moved
+        if header != previous_header:
+            previous_rows = {}
+
+        changed_records = [record for record in records if record not in previous_rows]
+        rows = dict(zip(changed_records, parse_records(changed_records, header, dataset, source)))
+        rows = [previous_rows[record] if record in previous_rows else rows[record] for record in records]
+
+        n_parsed_records += len(changed_records)
+        n_records += len(records)
+
+        vintage = {area: get_area_trends(rows, area, window, smoother) for area in area_list or [None]}
+        vintage["last_date"] = max(np.datetime64(row[0], 'D') for row in rows)
+        vintages.append(vintage)
+
+        previous_header = header
+        previous_rows = dict(zip(records, rows))
+
+    g.clear_cache()
+
+    return vintages, n_parsed_records, n_records
+
+
+def check_vintages(commits, dataset, area_list, source=JSON_SOURCE, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER, data_directory=DATA_DIRECTORY):
+    """
+    Check that reusing the records unchanged since the previous version leads to the same trends as parsing every version from scratch (see compute_vintages)
+
+    Versions whose trends differ are printed
+
+    Returns
+    ----------
+    bool
+        True if the trends of every version are the same
+    """
+    vintages, _, _ = compute_vintages(commits, dataset, area_list, source, window, smoother, data_directory)
+
+    is_passed = True
+
+    for commit, vintage in zip(commits, vintages):
+        [full_vintage], _, _ = compute_vintages([commit], dataset, area_list, source, window, smoother, data_directory)
+
+        for area in area_list or [None]:
+            if vintage[area][0] != full_vintage[area][0] or not np.array_equal(vintage[area][1], full_vintage[area][1], equal_nan=True):
+                print(f"The trends of {area or NATIONAL_AREA} in version {commit[:7]} differ from the ones of the version parsed from scratch")
+                is_passed = False
+
+        if vintage["last_date"] != full_vintage["last_date"]:
+            print(f"The last date of version {commit[:7]} differs from the one of the version parsed from scratch")
+            is_passed = False
+
+    return is_passed
+
+
+def compute_vintage_trends(commits, dataset, area_list=None, source=JSON_SOURCE, window=TREND_WINDOW, smoother=LINEAR_SMOOTHER, n_jobs=None, data_directory=DATA_DIRECTORY):
+    """
+    Compute the trends of every version of the dataset
+
+    Commits are split into consecutive chunks, each chunk is processed by one process (see compute_vintages)
+
+    Parameters
+    ----------
+    commits : list of str
+        Commits, oldest first (see get_history)
+    dataset : str
+        Dataset name (e.g. NATIONAL_DATASET)
+    area_list : list of str
+        Areas (None if the dataset has no area field)
+    n_jobs : int
+        Number of processes (default to number of CPUs)
+
+    Returns
+    ----------
+    numpy.ndarray
+        (commits, areas, len(MEASURE_FIELDS), days) trends, on the same day axis (NaN where a version has no trend)
+    numpy.ndarray
+        (days,) datetime64[D], the day axis
+    numpy.ndarray
+        (commits,) datetime64[D], date of the last record of each version
+    float
+        Fraction of records parsed
+    """
+    n_jobs = min(n_jobs or os.cpu_count(), len(commits))
+    chunks = [commits[chunk_index*len(commits)//n_jobs:(chunk_index+1)*len(commits)//n_jobs] for chunk_index in range(n_jobs)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(compute_vintages, chunks, *[[argument]*n_jobs for argument in (dataset, area_list, source, window, smoother, data_directory)]))
+
+    vintages = [vintage for chunk_vintages, _, _ in results for vintage in chunk_vintages]
+    n_parsed_records = sum(chunk_n_parsed_records for _, chunk_n_parsed_records, _ in results)
+    n_records = sum(chunk_n_records for _, _, chunk_n_records in results)
+
+    areas = area_list or [None]
+    first_dates = [vintage[area][0] for vintage in vintages for area in areas if vintage[area][0] is not None]
+    last_dates = [vintage[area][0] + vintage[area][1].shape[1] - 1 for vintage in vintages for area in areas if vintage[area][0] is not None]
+
+    if len(first_dates) == 0:
+        raise ValueError("No trend available for " + ', '.join(area or NATIONAL_AREA for area in areas))
+
+    dates = np.arange(min(first_dates), max(last_dates) + 1, dtype='datetime64[D]')
+    trends = np.full((len(vintages), len(areas), len(MEASURE_FIELDS), len(dates)), np.nan, dtype=np.float32)
+
+    for commit_index, vintage in enumerate(vintages):
+        for area_index, area in enumerate(areas):
+            first_date, area_trends = vintage[area]
+            if first_date is not None:
+                first_index = int((first_date - dates[0]).astype(np.int64))
+                trends[commit_index, area_index, :, first_index:first_index+area_trends.shape[1]] = area_trends
+
+    return trends, dates, np.array([vintage["last_date"] for vintage in vintages], dtype='datetime64[D]'), n_parsed_records/max(n_records, 1)
+
+
+def get_revisions(trends, dates, last_dates, max_age=MAX_REVISION_AGE):
+    """
+    Get the revisions of the trends
+
+    The revision of a trend sample is its difference from the latest version. Revisions are grouped by age of the sample: days between the sample and the last record of the version
+
+    Parameters
+    ----------
+    trends : numpy.ndarray
+        (commits, areas, measures, days) trends (see compute_vintage_trends)
+    dates : numpy.ndarray
+        Day axis
+    last_dates : numpy.ndarray
+        Date of the last record of each version
+    max_age : int
+        Maximum age [days]
+
+    Returns
+    ----------
+    numpy.ndarray
+        (areas, measures, max_age+1) mean absolute revision for each age (NaN if no sample has that age)
+    """
+    revisions = np.abs(trends[:-1] - trends[-1])
+
+    # (commits, days) age of each sample
+    ages = (last_dates[:-1, np.newaxis] - dates[np.newaxis, :]).astype(np.int64)
+
+    mean_revisions = np.full(trends.shape[1:3] + (max_age + 1,), np.nan)
+
+    with np.errstate(invalid='ignore'):
+        for age in range(max_age + 1):
+            age_revisions = revisions.transpose(1, 2, 0, 3)[..., ages == age]
+            if age_revisions.shape[-1] > 0:
+                is_available = np.isfinite(age_revisions)
+                mean_revisions[..., age] = np.where(is_available, age_revisions, 0).sum(axis=-1)/is_available.sum(axis=-1)
+
+    return mean_revisions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compute how the trends of Italian COVID-19 data changed across revisions of the data')
+    parser.add_argument('regions', nargs='*', help='regions to analyse (default to national data)')
+    parser.add_argument('--commits', type=int, default=N_COMMITS, help='number of versions of the data file to walk (default to %(default)s)')
+    parser.add_argument('--deepen', action='store_true', help='fetch the history needed if the repository is shallow')
+    parser.add_argument('--source', choices=SOURCES, default=JSON_SOURCE, help='format of the data files to parse (default to %(default)s)')
+    parser.add_argument('--smoother', choices=SMOOTHERS.keys(), default=LINEAR_SMOOTHER, help='smoother used to evaluate the trend (default to %(default)s)')
+    parser.add_argument('--trend-window', type=int, default=TREND_WINDOW, help='number of days of the trend window (default to %(default)s)')
+    parser.add_argument('--max-age', type=int, default=MAX_REVISION_AGE, help='maximum age of the revised days (default to %(default)s)')
+    parser.add_argument('--jobs', type=int, help='number of processes (default to number of CPUs)')
+    parser.add_argument('--data-directory', default=DATA_DIRECTORY, help='path of the Civil Protection Department repository (default to %(default)s)')
+    parser.add_argument('--output', default=VINTAGE_FILE_PATH, help='file the trends of every version are saved to (default to %(default)s)')
+    parser.add_argument('--check', action='store_true', help='check that the trends computed reusing unchanged records are the same as parsing every version from scratch')
+    args = parser.parse_args()
+
+    try:
+        check_window(args.trend_window, args.smoother)
+    except ValueError as error:
+        parser.error("--trend-window: " + str(error))
+
+    dataset = REGIONAL_DATASET if len(args.regions) > 0 else NATIONAL_DATASET
+    area_list = args.regions if len(args.regions) > 0 else None
+
+    if args.deepen:
+        deepen_history(args.commits, args.data_directory)
+
+    start_time = time.perf_counter()
+
+    commits = get_history(dataset, args.commits, args.source, args.data_directory)
+
+    if len(commits) < 2:
+        print(f"{len(commits)} versions of {dataset} data found, at least 2 are needed (use --deepen on a shallow repository)")
+        exit(1)
+
+    if args.check:
+        is_passed = check_vintages(commits, dataset, area_list, args.source, args.trend_window, args.smoother, args.data_directory)
+        print(f"The trends of {len(commits)} versions are the same as parsing each version from scratch!" if is_passed else "Some trends differ")
+        exit(0 if is_passed else 1)
+
+    trends, dates, last_dates, parsed_fraction = compute_vintage_trends(commits, dataset, area_list, args.source, args.trend_window, args.smoother, args.jobs, args.data_directory)
+
+    print(f"{len(commits)} versions of {dataset} data analysed in {time.perf_counter() - start_time:.3f} s, {100*parsed_fraction:.1f}% of the records parsed")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    np.savez(args.output, trends=trends, dates=dates, last_dates=last_dates, commits=np.array(commits), areas=np.array(area_list or [NATIONAL_AREA]), measures=np.array(list(MEASURE_FIELDS.keys())))
+
+    print("Trends of every version saved to " + args.output)
+
+    # mean absolute revision of the trend by age of the day
+    mean_revisions = get_revisions(trends, dates, last_dates, args.max_age)
+
+    for area_index, area in enumerate(area_list or [NATIONAL_AREA]):
+        print(f"\n{area}: mean absolute revision of the trend by age of the day [days]")
+        print(f"{'measure':30}" + ''.join(f"{age:>9}" for age in range(args.max_age + 1)))
+
+        for measure_index, measure in enumerate(MEASURE_FIELDS.keys()):
+            print(f"{measure:30}" + ''.join(f"{revision:9.2f}" if np.isfinite(revision) else f"{'-':>9}" for revision in mean_revisions[area_index, measure_index]))
+
+    exit(0)